@@ -0,0 +1,259 @@
+import argparse
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+from OutputBackend import INT_COLUMNS, FLOAT_COLUMNS, _import_pyarrow
+from Instrumentation import default_metrics, configure_logging, LOG_LEVELS
+from WebCrawlerX import COMMUNICATION_INDEX_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+# 每行追加的派生指标：(列名, 分子的列, 分母的列)，分母为0或缺失时结果为空
+RATIO_COLUMNS = (
+    ('点赞率', ('点赞数',), '播放量'),
+    ('投币率', ('投币数',), '播放量'),
+    ('收藏率', ('收藏数',), '播放量'),
+    ('分享率', ('分享数',), '播放量'),
+    ('互动率', ('点赞数', '投币数', '收藏数', '分享数', '评论数', '弹幕数'), '播放量'),
+    ('播放粉丝比', ('播放量',), 'UP主粉丝数'),
+)
+# 按UP主与分类汇总时累加的列
+SUM_COLUMNS = ['播放量', '点赞数', '投币数', '收藏数', '分享数', '评论数', '弹幕数']
+# 逐行结果中的列，按BV号与原数据对应，不重复写出标题、简介等原有的列
+DERIVED_COLUMNS = ['BV号', '传播效果指数'] + [name for name, _, _ in RATIO_COLUMNS]
+# 分类排行中保留的列
+RANKING_COLUMNS = ['视频分类标签', 'BV号', '视频标题', 'UP主名称', '播放量', '传播效果指数']
+
+def safe_ratio(numerator, denominator):
+    """
+    逐元素相除，分母为0、负数或缺失时结果为NaN，不产生inf与警告
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.full(numerator.shape, np.nan), where=denominator > 0)
+
+def communication_index(frame, weights=None):
+    """
+    批量计算传播效果指数，与WebCrawlerX.compute_communication_index的结果一致
+    加权和为0时记为0，任一统计值缺失时为NaN
+    :param frame: 含权重中各列的DataFrame
+    :param weights: 列名到权重的映射，默认为COMMUNICATION_INDEX_WEIGHTS，修改公式时只需传入新的权重
+    :return: numpy数组
+    """
+    weights = weights or COMMUNICATION_INDEX_WEIGHTS
+    total = np.zeros(len(frame))
+    for column, weight in weights.items():
+        total += weight * frame[column].to_numpy(dtype=np.float64, na_value=np.nan)
+    result = np.log(np.where(total > 0, total, 1.0))
+    result[np.isnan(total)] = np.nan
+    return result
+
+def add_derived_columns(frame, weights=None):
+    """
+    重新计算传播效果指数并追加各项比率，原地修改并返回frame
+    """
+    for column in SUM_COLUMNS + ['UP主粉丝数']:
+        if column in frame and not pd.api.types.is_numeric_dtype(frame[column]):
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    frame['传播效果指数'] = communication_index(frame, weights)
+    for name, numerators, denominator in RATIO_COLUMNS:
+        numerator = frame[list(numerators)].sum(axis=1, min_count=len(numerators))
+        frame[name] = safe_ratio(numerator, frame[denominator])
+    return frame
+
+def iter_video_chunks(path, chunk_size=100000):
+    """
+    分块读取视频基本信息，内存占用只与chunk_size有关
+    :param path: WebCrawlerX输出的csv文件，或parquet/arrow输出目录
+    :param chunk_size: 每块的行数
+    :return: 生成器，产出pandas.DataFrame
+    """
+    if os.path.isdir(path):
+        _import_pyarrow()
+        import pyarrow.dataset as ds
+        files = sorted(os.listdir(path))
+        fmt = 'ipc' if files and all(name.endswith('.arrow') for name in files) else 'parquet'
+        for batch in ds.dataset(path, format=fmt).to_batches(batch_size=chunk_size):
+            if batch.num_rows:
+                yield batch.to_pandas()
+        return
+    # 统计列由add_derived_columns统一转为数值，文本列保持字符串，避免BV号、标题等被推断为数字
+    numeric = set(INT_COLUMNS) | set(FLOAT_COLUMNS)
+    header = pd.read_csv(path, nrows=0).columns
+    dtype = {column: 'string' for column in header if column not in numeric}
+    yield from pd.read_csv(path, chunksize=chunk_size, dtype=dtype)
+
+class TableWriter:
+    """
+    逐块写出DataFrame，按扩展名写为csv或单个parquet文件
+    安装了pyarrow时csv也由pyarrow写出，浮点列的格式化比pandas.to_csv快一个数量级
+    """
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        try:
+            self.pa = _import_pyarrow()
+            import pyarrow.csv
+        except ImportError:
+            if self.parquet:
+                raise
+            self.pa = None
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+
+    def write(self, frame):
+        if self.pa is None:
+            frame.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False,
+                         encoding='utf-8')
+            self.rows += len(frame)
+            return
+        table = self.pa.Table.from_pandas(frame, preserve_index=False)
+        if self.writer is None:
+            self.schema = table.schema
+            if self.parquet:
+                self.writer = self.pa.parquet.ParquetWriter(self.path, self.schema, compression='zstd')
+            else:
+                self.writer = self.pa.csv.CSVWriter(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+        self.rows += len(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def _partial_groups(frame, key, extra):
+    # 一块数据按key分组的部分汇总，可与其他块的部分汇总再次相加
+    columns = {f'总{column}': (column, 'sum') for column in SUM_COLUMNS}
+    columns.update(视频数=('BV号', 'size'), 指数总和=('传播效果指数', 'sum'), 指数个数=('传播效果指数', 'count'))
+    columns.update(extra)
+    return frame.groupby(key, sort=False, dropna=True).agg(**columns)
+
+def _combine(partial, new, last_columns, max_columns):
+    if partial is None:
+        return new
+    combined = pd.concat([partial, new])
+    grouped = combined.groupby(level=0, sort=False)
+    result = grouped.sum(numeric_only=True)
+    for column in last_columns:
+        result[column] = grouped[column].last()
+    for column in max_columns:
+        result[column] = grouped[column].max()
+    return result
+
+def _finish_groups(groups, rank_column='总播放量'):
+    # 由累加结果计算平均值与比率，并按rank_column排名
+    groups = groups.copy()
+    groups['平均播放量'] = safe_ratio(groups['总播放量'], groups['视频数'])
+    groups['点赞率'] = safe_ratio(groups['总点赞数'], groups['总播放量'])
+    groups['投币率'] = safe_ratio(groups['总投币数'], groups['总播放量'])
+    groups['收藏率'] = safe_ratio(groups['总收藏数'], groups['总播放量'])
+    groups['平均传播效果指数'] = safe_ratio(groups['指数总和'], groups['指数个数'])
+    groups = groups.drop(columns=['指数总和', '指数个数'])
+    groups['排名'] = groups[rank_column].rank(method='min', ascending=False).astype('int64')
+    groups = groups.sort_values('排名').reset_index()
+    # 排名与分组的列在前
+    first = ['排名', groups.columns[0]]
+    first += [column for column in ('UP主名称', 'UP主粉丝数', '视频数') if column in groups]
+    return groups[first + [column for column in groups.columns if column not in first]]
+
+def analyze(source, output=None, uploaders=None, categories=None, rankings=None, chunk_size=100000, top_n=100,
+            weights=None):
+    """
+    分块读取视频基本信息，批量重新计算传播效果指数与各项比率，并按UP主与分类汇总，不需要重新爬取
+    :param source: csv文件或parquet/arrow输出目录
+    :param output: 逐行结果(BV号、传播效果指数与各项比率)的输出文件，.csv或.parquet，为None时不输出
+    :param uploaders: UP主汇总的输出文件
+    :param categories: 分类汇总的输出文件
+    :param rankings: 各分类内传播效果指数前top_n的视频的输出文件
+    :param chunk_size: 每块的行数
+    :param top_n: 每个分类保留的视频数
+    :param weights: 传播效果指数的权重，默认为COMMUNICATION_INDEX_WEIGHTS
+    :return: 各输出的行数
+    """
+    writer = TableWriter(output) if output else None
+    up_groups = tag_groups = top = None
+    rows = 0
+    try:
+        for chunk in iter_video_chunks(source, chunk_size):
+            with default_metrics.span('analytics_chunk'):
+                add_derived_columns(chunk, weights)
+                if writer is not None:
+                    writer.write(chunk[DERIVED_COLUMNS])
+                if uploaders:
+                    up_groups = _combine(up_groups, _partial_groups(chunk, 'UP主ID', {
+                        'UP主名称': ('UP主名称', 'last'), 'UP主粉丝数': ('UP主粉丝数', 'max')}),
+                        ['UP主名称'], ['UP主粉丝数'])
+                if categories:
+                    tag_groups = _combine(tag_groups, _partial_groups(chunk, '视频分类标签', {}), [], [])
+                if rankings:
+                    candidates = chunk.loc[chunk['传播效果指数'].notna(), RANKING_COLUMNS]
+                    candidates = candidates if top is None else pd.concat([top, candidates], ignore_index=True)
+                    top = (candidates.sort_values('传播效果指数', ascending=False, kind='stable')
+                           .groupby('视频分类标签', sort=False, observed=True).head(top_n))
+            rows += len(chunk)
+            logger.info('已处理%s行', rows)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    counts = {'videos': rows}
+    if uploaders:
+        result = _finish_groups(up_groups) if up_groups is not None else pd.DataFrame()
+        _write_table(result, uploaders)
+        counts['uploaders'] = len(result)
+    if categories:
+        result = _finish_groups(tag_groups) if tag_groups is not None else pd.DataFrame()
+        _write_table(result, categories)
+        counts['categories'] = len(result)
+    if rankings:
+        if top is None:
+            result = pd.DataFrame(columns=['分类内排名'] + RANKING_COLUMNS)
+        else:
+            result = top.sort_values(['视频分类标签', '传播效果指数'], ascending=[True, False], kind='stable')
+            result.insert(1, '分类内排名', result.groupby('视频分类标签', sort=False, observed=True).cumcount() + 1)
+        _write_table(result, rankings)
+        counts['rankings'] = len(result)
+    return counts
+
+def _write_table(frame, path):
+    writer = TableWriter(path)
+    try:
+        writer.write(frame)
+    finally:
+        writer.close()
+
+def main(argv=None):
+    # 命令行入口：对已爬取的数据重新计算指标，不发出任何网络请求
+    parser = argparse.ArgumentParser(description='批量计算传播效果指数、互动比率，以及UP主与分类的汇总和排行')
+    parser.add_argument('source', nargs='?', default='视频基本信息.csv',
+                        help='WebCrawlerX输出的csv文件，或parquet/arrow输出目录')
+    parser.add_argument('-o', '--output', default='视频指标.csv', help='逐行结果的输出文件，.csv或.parquet，为空时不输出')
+    parser.add_argument('--uploaders', default='UP主统计.csv', help='UP主汇总的输出文件，为空时不输出')
+    parser.add_argument('--categories', default='分类统计.csv', help='分类汇总的输出文件，为空时不输出')
+    parser.add_argument('--rankings', default='分类排行.csv', help='各分类内排行的输出文件，为空时不输出')
+    parser.add_argument('--top', type=int, default=100, help='每个分类排行中保留的视频数')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='每次读取的行数')
+    parser.add_argument('--weight', action='append', default=[], metavar='列名=权重',
+                        help='修改传播效果指数中某一列的权重，如--weight 播放量=0.6，可多次指定')
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='info', help='日志详细程度')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    weights = dict(COMMUNICATION_INDEX_WEIGHTS)
+    for item in args.weight:
+        name, _, value = item.partition('=')
+        if name not in weights:
+            parser.error(f'未知的列：{name}，可选{list(weights)}')
+        weights[name] = float(value)
+    counts = analyze(args.source, output=args.output or None, uploaders=args.uploaders or None,
+                     categories=args.categories or None, rankings=args.rankings or None,
+                     chunk_size=args.chunk_size, top_n=args.top, weights=weights)
+    print(f'处理完成：{counts}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
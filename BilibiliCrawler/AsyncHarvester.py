@@ -0,0 +1,112 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from RateLimiter import default_limiter
+from ResponseCache import default_cache
+from WebCrawlerX import VIEW_API_URL, CARD_API_URL, HEADERS, fetch_api_json, parse_video_info, parse_user_info
+
+class AsyncHarvester:
+    """
+    并发获取视频基本信息(view接口)与UP主信息(card接口)的异步爬取引擎
+    返回的info_dict与user_info_dict结构与get_video_info/get_user_info一致
+    """
+    def __init__(self, concurrency=8, limiter=None, cache=None, headers=None, timeout=10):
+        """
+        :param concurrency: 同时处理的BV号数量上限
+        :param limiter: 所有请求共享的限速器，默认使用RateLimiter.default_limiter
+        :param cache: 接口响应缓存，默认使用ResponseCache.default_cache
+        :param headers: 请求头，默认使用WebCrawlerX中的HEADERS
+        :param timeout: 单次请求的超时时间(秒)
+        """
+        self.concurrency = concurrency
+        self.limiter = limiter or default_limiter
+        self.cache = cache or default_cache
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers if headers is not None else HEADERS)
+        # 连接池大小与并发数保持一致，复用TCP连接
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = None
+
+    async def _get_json(self, url):
+        """
+        在线程池中经过缓存与限速器请求json接口，不阻塞事件循环
+        :param url: 请求的url
+        :return: 解析后的json字典
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: fetch_api_json(url, cache=self.cache, session=self.session, limiter=self.limiter,
+                                   timeout=self.timeout))
+
+    async def fetch_video_info(self, bv_id):
+        """
+        :param bv_id: BV号
+        :return: info_dict
+        """
+        video_info_json = await self._get_json(VIEW_API_URL.format(bvid=bv_id))
+        return parse_video_info(video_info_json)
+
+    async def fetch_user_info(self, mid):
+        """
+        :param mid: UP主的ID
+        :return: user_info_dict
+        """
+        up_info_json = await self._get_json(CARD_API_URL.format(mid=mid))
+        return parse_user_info(up_info_json)
+
+    async def harvest_one(self, bv_id):
+        """
+        获取单个BV号的视频信息及其UP主信息
+        :param bv_id: BV号
+        :return: (info_dict, user_info_dict)
+        """
+        video_info = await self.fetch_video_info(bv_id)
+        user_info = await self.fetch_user_info(video_info['mid'])
+        return video_info, user_info
+
+    async def harvest(self, bv_ids):
+        """
+        并发获取一批BV号的信息，按完成顺序逐个产出结果，同时在途的任务不超过concurrency个
+        :param bv_ids: BV号的可迭代对象
+        :return: 异步生成器，产出(index, bv_id, info_dict, user_info_dict, error)
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        async def run_one(index, bv_id):
+            try:
+                video_info, user_info = await self.harvest_one(bv_id)
+                return index, bv_id, video_info, user_info, None
+            except Exception as e:
+                return index, bv_id, None, None, e
+
+        try:
+            pending = set()
+            for index, bv_id in enumerate(bv_ids):
+                pending.add(asyncio.ensure_future(run_one(index, bv_id)))
+                if len(pending) >= self.concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def run(self, bv_ids, on_result):
+        """
+        同步入口，在新的事件循环中执行harvest，每得到一个结果就调用一次on_result
+        :param bv_ids: BV号的可迭代对象
+        :param on_result: 回调函数，参数为(index, bv_id, info_dict, user_info_dict, error)
+        """
+        async def consume():
+            async for result in self.harvest(bv_ids):
+                on_result(*result)
+
+        asyncio.run(consume())
@@ -1,19 +1,53 @@
+import time
 import tkinter as tk
 from tkinter import ttk, scrolledtext
-from barcode import Code128
-from barcode.writer import ImageWriter
-from PIL import Image, ImageTk
-import io
+from PIL import ImageTk
+from BarcodeRenderer import BarcodeRenderer
+
+# 每个条码的高度与条码之间的间距
+BARCODE_HEIGHT = 100
+ROW_GAP = 10
+ROW_STEP = BARCODE_HEIGHT + ROW_GAP
+# 可见区域上下额外保留的行数，滚动时提前生成即将出现的条码
+OVERSCAN_ROWS = 3
+# 在主线程中取出已生成条码的间隔(毫秒)与每次最多显示的个数，避免界面卡顿
+RENDER_POLL_INTERVAL = 30
+RENDER_BATCH = 50
+# 自动滚动每帧的间隔(毫秒)，以及滚动速度为1时每秒滚动的像素数(约每秒一个条码)
+SCROLL_FRAME_INTERVAL = 16
+PIXELS_PER_SPEED = ROW_STEP
 
 class BarcodeGeneratorApp:
     def __init__(self, root):
         self.root = root
         self.root.resizable(False, False)
         self.root.title("条码生成器")
-        self.barcode_images = []
+        # 全部条码的内容；画布上只保留可见区域附近的行，rows为行号到(画布元素, 图片)的映射
+        self.lines = []
+        self.rows = {}
+        # 已移出可见区域、可以重复使用的图片元素
+        self.free_items = []
+        self.window = (0, -1)
+        self.canvas_width = 0
+        self.content_height = 0
         self.scrolling = False
+        # 自动滚动的位置(像素，可以不是整数)、速度(像素/秒)与上一帧的时间
+        self.scroll_offset = 0.0
+        self.scroll_speed = PIXELS_PER_SPEED
+        self.last_frame = 0.0
+        self.scroll_job = None
+        self.shown_count = None
+        # 条码在后台线程中生成，界面只负责显示；已移出可见区域的行不再生成
+        self.renderer = BarcodeRenderer(wanted=lambda index: self.window[0] <= index <= self.window[1])
+        self.polling = False
         self.configure_style()
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        """关闭窗口时放弃尚未生成的条码"""
+        self.renderer.shutdown()
+        self.root.destroy()
 
     def configure_style(self):
         """配置应用程序的风格和主题"""
@@ -25,17 +59,26 @@ class BarcodeGeneratorApp:
 
     def update_barcode_count(self):
         """更新界面上的条码计数"""
-        total = len(self.barcode_images)
-        top_barcode_index = self.canvas_barcodes.yview()[0] * total
+        total = len(self.lines)
+        top_barcode_index = min(total - 1, int(self.canvas_barcodes.canvasy(0) // ROW_STEP)) if total else -1
+        # 数值不变时不更新标签，自动滚动时每帧都会调用
+        if self.shown_count == (total, top_barcode_index):
+            return
+        self.shown_count = (total, top_barcode_index)
         self.total_barcodes_label.config(text=f"总条码数量：{total}")
-        self.current_barcode_label.config(text=f"当前条码：{int(top_barcode_index) + 1 if self.barcode_images else 0}")
+        self.current_barcode_label.config(text=f"当前条码：{top_barcode_index + 1}")
 
     def clear_barcodes(self):
         """清除画布上的所有条码"""
         if self.scrolling:
             return  # 如果正在滚动，则不执行任何操作
+        self.renderer.cancel()
         self.canvas_barcodes.delete("all")
-        self.barcode_images.clear()
+        self.lines = []
+        self.rows.clear()
+        self.free_items.clear()
+        self.window = (0, -1)
+        self.content_height = 0
         self.canvas_barcodes.config(scrollregion=(0, 0, self.canvas_barcodes.winfo_width(), 110))
         self.update_barcode_count()
 
@@ -45,24 +88,86 @@ class BarcodeGeneratorApp:
             return  # 如果正在滚动，则不执行任何操作
         content = self.text_area.get('1.0', tk.END).strip()
         self.clear_barcodes()
-        y_position = 10
         if content:  # 检查文本域是否为空
-            canvas_width = self.canvas_barcodes.winfo_width() if self.canvas_barcodes.winfo_width() > 0 else self.root.winfo_width()
-            lines = content.split('\n')
-            for line in lines:
-                if line:
-                    barcode_instance = Code128(line, writer=ImageWriter())
-                    fp = io.BytesIO()
-                    barcode_instance.write(fp)
-                    fp.seek(0)
-                    image = Image.open(fp)
-                    image = image.resize((canvas_width, 100), Image.Resampling.LANCZOS)
-                    photo = ImageTk.PhotoImage(image)
-                    self.barcode_images.append((barcode_instance, fp, photo))
-                    self.canvas_barcodes.create_image(10, y_position, image=photo, anchor='nw')
-                    y_position += 100 + 10
-            self.canvas_barcodes.config(scrollregion=(0, 0, canvas_width, y_position))
-            self.update_barcode_count()
+            self.canvas_width = self.canvas_barcodes.winfo_width() if self.canvas_barcodes.winfo_width() > 0 else self.root.winfo_width()
+            self.lines = [line for line in content.split('\n') if line]
+            # 每行的位置是固定的，滚动区域按总行数计算，只生成并显示可见区域附近的行
+            self.content_height = ROW_GAP + len(self.lines) * ROW_STEP
+            self.canvas_barcodes.config(scrollregion=(0, 0, self.canvas_width, self.content_height))
+            self.canvas_barcodes.yview_moveto(0)
+            self.refresh_visible_rows()
+
+    def visible_range(self):
+        """可见区域及其上下OVERSCAN_ROWS行的行号范围"""
+        top = self.canvas_barcodes.canvasy(0)
+        bottom = self.canvas_barcodes.canvasy(max(self.canvas_barcodes.winfo_height(), 1))
+        first = max(0, int((top - ROW_GAP) // ROW_STEP) - OVERSCAN_ROWS)
+        last = min(len(self.lines) - 1, int(bottom // ROW_STEP) + OVERSCAN_ROWS)
+        return first, last
+
+    def on_view_changed(self, first, last):
+        """画布的可见区域改变时(滚轮、滚动条、自动滚动)更新滚动条并刷新可见行"""
+        self.scrollbar.set(first, last)
+        if self.lines:
+            self.refresh_visible_rows()
+
+    def refresh_visible_rows(self):
+        """移除已离开可见区域的行，显示新进入的行，缓存中没有的交给后台生成"""
+        first, last = self.window = self.visible_range()
+        for index in [index for index in self.rows if not first <= index <= last]:
+            self.release_row(index)
+        missing = []
+        for index in range(first, last + 1):
+            if index in self.rows:
+                continue
+            image = self.renderer.cached(self.lines[index], self.canvas_width, BARCODE_HEIGHT)
+            if image is not None:
+                self.place_row(index, image)
+            else:
+                missing.append((index, self.lines[index]))
+        if missing:
+            self.renderer.request(missing, self.canvas_width, BARCODE_HEIGHT)
+            if not self.polling:
+                self.polling = True
+                self.root.after(RENDER_POLL_INTERVAL, self.show_rendered_barcodes)
+        self.update_barcode_count()
+
+    def place_row(self, index, image, error=None):
+        """把一行条码放到画布上，优先重复使用已移出可见区域的图片元素"""
+        y_position = ROW_GAP + index * ROW_STEP
+        if error is not None:
+            # 含有Code128不支持的字符等情况，只在该行显示错误信息
+            item = self.canvas_barcodes.create_text(10, y_position, text=f"第{index + 1}行无法生成条码：{error}", anchor='nw')
+            self.rows[index] = (item, None)
+            return
+        photo = ImageTk.PhotoImage(image)
+        if self.free_items:
+            item = self.free_items.pop()
+            self.canvas_barcodes.coords(item, 10, y_position)
+            self.canvas_barcodes.itemconfig(item, image=photo, state='normal')
+        else:
+            item = self.canvas_barcodes.create_image(10, y_position, image=photo, anchor='nw')
+        self.rows[index] = (item, photo)
+
+    def release_row(self, index):
+        """移除一行条码并释放其图片，图片元素留待重复使用"""
+        item, photo = self.rows.pop(index)
+        if photo is None:
+            self.canvas_barcodes.delete(item)
+        else:
+            self.canvas_barcodes.itemconfig(item, image='', state='hidden')
+            self.free_items.append(item)
+
+    def show_rendered_barcodes(self):
+        """在主线程中把后台生成好的条码放到画布上，已离开可见区域的行不再显示"""
+        first, last = self.window
+        for index, image, error in self.renderer.drain(RENDER_BATCH):
+            if first <= index <= last and index not in self.rows:
+                self.place_row(index, image, error)
+        if self.renderer.has_pending():
+            self.root.after(RENDER_POLL_INTERVAL, self.show_rendered_barcodes)
+        else:
+            self.polling = False
 
     def create_widgets(self):
         """创建GUI组件"""
@@ -103,9 +208,9 @@ class BarcodeGeneratorApp:
         self.canvas_barcodes.bind("<MouseWheel>", self.on_mousewheel)
         self.canvas_barcodes.config(scrollregion=(0, 0, 0, 110))
 
-        scrollbar = ttk.Scrollbar(frame_barcodes, orient="vertical", command=self.canvas_barcodes.yview)
-        self.canvas_barcodes.configure(yscrollcommand=scrollbar.set)
-        scrollbar.pack(side="right", fill="y")
+        self.scrollbar = ttk.Scrollbar(frame_barcodes, orient="vertical", command=self.canvas_barcodes.yview)
+        self.canvas_barcodes.configure(yscrollcommand=self.on_view_changed)
+        self.scrollbar.pack(side="right", fill="y")
 
         # 创建滚动速度控制组件
         scroll_speed_frame = ttk.Frame(self.root)
@@ -121,31 +226,47 @@ class BarcodeGeneratorApp:
         scroll_speed_label = ttk.Label(scroll_speed_frame, text="滚动速度:")
         scroll_speed_label.pack(side=tk.LEFT, padx=(0, 2))
 
-        self.scroll_speed_entry = ttk.Entry(scroll_speed_frame, width=5)
+        # 滚动速度在输入改变时解析一次，滚动时不再读取输入框
+        self.scroll_speed_var = tk.StringVar(value="1")  # 默认滚动速度
+        self.scroll_speed_var.trace_add('write', self.on_scroll_speed_changed)
+        self.scroll_speed_entry = ttk.Entry(scroll_speed_frame, width=5, textvariable=self.scroll_speed_var)
         self.scroll_speed_entry.pack(side=tk.LEFT, padx=(0, 10))
-        self.scroll_speed_entry.insert(0, "1")  # 默认滚动速度
 
         # 绑定事件
         self.root.bind('<space>', self.on_space_press)
 
+    def on_scroll_speed_changed(self, *args):
+        """滚动速度输入改变时更新速度，输入无效时保持原来的速度"""
+        try:
+            speed = float(self.scroll_speed_var.get())
+        except ValueError:
+            return
+        if speed > 0:
+            self.scroll_speed = speed * PIXELS_PER_SPEED
+
     def scroll_barcodes(self):
-        """滚动条码图像，并在到达底部时停止"""
-        if self.scrolling:
-            # 获取当前滚动位置和画布可滚动区域的高度
-            scroll_position = self.canvas_barcodes.yview()[1]
-            canvas_scrollable_height = self.canvas_barcodes.bbox("all")[3] if self.canvas_barcodes.bbox("all") else 0
-
-            # 检查是否已经滚动到底部
-            if scroll_position >= 1.0 or (self.canvas_barcodes.winfo_height() >= canvas_scrollable_height):
-                # 到达底部，停止滚动
-                self.toggle_scrolling()
-                return
-
-            # 如果没有到达底部，继续滚动
-            scroll_step = int(self.scroll_speed_entry.get()) if self.scroll_speed_entry.get().isdigit() else 1
-            self.canvas_barcodes.yview_scroll(scroll_step, "units")
-            self.root.after(100, self.scroll_barcodes)  # 继续在100毫秒后调用自身
-            self.update_barcode_count()
+        """按实际经过的时间平滑滚动条码，并在到达底部时停止，每帧的开销与条码数量无关"""
+        if not self.scrolling:
+            return
+        now = time.monotonic()
+        elapsed = now - self.last_frame
+        self.last_frame = now
+        # 用户用滚轮或滚动条改变了位置时，从新的位置继续
+        top = self.canvas_barcodes.canvasy(0)
+        if abs(top - int(self.scroll_offset)) > 1:
+            self.scroll_offset = top
+
+        # 内容高度在生成或清除条码时确定，这里不需要遍历画布上的元素
+        max_offset = self.content_height - self.canvas_barcodes.winfo_height()
+        if max_offset <= 0 or self.scroll_offset >= max_offset:
+            # 到达底部，停止滚动
+            self.toggle_scrolling()
+            return
+        self.scroll_offset = min(max_offset, self.scroll_offset + self.scroll_speed * elapsed)
+        self.canvas_barcodes.yview_moveto(self.scroll_offset / self.content_height)
+        # 扣除本帧的耗时，使帧间隔保持稳定
+        delay = SCROLL_FRAME_INTERVAL - int((time.monotonic() - now) * 1000)
+        self.scroll_job = self.root.after(max(1, delay), self.scroll_barcodes)
 
     def on_mousewheel(self, event):
         """处理鼠标滚轮事件以滚动画布"""
@@ -161,10 +282,15 @@ class BarcodeGeneratorApp:
         self.scrolling = not self.scrolling
         if self.scrolling:
             self.scroll_button.config(text="停止滚动")
+            self.scroll_offset = self.canvas_barcodes.canvasy(0)
+            self.last_frame = time.monotonic()
             self.scroll_barcodes()  # 开始滚动
         else:
             self.scroll_button.config(text="开始滚动")
-            # 滚动停止，无需调用self.scroll_barcodes()
+            # 取消已安排的下一帧，避免很快再次开始滚动时有两个滚动循环
+            if self.scroll_job is not None:
+                self.root.after_cancel(self.scroll_job)
+                self.scroll_job = None
 
     def on_space_press(self, event):
         """当用户按下空格键时，切换滚动状态"""
@@ -0,0 +1,273 @@
+import argparse
+import functools
+import io
+import itertools
+import os
+import re
+import sys
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from Code128Raster import render_code128
+
+FORMATS = ('pdf', 'png', 'zip')
+
+def read_lines(path):
+    """
+    逐行读取要生成条码的内容，不一次性载入内存
+    :param path: 文件路径，为'-'时读取标准输入
+    :return: 生成器，产出(行号, 内容)，跳过空行，行号从1开始
+    """
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if line:
+                yield number, line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def render_sheet(labels, columns, rows, width, height, gap):
+    """
+    在子进程中把一页的条码排成columns列rows行
+    :param labels: (行号, 内容)列表，最多columns*rows个
+    :return: (页面的灰度像素数组, [(行号, 错误信息)])
+    """
+    sheet = np.full((rows * (height + gap) + gap, columns * (width + gap) + gap), 255, dtype=np.uint8)
+    errors = []
+    for i, (number, text) in enumerate(labels):
+        try:
+            label = np.asarray(render_code128(text, width, height))
+        except Exception as e:
+            errors.append((number, str(e)))
+            continue
+        top = gap + (i // columns) * (height + gap)
+        left = gap + (i % columns) * (width + gap)
+        sheet[top:top + height, left:left + width] = label
+    return sheet, errors
+
+def render_png_sheet(labels, columns, rows, width, height, gap):
+    # PNG在子进程中编码，主进程只负责写文件
+    sheet, errors = render_sheet(labels, columns, rows, width, height, gap)
+    fp = io.BytesIO()
+    Image.fromarray(sheet, mode='L').save(fp, format='PNG')
+    return fp.getvalue(), errors
+
+def render_pdf_sheet(labels, columns, rows, width, height, gap):
+    # 转为每像素1位的黑白图并在子进程中压缩，主进程只负责写入PDF
+    sheet, errors = render_sheet(labels, columns, rows, width, height, gap)
+    bits = np.packbits(sheet >= 128, axis=1)
+    return (sheet.shape[1], sheet.shape[0], zlib.compress(bits.tobytes(), 6)), errors
+
+def render_png_labels(labels, width, height):
+    """
+    :return: ([(行号, 内容, PNG字节)], [(行号, 错误信息)])
+    """
+    images = []
+    errors = []
+    for number, text in labels:
+        try:
+            image = render_code128(text, width, height)
+        except Exception as e:
+            errors.append((number, str(e)))
+            continue
+        fp = io.BytesIO()
+        image.save(fp, format='PNG')
+        images.append((number, text, fp.getvalue()))
+    return images, errors
+
+def ordered_map(executor, fn, batches, window):
+    """
+    按顺序产出每批的结果，同时最多有window批在处理中，输入再多内存占用也有上限
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append(executor.submit(fn, batch))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+class PdfSink:
+    """
+    每页渲染完成后立即写入PDF文件，只在内存中保留各对象的偏移量
+    PIL追加页面时每次都要重新解析整个文件，页数多时越来越慢，这里直接按顺序写出PDF对象
+    """
+    # 1号对象为Catalog，2号对象为Pages，在文件末尾写出
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, path, dpi):
+        self.dpi = dpi
+        self.f = open(path, 'wb')
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    @property
+    def pages(self):
+        return len(self.page_ids)
+
+    def _object(self, body, stream=None, obj_id=None):
+        if obj_id is None:
+            obj_id = self.next_id
+            self.next_id += 1
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(f'{obj_id} 0 obj\n'.encode('ascii') + body.encode('ascii'))
+        if stream is not None:
+            self.f.write(b'\nstream\n' + stream + b'\nendstream')
+        self.f.write(b'\nendobj\n')
+        return obj_id
+
+    def write(self, result):
+        (width, height, data), errors = result
+        page_width, page_height = width * 72 / self.dpi, height * 72 / self.dpi
+        image_id = self._object(f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                                f'/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode '
+                                f'/Length {len(data)} >>', data)
+        content = f'q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q'.encode('ascii')
+        content_id = self._object(f'<< /Length {len(content)} >>', content)
+        self.page_ids.append(self._object(
+            f'<< /Type /Page /Parent {self.PAGES_ID} 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>'))
+        return errors
+
+    def close(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        self._object(f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>', obj_id=self.PAGES_ID)
+        self._object(f'<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>', obj_id=self.CATALOG_ID)
+        xref_offset = self.f.tell()
+        lines = [f'xref\n0 {self.next_id}\n', '0000000000 65535 f \n']
+        lines.extend(f'{self.offsets[obj_id]:010d} 00000 n \n' for obj_id in range(1, self.next_id))
+        lines.append(f'trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R >>\n'
+                     f'startxref\n{xref_offset}\n%%EOF\n')
+        self.f.write(''.join(lines).encode('ascii'))
+        self.f.close()
+
+class PngSheetSink:
+    # 每页保存为一个PNG文件
+    def __init__(self, path, dpi):
+        self.path = path
+        self.pages = 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, result):
+        data, errors = result
+        self.pages += 1
+        with open(os.path.join(self.path, f'sheet-{self.pages:05d}.png'), 'wb') as f:
+            f.write(data)
+        return errors
+
+    def close(self):
+        pass
+
+class ZipSink:
+    # 每个条码一个PNG文件，PNG已经压缩，zip中直接存储
+    def __init__(self, path, dpi):
+        self.zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        self.pages = 0
+
+    def write(self, result):
+        images, errors = result
+        for number, text, data in images:
+            name = re.sub(r'[\\/*?:"<>|\s]', '_', text)[:64]
+            self.zip.writestr(f'{number:06d}_{name}.png', data)
+        self.pages += 1
+        return errors
+
+    def close(self):
+        self.zip.close()
+
+SINKS = {'pdf': PdfSink, 'png': PngSheetSink, 'zip': ZipSink}
+
+def export(lines, output, fmt, width=600, height=100, gap=10, columns=3, rows=10, dpi=300, workers=None,
+           labels_per_task=256):
+    """
+    多进程生成条码并边生成边写入
+    :param lines: (行号, 内容)的可迭代对象
+    :param output: 输出路径，png格式时为保存各页的目录
+    :param fmt: 'pdf'、'png'或'zip'
+    :param width: 每个条码的宽度(像素)
+    :param height: 每个条码的高度(像素)
+    :param gap: 条码之间的间距(像素)
+    :param columns: 每页的列数
+    :param rows: 每页的行数
+    :param dpi: PDF的分辨率
+    :param workers: 进程数，默认为CPU核数
+    :param labels_per_task: zip格式时每个任务生成的条码数
+    :return: (条码总数, 页数或zip格式时的批数, [(行号, 错误信息)])
+    """
+    if fmt not in SINKS:
+        raise ValueError(f'不支持的输出格式：{fmt}')
+    workers = workers or os.cpu_count() or 1
+    if fmt == 'zip':
+        task, size = functools.partial(render_png_labels, width=width, height=height), labels_per_task
+    elif fmt == 'png':
+        task = functools.partial(render_png_sheet, columns=columns, rows=rows, width=width, height=height, gap=gap)
+        size = columns * rows
+    else:
+        task = functools.partial(render_pdf_sheet, columns=columns, rows=rows, width=width, height=height, gap=gap)
+        size = columns * rows
+
+    sink = SINKS[fmt](output, dpi)
+    errors = []
+    count = [0]
+
+    def counted():
+        for item in lines:
+            count[0] += 1
+            yield item
+
+    batches = batched(counted(), size)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for batch_result in ordered_map(executor, task, batches, workers * 2):
+                errors.extend(sink.write(batch_result))
+                if sink.pages % 50 == 0:
+                    print(f'已写入{count[0]}个条码', file=sys.stderr)
+        finally:
+            sink.close()
+    return count[0], sink.pages, errors
+
+def main(argv=None):
+    # 命令行入口，不需要图形界面即可批量导出条码
+    parser = argparse.ArgumentParser(description='批量生成Code128条码并导出为PDF、PNG页面或PNG图片的zip')
+    parser.add_argument('input', nargs='?', default='-', help='每行一个条码内容的文本文件，默认读取标准输入')
+    parser.add_argument('-o', '--output', required=True, help='输出文件，png格式时为保存各页的目录')
+    parser.add_argument('-f', '--format', choices=FORMATS, help='输出格式，默认按输出文件的扩展名判断')
+    parser.add_argument('--width', type=int, default=600, help='每个条码的宽度(像素)')
+    parser.add_argument('--height', type=int, default=100, help='每个条码的高度(像素)')
+    parser.add_argument('--gap', type=int, default=10, help='条码之间的间距(像素)')
+    parser.add_argument('--columns', type=int, default=3, help='每页的列数')
+    parser.add_argument('--rows', type=int, default=10, help='每页的行数')
+    parser.add_argument('--dpi', type=int, default=300, help='PDF的分辨率')
+    parser.add_argument('-w', '--workers', type=int, help='进程数，默认为CPU核数')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower() or 'png'
+    if fmt not in FORMATS:
+        parser.error(f'无法从输出路径判断格式，请用--format指定：{args.output}')
+    count, pages, errors = export(read_lines(args.input), args.output, fmt, width=args.width, height=args.height,
+                                  gap=args.gap, columns=args.columns, rows=args.rows, dpi=args.dpi,
+                                  workers=args.workers)
+    unit = '批' if fmt == 'zip' else '页'
+    print(f'导出完成：{args.output}，共{count}个条码，{pages}{unit}', file=sys.stderr)
+    for number, error in errors:
+        print(f'第{number}行无法生成条码：{error}', file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
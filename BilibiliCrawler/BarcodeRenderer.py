@@ -0,0 +1,143 @@
+import io
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from barcode import Code128
+from barcode.writer import ImageWriter
+from PIL import Image
+from Code128Raster import render_code128
+
+def render_barcode(text, width, height=100):
+    """
+    用python-barcode的ImageWriter生成一个条码图片，需要PNG编码、解码与缩放，比render_code128慢得多
+    :param text: 条码内容
+    :param width: 图片宽度
+    :param height: 图片高度
+    :return: PIL图片
+    """
+    fp = io.BytesIO()
+    Code128(text, writer=ImageWriter()).write(fp)
+    fp.seek(0)
+    # 条码只有黑白两色，转为灰度图后缓存占用的内存只有RGB的三分之一
+    image = Image.open(fp).convert('L')
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+class BarcodeRenderer:
+    """
+    在后台线程池中生成条码图片，生成好的图片放入结果队列，由界面在主线程中取出显示
+    按(内容, 宽, 高)缓存最近生成的图片，修改少数几行后重新生成时只需生成改动的行
+    """
+    def __init__(self, workers=4, cache_size=500, render=render_code128, wanted=None):
+        """
+        :param workers: 生成条码的线程数
+        :param cache_size: 缓存的图片数量
+        :param render: 生成单个条码图片的函数，参数为(内容, 宽, 高)，默认直接绘制，不经过PNG
+        :param wanted: 判断某行是否仍需要的函数，参数为行号，开始生成前返回False的行直接跳过
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.cache_size = cache_size
+        self.render = render
+        self.wanted = wanted
+        self.cache = OrderedDict()
+        # 已提交、尚未完成的(批次, 行号)，避免同一行重复提交
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.results = queue.Queue()
+        # 每次重新生成时加1，旧批次中尚未完成的任务直接丢弃
+        self.generation = 0
+
+    def cached(self, text, width, height=100):
+        """
+        :return: 缓存中的图片，没有时返回None
+        """
+        key = (text, width, height)
+        with self.lock:
+            image = self.cache.get(key)
+            if image is not None:
+                self.cache.move_to_end(key)
+            return image
+
+    def _store(self, key, image):
+        with self.lock:
+            self.cache[key] = image
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def cancel(self):
+        # 放弃尚未完成的任务，并清空结果队列中旧批次的结果
+        with self.lock:
+            self.generation += 1
+            self.pending.clear()
+        while True:
+            try:
+                self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def submit(self, items, width, height=100):
+        """
+        开始新一批生成，之前未完成的批次被取消
+        缓存中已有的图片立即放入结果队列，其余的交给线程池
+        :param items: (行号, 内容)的可迭代对象
+        :return: 本批次的编号，与结果队列中的编号相同
+        """
+        self.cancel()
+        return self.request(items, width, height)
+
+    def request(self, items, width, height=100):
+        """
+        在当前批次中追加要生成的行，已在生成中的行不重复提交
+        :param items: (行号, 内容)的可迭代对象
+        :return: 当前批次的编号
+        """
+        generation = self.generation
+        for index, text in items:
+            image = self.cached(text, width, height)
+            if image is not None:
+                self.results.put((generation, index, image, None))
+                continue
+            with self.lock:
+                if (generation, index) in self.pending:
+                    continue
+                self.pending.add((generation, index))
+            self.executor.submit(self._render_one, generation, index, text, width, height)
+        return generation
+
+    def has_pending(self):
+        return bool(self.pending) or not self.results.empty()
+
+    def _render_one(self, generation, index, text, width, height):
+        try:
+            if generation != self.generation or (self.wanted is not None and not self.wanted(index)):
+                return
+            try:
+                image = self.render(text, width, height)
+            except Exception as e:
+                self.results.put((generation, index, None, e))
+                return
+            self._store((text, width, height), image)
+            self.results.put((generation, index, image, None))
+        finally:
+            with self.lock:
+                self.pending.discard((generation, index))
+
+    def drain(self, limit=50):
+        """
+        取出当前批次已完成的结果，最多limit个，不阻塞
+        :return: (行号, 图片, 错误)的列表
+        """
+        done = []
+        while len(done) < limit:
+            try:
+                generation, index, image, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                done.append((index, image, error))
+        return done
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from MockBilibili import MockBilibiliServer, make_bvid
+
+# 被替换为本地模拟服务器地址的域名
+REAL_HOSTS = ('https://api.bilibili.com', 'https://www.bilibili.com')
+# 需要替换地址、限速器与缓存的模块，Pipeline与AsyncHarvester中的地址是从WebCrawlerX导入的副本，需要单独替换
+PATCHED_MODULES = ('WebCrawlerX', 'Pipeline', 'AsyncHarvester', 'SearchCollector', 'SpiderNet', 'StatsTracker',
+                   'RateLimiter')
+
+def percentile(values, q):
+    """
+    :param values: 已排序的数值列表
+    :param q: 0到100之间的百分位
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+def peak_rss_mb():
+    # 当前进程的峰值内存，Windows上没有resource模块时返回None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux上单位为KB，macOS上为字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def patch_environment(base_url, workdir, options):
+    """
+    在子进程中把各模块的接口地址指向模拟服务器，并换用独立的限速器与缓存
+    """
+    import importlib
+    from RateLimiter import AdaptiveRateLimiter
+    from ResponseCache import ResponseCache
+    rate = options['rate']
+    limiter = AdaptiveRateLimiter(host_rates={'127.0.0.1': (rate, max(1, int(rate)))}, backoff=options['backoff'])
+    cache = ResponseCache(path=os.path.join(workdir, 'api_cache.sqlite'))
+    for name in PATCHED_MODULES:
+        module = importlib.import_module(name)
+        for attr, value in list(vars(module).items()):
+            if attr.endswith('_URL') and isinstance(value, str):
+                for host in REAL_HOSTS:
+                    if value.startswith(host):
+                        setattr(module, attr, base_url + value[len(host):])
+        if hasattr(module, 'default_limiter'):
+            module.default_limiter = limiter
+        if hasattr(module, 'default_cache'):
+            module.default_cache = cache
+    return limiter, cache
+
+@contextlib.contextmanager
+def record_requests(latencies):
+    # 记录每个HTTP请求从发出到收到响应头的耗时
+    import requests
+    original = requests.Session.send
+
+    def timed_send(session, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(session, request, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    requests.Session.send = timed_send
+    try:
+        yield
+    finally:
+        requests.Session.send = original
+
+def bvids(options):
+    return [make_bvid('benchmark', 0, i) for i in range(options['videos'])]
+
+def bench_video_info(base_url, options):
+    from WebCrawlerX import get_video_info
+    failed = 0
+    for bvid in bvids(options):
+        try:
+            get_video_info(bvid)
+        except Exception:
+            failed += 1
+    return options['videos'], 'videos', failed
+
+def bench_user_info(base_url, options):
+    from WebCrawlerX import get_user_info
+    failed = 0
+    for mid in range(1, options['videos'] + 1):
+        try:
+            get_user_info(mid)
+        except Exception:
+            failed += 1
+    return options['videos'], 'users', failed
+
+def bench_async_harvest(base_url, options):
+    from AsyncHarvester import AsyncHarvester
+    results = {'done': 0, 'failed': 0}
+
+    def on_result(index, bv_id, info, user_info, error):
+        results['failed' if error else 'done'] += 1
+
+    AsyncHarvester(concurrency=options['concurrency']).run(bvids(options), on_result)
+    return results['done'] + results['failed'], 'videos', results['failed']
+
+def bench_search(base_url, options):
+    from SearchCollector import SearchCollector
+    collector = SearchCollector(concurrency=options['concurrency'])
+    found = 0
+    for i in range(options['keywords']):
+        found += len(collector.collect(f'关键词{i}'))
+    return found, 'bvids', 0
+
+def bench_pipeline(base_url, options):
+    from OutputBackend import open_video_output
+    from Pipeline import CrawlPipeline
+    from WebCrawlerX import VIDEO_INFO_FIELDNAMES
+    keywords = [f'关键词{i}' for i in range(options['keywords'])]
+    with open_video_output('视频基本信息', VIDEO_INFO_FIELDNAMES, fmt='csv') as sink:
+        counts = CrawlPipeline(keywords, sink, detail_workers=options['concurrency'],
+                               user_workers=max(1, options['concurrency'] // 2)).run()
+    return counts['written'] + counts['failed'], 'videos', counts['failed']
+
+def bench_stats_refresh(base_url, options):
+    # 登记全部视频后再对全部视频采集一轮统计数据，耗时包括两者
+    from StatsTracker import StatsTracker
+    tracker = StatsTracker('video_stats.sqlite', concurrency=options['concurrency'])
+    tracker.track(bvids(options))
+    counts = tracker.refresh(force=True)
+    tracker.close()
+    return counts['polled'] + counts['failed'], 'videos', counts['failed']
+
+def bench_play_info(base_url, options):
+    from SpiderNet import BilibiliVideoAudio
+    failed = 0
+    for bvid in bvids(options)[:options['pages']]:
+        try:
+            BilibiliVideoAudio(bvid).get_play_streams()
+        except Exception:
+            failed += 1
+    return options['pages'], 'pages', failed
+
+def _bench_download(base_url, options, segments):
+    from SpiderNet import BilibiliVideoAudio
+    total = 0
+    failed = 0
+    for i in range(options['downloads']):
+        path = f'video-{i}.mp4'
+        try:
+            BilibiliVideoAudio(f'BV{i}', segments=segments).download_file(f'{base_url}/media/video.m4s', path, None)
+            total += os.path.getsize(path)
+        except Exception:
+            failed += 1
+        if os.path.isfile(path):
+            os.remove(path)
+    return total / (1024 * 1024), 'MB', failed
+
+def bench_download_range(base_url, options):
+    return _bench_download(base_url, options, segments=4)
+
+def bench_download_single(base_url, options):
+    return _bench_download(base_url, options, segments=1)
+
+BENCHMARKS = {
+    'video_info': bench_video_info,
+    'user_info': bench_user_info,
+    'async_harvest': bench_async_harvest,
+    'search': bench_search,
+    'pipeline': bench_pipeline,
+    'stats_refresh': bench_stats_refresh,
+    'play_info': bench_play_info,
+    'download_range': bench_download_range,
+    'download_single': bench_download_single,
+}
+
+def run_benchmark(name, base_url, options):
+    """
+    在独立的子进程中运行一项测试，峰值内存只包含这一项
+    :return: 结果字典
+    """
+    from Instrumentation import configure_logging, default_metrics
+    # 只保留错误日志，逐行的输出不计入测试，也不干扰结果表格
+    configure_logging('error', stream=sys.stderr)
+    latencies = []
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            _, cache = patch_environment(base_url, workdir, options)
+            with record_requests(latencies), open(os.devnull, 'w', encoding='utf-8') as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                ops, unit, failed = BENCHMARKS[name](base_url, options)
+                elapsed = time.perf_counter() - start
+            cache.close()
+        finally:
+            os.chdir(cwd)
+    latencies.sort()
+    return {
+        'name': name, 'ops': round(ops, 2), 'unit': unit, 'failed': failed, 'seconds': round(elapsed, 3),
+        'throughput': round(ops / elapsed, 2) if elapsed > 0 else None, 'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None,
+        # 各计数器按名称汇总，如重试次数、缓存命中数与下载字节数，只写入JSON结果
+        'counters': counter_totals(default_metrics.snapshot()),
+    }
+
+def counter_totals(snapshot):
+    totals = {}
+    for counter in snapshot['counters']:
+        totals[counter['name']] = totals.get(counter['name'], 0) + counter['value']
+    return totals
+
+def format_table(results):
+    header = ('测试', '数量', '耗时(s)', '吞吐量', 'p50(ms)', 'p99(ms)', '请求数', '失败', '峰值内存(MB)')
+    rows = [header]
+    for result in results:
+        if 'error' in result:
+            rows.append((result['name'], '出错：' + result['error'], '', '', '', '', '', '', ''))
+            continue
+        rows.append((result['name'], f"{result['ops']}{result['unit']}", result['seconds'],
+                     f"{result['throughput']}{result['unit']}/s", result['p50_ms'], result['p99_ms'],
+                     result['requests'], result['failed'], result['peak_rss_mb']))
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(str(value).ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+def main(argv=None):
+    # 命令行入口：启动模拟服务器，逐项运行测试并输出结果
+    parser = argparse.ArgumentParser(description='使用本地模拟服务器离线测试爬虫与下载器的性能')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS), help='只运行指定的测试，可多次指定')
+    parser.add_argument('--videos', type=int, default=200, help='view/card接口测试的视频数')
+    parser.add_argument('--keywords', type=int, default=2, help='搜索与流水线测试的关键词数')
+    parser.add_argument('--search-pages', type=int, default=5, help='每个关键词的搜索结果页数')
+    parser.add_argument('--pages', type=int, default=50, help='解析视频页面的次数')
+    parser.add_argument('--downloads', type=int, default=3, help='下载测试的文件数')
+    parser.add_argument('--media-size', type=int, default=32, help='模拟视频文件的大小(MB)')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发测试的并发数')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟服务器每个请求的延迟(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回HTTP 500的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回HTTP 412的比例')
+    parser.add_argument('--rate', type=float, default=0, help='限速器对模拟服务器的初始速率，0为不限速')
+    parser.add_argument('--backoff', type=float, default=2.0, help='被限流时的首次退避秒数')
+    parser.add_argument('--json', help='把结果以JSON行追加到该文件，便于与之前的结果比较')
+    args = parser.parse_args(argv)
+
+    options = {key: getattr(args, key) for key in ('videos', 'keywords', 'pages', 'downloads', 'concurrency',
+                                                   'rate', 'backoff')}
+    names = args.only or list(BENCHMARKS)
+    results = []
+    with MockBilibiliServer(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                            media_size=args.media_size * 1024 * 1024, num_pages=args.search_pages) as server:
+        context = multiprocessing.get_context('spawn')
+        for name in names:
+            print(f'正在运行：{name}', file=sys.stderr)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                try:
+                    results.append(executor.submit(run_benchmark, name, server.base_url, options).result())
+                except Exception as e:
+                    results.append({'name': name, 'error': str(e)})
+        server_counts = dict(server.counts)
+    print(format_table(results))
+    print(f"模拟服务器：限流{server_counts.get('throttled', 0)}次，错误{server_counts.get('errors', 0)}次")
+    if args.json:
+        with open(args.json, 'a', encoding='utf-8') as f:
+            record = {'time': datetime.now().isoformat(timespec='seconds'), 'options': vars(args), 'results': results}
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return 1 if any('error' in result for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
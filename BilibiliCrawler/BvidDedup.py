@@ -0,0 +1,94 @@
+import csv
+import sqlite3
+import threading
+
+class SeenSet:
+    """
+    基于SQLite的持久化BV号集合，用于跨文件、跨运行去重
+    数据在磁盘上，内存占用不随BV号数量增长
+    """
+    def __init__(self, path='seen_bvid.sqlite'):
+        """
+        :param path: SQLite文件路径，为':memory:'时只在本次运行中去重
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS seen (bvid TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.conn.commit()
+
+    def add(self, bvid):
+        """
+        :param bvid: BV号
+        :return: 是否为新的BV号
+        """
+        with self.lock:
+            cursor = self.conn.execute('INSERT OR IGNORE INTO seen (bvid) VALUES (?)', (str(bvid),))
+            self.conn.commit()
+            return cursor.rowcount == 1
+
+    def add_many(self, bvids):
+        """
+        批量加入BV号，只在一个事务中提交
+        :param bvids: BV号的可迭代对象
+        :return: 其中新的BV号列表，保持原有顺序
+        """
+        new = []
+        with self.lock:
+            for bvid in bvids:
+                cursor = self.conn.execute('INSERT OR IGNORE INTO seen (bvid) VALUES (?)', (str(bvid),))
+                if cursor.rowcount == 1:
+                    new.append(str(bvid))
+            self.conn.commit()
+        return new
+
+    def new_bvids(self, bvids):
+        """
+        只查询不写入，需要先把BV号写入文件再调用add_many记录时使用
+        :param bvids: BV号的可迭代对象
+        :return: 其中不在集合中的BV号列表，去除重复并保持原有顺序
+        """
+        new = []
+        pending = set()
+        with self.lock:
+            for bvid in map(str, bvids):
+                if bvid in pending:
+                    continue
+                if self.conn.execute('SELECT 1 FROM seen WHERE bvid = ?', (bvid,)).fetchone() is None:
+                    pending.add(bvid)
+                    new.append(bvid)
+        return new
+
+    def __contains__(self, bvid):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM seen WHERE bvid = ?', (str(bvid),)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def iter_bvids(filename, chunk_size=1000):
+    """
+    逐块读取BV号csv文件的第一列，不一次性载入内存
+    :param filename: 带表头的BV号csv文件
+    :param chunk_size: 每块的行数
+    :return: 生成器，产出BV号列表
+    """
+    with open(filename, encoding='utf-8', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)
+        chunk = []
+        for row in reader:
+            if row and row[0]:
+                chunk.append(row[0])
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
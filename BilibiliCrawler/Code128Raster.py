@@ -0,0 +1,139 @@
+from functools import lru_cache
+import numpy as np
+from barcode import Code128
+from barcode.writer import ImageWriter
+from PIL import Image, ImageDraw, ImageFont
+
+# 条码两侧空白区的模块数，与ImageWriter默认的6.5mm空白区(模块宽0.2mm)一致
+QUIET_ZONE_MODULES = 32
+# 条的高度占图片高度的比例，其余部分显示条码下方的文字
+BAR_HEIGHT_RATIO = 0.7
+# 与ImageWriter相同的字体
+FONT_PATH = ImageWriter().font_path
+
+@lru_cache(maxsize=16)
+def _font(size):
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+def module_pattern(text):
+    """
+    计算Code128编码(含起始符、校验符与终止符)的模块序列，不生成任何图片
+    :param text: 条码内容，含Code128不支持的字符时抛出异常
+    :return: 布尔数组，True为条(黑)，False为空(白)
+    """
+    return np.frombuffer(Code128(text).build()[0].encode('ascii'), dtype=np.uint8) == ord('1')
+
+def bar_row(pattern, width):
+    """
+    把模块序列按目标宽度排成一行像素，每个模块占整数个像素并居中，条宽一致便于扫码
+    宽度不足每模块一个像素时按最近邻取样
+    :return: 长度为width的uint8数组，0为条，255为空
+    """
+    padded = np.zeros(pattern.size + 2 * QUIET_ZONE_MODULES, dtype=bool)
+    padded[QUIET_ZONE_MODULES:QUIET_ZONE_MODULES + pattern.size] = pattern
+    module_px = width // padded.size
+    if module_px == 0:
+        bars = padded[(np.arange(width) * padded.size) // width]
+    else:
+        bars = np.zeros(width, dtype=bool)
+        offset = (width - module_px * padded.size) // 2
+        bars[offset:offset + module_px * padded.size] = np.repeat(padded, module_px)
+    return np.where(bars, 0, 255).astype(np.uint8)
+
+def _layout(height):
+    # 条码上边距、条高与文字字号
+    margin = max(1, height // 25)
+    bar_height = max(1, int(height * BAR_HEIGHT_RATIO) - margin)
+    font_size = max(6, height - margin - bar_height - 2 * margin)
+    return margin, bar_height, font_size
+
+def render_code128(text, width, height=100, show_text=True):
+    """
+    直接按目标大小绘制条码，不经过PNG编码、解码与缩放
+    :param text: 条码内容
+    :param width: 图片宽度
+    :param height: 图片高度
+    :param show_text: 是否在条码下方显示内容
+    :return: 灰度PIL图片
+    """
+    pixels = np.full((height, width), 255, dtype=np.uint8)
+    margin, bar_height, font_size = _layout(height)
+    pixels[margin:margin + bar_height] = bar_row(module_pattern(text), width)
+    image = Image.fromarray(pixels, mode='L')
+    if show_text:
+        ImageDraw.Draw(image).text((width / 2, margin * 2 + bar_height), text, fill=0, font=_font(font_size),
+                                   anchor='ma')
+    return image
+
+def module_matrix(texts):
+    """
+    一次计算多个条码含两侧空白区的模块矩阵
+    :param texts: 条码内容列表
+    :return: (布尔矩阵，每行一个条码并按最长的补齐, 每行的模块数, [(下标, 异常)])，无法编码的行全为空
+    """
+    encoded = []
+    errors = []
+    for i, text in enumerate(texts):
+        try:
+            encoded.append(Code128(text).build()[0])
+        except Exception as e:
+            errors.append((i, e))
+            encoded.append('')
+    lengths = np.fromiter((len(code) for code in encoded), dtype=np.int64, count=len(encoded))
+    counts = np.where(lengths > 0, lengths + 2 * QUIET_ZONE_MODULES, 0)
+    matrix = np.zeros((len(encoded), max(1, int(counts.max(initial=0)))), dtype=bool)
+    # 全部编码拼成一个数组后按(行, 列)一次写入矩阵
+    flat = np.frombuffer(''.join(encoded).encode('ascii'), dtype=np.uint8) == ord('1')
+    rows = np.repeat(np.arange(len(encoded)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    cols = np.arange(flat.size) - np.repeat(starts, lengths) + QUIET_ZONE_MODULES
+    matrix[rows, cols] = flat
+    return matrix, counts, errors
+
+def bar_rows(matrix, counts, width):
+    """
+    与bar_row相同的排列方式，由模块矩阵一次得到全部条码的一行像素
+    :return: (len(counts), width)的uint8数组，模块数为0的行全为空
+    """
+    x = np.arange(width)[None, :]
+    n = np.maximum(counts, 1)[:, None]
+    module_px = width // n
+    offset = (width - module_px * n) // 2
+    # 每像素一个以上模块的行按最近邻取样，其余行每个模块占module_px个像素并居中
+    index = np.where(module_px == 0, (x * n) // width, (x - offset) // np.maximum(module_px, 1))
+    inside = (index >= 0) & (index < n) & (counts[:, None] > 0)
+    bars = np.take_along_axis(matrix, np.clip(index, 0, matrix.shape[1] - 1), axis=1) & inside
+    return np.where(bars, 0, 255).astype(np.uint8)
+
+def render_strip(texts, width, height=100, gap=10, show_text=True):
+    """
+    把多个条码从上到下绘制到同一张图片中，全部条码的模块矩阵一次算出，按像素一次取样并写入数组，文字用一个ImageDraw绘制
+    :param texts: 条码内容列表
+    :param width: 图片宽度
+    :param height: 每个条码的高度
+    :param gap: 条码之间的间距
+    :param show_text: 是否在条码下方显示内容
+    :return: (灰度PIL图片, [(下标, 异常)])，无法编码的条码所在位置留空并显示错误信息
+    """
+    texts = list(texts)
+    step = height + gap
+    margin, bar_height, font_size = _layout(height)
+    matrix, counts, errors = module_matrix(texts)
+    # 按每个条码step行分块，条的部分整批广播写入，最后去掉末尾多出的间距
+    blocks = np.full((max(1, len(texts)), step, width), 255, dtype=np.uint8)
+    if texts:
+        blocks[:, margin:margin + bar_height] = bar_rows(matrix, counts, width)[:, None, :]
+    pixels = blocks.reshape(-1, width)[:max(1, len(texts) * step - gap)]
+    image = Image.fromarray(pixels, mode='L')
+    draw = ImageDraw.Draw(image)
+    failed = dict(errors)
+    font = _font(font_size)
+    for i, text in enumerate(texts):
+        if i in failed:
+            draw.text((10, i * step + margin), str(failed[i]), fill=0, font=_font(max(6, font_size // 2)))
+        elif show_text:
+            draw.text((width / 2, i * step + margin * 2 + bar_height), text, fill=0, font=font, anchor='ma')
+    return image, errors
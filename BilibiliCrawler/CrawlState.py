@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+class CrawlState:
+    """
+    基于SQLite的爬取进度记录，按BV号记录视频信息的爬取状态，按关键词与页码记录搜索进度
+    程序中断后重新运行时，只处理未完成的BV号与搜索页
+    """
+    def __init__(self, path='crawl_state.sqlite'):
+        """
+        :param path: SQLite文件路径
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS videos (bvid TEXT PRIMARY KEY, status TEXT NOT NULL, '
+                          'attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_status ON videos(status)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS search_pages (keyword TEXT NOT NULL, page INTEGER NOT NULL, '
+                          'status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL, '
+                          'PRIMARY KEY (keyword, page))')
+        self.conn.commit()
+
+    def add_videos(self, bvids):
+        """
+        登记待爬取的BV号，已登记过的BV号保持原有状态
+        :param bvids: BV号的可迭代对象
+        :return: 新登记的数量
+        """
+        now = time.time()
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany('INSERT OR IGNORE INTO videos (bvid, status, updated_at) VALUES (?, ?, ?)',
+                                  ((str(bvid), PENDING, now) for bvid in bvids))
+            self.conn.commit()
+            return self.conn.total_changes - before
+
+    def pending_videos(self, max_attempts=3):
+        """
+        :param max_attempts: 失败次数达到该值的BV号不再重试
+        :return: 未完成的BV号列表，按登记顺序排列
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT bvid FROM videos WHERE status != ? AND attempts < ? ORDER BY rowid',
+                                     (DONE, max_attempts)).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_done(self, bvids):
+        """
+        标记BV号已完成，应在对应的数据写入文件之后调用
+        :param bvids: BV号或BV号的列表
+        """
+        if isinstance(bvids, str):
+            bvids = [bvids]
+        now = time.time()
+        with self.lock:
+            self.conn.executemany('UPDATE videos SET status = ?, error = NULL, updated_at = ? WHERE bvid = ?',
+                                  ((DONE, now, str(bvid)) for bvid in bvids))
+            self.conn.commit()
+
+    def mark_failed(self, bvid, error):
+        """
+        标记BV号爬取失败，记录错误信息并累加尝试次数
+        """
+        with self.lock:
+            self.conn.execute('UPDATE videos SET status = ?, attempts = attempts + 1, error = ?, updated_at = ? '
+                              'WHERE bvid = ?', (FAILED, str(error), time.time(), str(bvid)))
+            self.conn.commit()
+
+    def done_pages(self, keyword):
+        """
+        :param keyword: 搜索关键词
+        :return: 该关键词已完成的页码集合
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT page FROM search_pages WHERE keyword = ? AND status = ?',
+                                     (keyword, DONE)).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_page_done(self, keyword, page):
+        """
+        标记搜索页已完成，应在该页的BV号写入文件之后调用
+        """
+        with self.lock:
+            self.conn.execute('INSERT INTO search_pages (keyword, page, status, updated_at) VALUES (?, ?, ?, ?) '
+                              'ON CONFLICT(keyword, page) DO UPDATE SET status = excluded.status, error = NULL, '
+                              'updated_at = excluded.updated_at', (keyword, page, DONE, time.time()))
+            self.conn.commit()
+
+    def mark_page_failed(self, keyword, page, error):
+        with self.lock:
+            self.conn.execute('INSERT INTO search_pages (keyword, page, status, attempts, error, updated_at) '
+                              'VALUES (?, ?, ?, 1, ?, ?) ON CONFLICT(keyword, page) DO UPDATE SET '
+                              'status = excluded.status, attempts = attempts + 1, error = excluded.error, '
+                              'updated_at = excluded.updated_at', (keyword, page, FAILED, str(error), time.time()))
+            self.conn.commit()
+
+    def summary(self):
+        """
+        :return: 各状态的BV号数量
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT status, COUNT(*) FROM videos GROUP BY status').fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,154 @@
+import argparse
+import sys
+from Instrumentation import LOG_LEVELS, EXPORT_FORMATS, configure_logging, MetricsExporter
+
+# 转交给各模块自己的命令行入口的子命令，参数原样传入对应模块的main
+DELEGATED_COMMANDS = {
+    'download': ('DownloadManager', '批量下载视频并合并音视频'),
+    'stats': ('StatsTracker', '增量跟踪视频的统计数据'),
+    'analyze': ('Analytics', '分块计算传播效果指数与各项比率'),
+    'barcodes': ('BarcodeExport', '批量导出条形码'),
+    'bench': ('Benchmark', '使用本地模拟服务器离线测试性能'),
+    'gui': ('SpiderNetGui', '启动视频下载器的图形界面'),
+}
+
+# 本模块只导入argparse与Instrumentation，各子命令用到的模块(requests、selenium、pandas、tkinter等)在执行时才导入，
+# 调度程序按关键词或按视频启动的短任务不必为用不到的依赖付出启动时间
+
+def read_bvids(bvids, inputs):
+    # 命令行中的BV号在前，之后依次为各csv文件第一列的BV号
+    from BvidDedup import iter_bvids
+    yield from bvids
+    for path in inputs:
+        for chunk in iter_bvids(path):
+            yield from chunk
+
+def open_state(path):
+    if not path:
+        return None
+    from CrawlState import CrawlState
+    return CrawlState(path)
+
+def run_search(args):
+    """
+    搜索关键词，每个关键词的BV号写入{关键词}BV号.csv，可选地合并去重为一个文件
+    """
+    from WebCrawlerX import spider_bvid, merge_bvid_files
+    state = open_state(args.state)
+    try:
+        for keyword in args.keywords:
+            spider_bvid(keyword, state=state, concurrency=args.concurrency)
+    finally:
+        if state is not None:
+            state.close()
+    if args.merge:
+        merge_bvid_files([f'{keyword}BV号.csv' for keyword in args.keywords], args.merge)
+    return 0
+
+def run_harvest(args):
+    """
+    并发获取一批BV号的视频信息与UP主信息，写入视频基本信息
+    """
+    from AsyncHarvester import AsyncHarvester
+    from OutputBackend import open_video_output
+    from WebCrawlerX import VIDEO_INFO_FIELDNAMES, build_video_row
+    state = open_state(args.state)
+    bvids = read_bvids(args.bvids, args.input)
+    on_flush = None
+    if state is not None:
+        # 登记后只处理未完成的BV号，每批写入文件后才标记为已完成
+        state.add_videos(bvids)
+        bvids = state.pending_videos()
+        on_flush = lambda rows: state.mark_done([row['BV号'] for row in rows])
+    counts = {'written': 0, 'failed': 0}
+    try:
+        with open_video_output(args.output, VIDEO_INFO_FIELDNAMES, fmt=args.format, on_flush=on_flush) as sink:
+            def on_result(index, bv_id, info, user_info, error):
+                if error is not None:
+                    counts['failed'] += 1
+                    if state is not None:
+                        state.mark_failed(bv_id, error)
+                    print(f'{bv_id}获取失败：{error}', file=sys.stderr)
+                    return
+                sink.writerow(build_video_row(info, user_info))
+                counts['written'] += 1
+
+            AsyncHarvester(concurrency=args.concurrency).run(bvids, on_result)
+    finally:
+        if state is not None:
+            state.close()
+    print(f"写入{counts['written']}个，失败{counts['failed']}个")
+    return 1 if counts['failed'] else 0
+
+def run_crawl(args):
+    """
+    搜索、视频信息、UP主信息、写入四个阶段同时进行的完整爬取，与WebCrawlerX直接运行时相同
+    """
+    from OutputBackend import open_video_output
+    from Pipeline import CrawlPipeline
+    from WebCrawlerX import VIDEO_INFO_FIELDNAMES
+    state = open_state(args.state)
+    on_flush = (lambda rows: state.mark_done([row['BV号'] for row in rows])) if state is not None else None
+    try:
+        with open_video_output(args.output, VIDEO_INFO_FIELDNAMES, fmt=args.format, on_flush=on_flush) as sink:
+            counts = CrawlPipeline(args.keywords, sink, state=state, detail_workers=args.concurrency,
+                                   user_workers=max(1, args.concurrency // 2)).run()
+    finally:
+        if state is not None:
+            state.close()
+    print(f'共发现{counts["found"]}个待爬取的BV号，写入{counts["written"]}个，失败{counts["failed"]}个')
+    return 1 if counts['failed'] else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='CrawlerCli', description='B站视频爬虫与下载器的命令行入口')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--log-level', choices=list(LOG_LEVELS), default='info', help='日志详细程度')
+    common.add_argument('--metrics-file', help='定期把请求数、缓存命中与各阶段耗时写入该文件')
+    common.add_argument('--metrics-format', choices=EXPORT_FORMATS, default='jsonl', help='指标文件的格式')
+    common.add_argument('--state', help='记录进度的SQLite文件，中断后重新运行只处理未完成的部分')
+    common.add_argument('-c', '--concurrency', type=int, default=8, help='并发数')
+
+    search = commands.add_parser('search', parents=[common], help='搜索关键词，获取BV号')
+    search.add_argument('keywords', nargs='+', help='搜索关键词')
+    search.add_argument('--merge', help='把各关键词的BV号合并去重后写入该文件，如BV号合并.csv')
+    search.set_defaults(run=run_search, concurrency=4)
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('-o', '--output', default='视频基本信息', help='输出路径，csv为文件名，parquet/arrow为目录名')
+    output.add_argument('-f', '--format', choices=('csv', 'parquet', 'arrow'), default='csv', help='输出格式')
+
+    harvest = commands.add_parser('harvest', parents=[common, output], help='获取BV号的视频信息与UP主信息')
+    harvest.add_argument('bvids', nargs='*', help='BV号')
+    harvest.add_argument('-i', '--input', action='append', default=[],
+                         help='第一列为BV号的csv文件，如BV号合并.csv，可多次指定')
+    harvest.set_defaults(run=run_harvest)
+
+    crawl = commands.add_parser('crawl', parents=[common, output], help='从搜索到写入的完整爬取')
+    crawl.add_argument('keywords', nargs='+', help='搜索关键词')
+    crawl.set_defaults(run=run_crawl)
+
+    for name, (module, description) in DELEGATED_COMMANDS.items():
+        commands.add_parser(name, help=f'{description}，参数见 {name} -h', add_help=False)
+    return parser
+
+def main(argv=None):
+    # 命令行入口：search/harvest/crawl在这里实现，其余子命令交给对应模块的main
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in DELEGATED_COMMANDS:
+        import importlib
+        module = importlib.import_module(DELEGATED_COMMANDS[argv[0]][0])
+        return module.main(argv[1:])
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    configure_logging(args.log_level)
+    with MetricsExporter(path=args.metrics_file, fmt=args.metrics_format):
+        return args.run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
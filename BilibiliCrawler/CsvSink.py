@@ -0,0 +1,134 @@
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from Instrumentation import default_metrics
+
+logger = logging.getLogger(__name__)
+
+class BufferedCsvWriter:
+    """
+    长期打开的csv写入器：在内存中缓存行，按行数或时间间隔批量写入
+    表头只在文件为空时写入一次，关闭时fsync落盘，可作为上下文管理器使用
+    """
+    def __init__(self, filename, fieldnames, batch_size=200, flush_interval=5.0, max_retries=50, retry_wait=3,
+                 on_flush=None):
+        """
+        :param filename: 写入的文件名称，不存在则创建
+        :param fieldnames: 表头
+        :param batch_size: 缓存的行数达到该值时写入文件
+        :param flush_interval: 距上次写入超过该秒数时，下一次写行会触发写入
+        :param max_retries: 遇到PermissionError时的最大重试次数
+        :param retry_wait: 每次重试前等待的秒数
+        :param on_flush: 每批行写入文件后调用的函数，参数为这批行的列表，可用于记录爬取进度
+        """
+        self.filename = filename
+        self.fieldnames = list(fieldnames)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.on_flush = on_flush
+        self.buffer = []
+        self.rows_written = 0
+        self.file = None
+        self.writer = None
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _retry(self, action, description):
+        # 文件被占用(如被Excel打开)时等待后重试
+        for retries in range(1, self.max_retries + 1):
+            try:
+                return action()
+            except PermissionError as e:
+                logger.warning('%s时，遇到权限错误Permission denied，文件可能被占用或无写入权限: %s', description, e)
+                logger.warning('等待%ss后重试，将会重试%s次... (尝试 %s/%s)', self.retry_wait, self.max_retries, retries,
+                               self.max_retries)
+                time.sleep(self.retry_wait)
+        raise PermissionError(f"{description}时遇到权限错误，且已达到最大重试次数{self.max_retries}次：{self.filename}")
+
+    def open(self):
+        """
+        以追加模式打开文件，文件为空时写入表头
+        """
+        if self.file is not None:
+            return self
+
+        def do_open():
+            return open(self.filename, mode='a', encoding='utf-8', newline='')
+
+        self.file = self._retry(do_open, '打开csv文件')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+        self.last_flush = time.monotonic()
+        return self
+
+    def writerow(self, row):
+        """
+        缓存一行数据，达到批量条件时写入文件
+        :param row: 以表头为键的字典
+        """
+        with self.lock:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _flush(self):
+        if self.file is None:
+            self.open()
+        if self.buffer:
+            rows = self.buffer
+            # 整批先序列化为一个字符串，只调用一次write；write成功后重试只需再次flush，不会重复写入部分行
+            text = io.StringIO()
+            csv.DictWriter(text, fieldnames=self.fieldnames).writerows(rows)
+            text = text.getvalue()
+            written = False
+
+            def do_write():
+                nonlocal written
+                if not written:
+                    self.file.write(text)
+                    written = True
+                self.file.flush()
+
+            with default_metrics.span('output_write', format='csv'):
+                self._retry(do_write, '将爬取到的数据写入csv')
+            self.rows_written += len(rows)
+            default_metrics.incr('rows_written', len(rows), format='csv')
+            self.buffer = []
+            if self.on_flush is not None:
+                self.on_flush(rows)
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        """
+        立即把缓存的行写入文件
+        """
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """
+        写入剩余的行，fsync落盘后关闭文件
+        """
+        with self.lock:
+            if self.buffer or self.file is not None:
+                self._flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+                self.writer = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
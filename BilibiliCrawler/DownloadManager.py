@@ -0,0 +1,295 @@
+import argparse
+import csv
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from SpiderNet import BilibiliVideoAudio
+from StreamSelector import StreamSelector, CODEC_IDS
+from TransferMeter import TransferMeter, format_size, format_eta
+from Instrumentation import default_metrics, configure_logging, MetricsExporter, LOG_LEVELS, EXPORT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+# 下载任务的状态
+QUEUED = '排队中'
+RESOLVING = '解析中'
+DOWNLOADING = '下载中'
+MERGING = '合并中'
+DONE = '已完成'
+FAILED = '失败'
+
+class DownloadJob:
+    """
+    单个BV号的下载任务，记录状态与进度，由下载线程更新，界面或命令行只读取
+    """
+    def __init__(self, bvid):
+        self.bvid = bvid
+        self.state = QUEUED
+        self.title = ''
+        self.downloaded = 0
+        self.total = 0
+        self.output_path = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.meter = TransferMeter()
+
+    def percent(self):
+        return int(self.downloaded * 100 / self.total) if self.total else 0
+
+    def update_progress(self, downloaded, total):
+        # 在下载线程中调用，只记录数值，不做任何输出
+        self.downloaded = downloaded
+        self.total = total
+        self.meter.update(downloaded, total)
+
+    def restart_progress(self):
+        # 下载重新开始或从.part文件继续时调用，速度与剩余时间只按此后新下载的字节计算
+        self.meter.reset()
+
+    def rate(self):
+        return self.meter.rate() if self.state == DOWNLOADING else 0.0
+
+    def eta(self):
+        return self.meter.eta() if self.state == DOWNLOADING else None
+
+def load_bvids(path):
+    """
+    从文件读取BV号，支持WebCrawlerX输出的BV号合并.csv(读取BV号列)与每行一个BV号的文本文件
+    :param path: 文件路径
+    :return: 去重后的BV号列表，保持原有顺序
+    """
+    bvids = []
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(f)
+            column = 'BV号' if 'BV号' in (reader.fieldnames or []) else reader.fieldnames[0]
+            bvids = [row[column].strip() for row in reader]
+        else:
+            for line in f:
+                bvids.extend(re.findall(r'BV[0-9A-Za-z]{10}', line))
+    return list(dict.fromkeys(bvid for bvid in bvids if bvid))
+
+def parse_bvids(text):
+    """
+    :param text: 输入的文本，BV号之间可用空格、逗号或换行分隔
+    :return: 其中的BV号列表
+    """
+    return list(dict.fromkeys(re.findall(r'BV[0-9A-Za-z]{10}', text)))
+
+class DownloadManager:
+    """
+    批量下载队列：固定数量的工作线程从队列中取任务，下载与ffmpeg合并分别限制并发数
+    """
+    def __init__(self, save_dir='.', workers=4, network_limit=3, merge_limit=1, segments=4, stream_merge=True,
+                 selector=None):
+        """
+        :param save_dir: 保存目录
+        :param workers: 工作线程数，即同时处理的任务数
+        :param network_limit: 同时下载的任务数
+        :param merge_limit: 同时运行的ffmpeg合并数
+        :param segments: 每个文件分段并行下载的段数
+        :param stream_merge: 支持时是否边下载边合并，此时只占用下载名额，ffmpeg只做复制封装，速度受下载限制
+        :param selector: StreamSelector，决定下载哪一路视频与音频，默认选择清晰度最高的一路
+        """
+        self.save_dir = save_dir
+        self.workers = workers
+        self.segments = segments
+        self.stream_merge = stream_merge
+        self.selector = selector
+        self.network_slots = threading.BoundedSemaphore(network_limit)
+        self.merge_slots = threading.BoundedSemaphore(merge_limit)
+        self.jobs = []
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def add(self, bvid):
+        """
+        加入一个下载任务，已在列表中的BV号不重复加入
+        :return: DownloadJob
+        """
+        with self.lock:
+            for job in self.jobs:
+                if job.bvid == bvid:
+                    return job
+            job = DownloadJob(bvid)
+            self.jobs.append(job)
+        self.queue.put(job)
+        self.start()
+        return job
+
+    def add_many(self, bvids):
+        return [self.add(bvid) for bvid in bvids]
+
+    def start(self):
+        # 按需启动工作线程，线程数不超过workers
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+            try:
+                self._run(job)
+            except Exception as e:
+                job.error = str(e)
+                job.state = FAILED
+                default_metrics.incr('jobs', state=FAILED)
+                logger.warning('%s下载失败：%s', job.bvid, e)
+            finally:
+                job.finished_at = time.time()
+                self.queue.task_done()
+
+    def _run(self, job):
+        job.started_at = time.time()
+        bili = BilibiliVideoAudio(job.bvid, segments=self.segments, selector=self.selector)
+        job.state = RESOLVING
+        with self.network_slots:
+            title, video_url, audio_url = bili.get_play_streams()
+        job.title = title
+        # 标题中不合法的字符替换掉，避免创建文件时出错
+        sanitized_title = re.sub(r'[\\/*?:"<>|]', '', title)
+        # 文件名带上BV号，同名的视频(重新上传、分P、清理后标题为空)同时下载时不会共用临时文件与断点
+        stem = f'{sanitized_title}_{job.bvid}'
+        video_path = os.path.join(self.save_dir, f'{stem}.mp4')
+        audio_path = os.path.join(self.save_dir, f'{stem}.mp3')
+        job.output_path = os.path.join(self.save_dir, f'{stem}_合并.mp4')
+
+        # 有上次未完成的下载时先下载到文件，从已下载的位置继续
+        resumable = any(os.path.isfile(f'{path}{suffix}') for path in (video_path, audio_path)
+                        for suffix in ('.part', '.dl.json'))
+        streamed = False
+        if self.stream_merge and bili.can_stream_merge() and not resumable:
+            # 边下载边合并，ffmpeg不重新编码，只占用下载的名额，不与下载到文件后的合并争抢合并名额
+            with self.network_slots:
+                job.state = DOWNLOADING
+                job.restart_progress()
+                try:
+                    bili.stream_merge(video_url, audio_url, job.output_path, job.update_progress)
+                    streamed = True
+                except Exception as e:
+                    # 管道中的数据无法续传，改为下载到文件，之后再出错时只需补齐缺少的部分
+                    logger.warning('%s边下载边合并失败：%s，改为下载到文件后合并', job.bvid, e)
+                    default_metrics.incr('stream_merge_fallbacks')
+                    if os.path.isfile(job.output_path):
+                        os.remove(job.output_path)
+                    video_url, audio_url = bili.refresh_urls('video'), bili.refresh_urls('audio')
+        if not streamed:
+            with self.network_slots:
+                job.state = DOWNLOADING
+                job.restart_progress()
+                bili.download_both(video_url, audio_url, video_path, audio_path, job.update_progress)
+            with self.merge_slots:
+                job.state = MERGING
+                bili.merge_video_audio(video_path, audio_path, job.output_path)
+            for path in (video_path, audio_path):
+                os.remove(path)
+        job.state = DONE
+        default_metrics.incr('jobs', state=DONE)
+        logger.info('%s下载完成：%s', job.bvid, job.output_path)
+
+    def wait(self):
+        """
+        等待队列中的全部任务完成
+        """
+        self.queue.join()
+
+    def shutdown(self):
+        # 通知全部工作线程在处理完当前任务后退出
+        with self.lock:
+            threads = list(self.threads)
+        for _ in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def summary(self):
+        """
+        :return: 各状态的任务数
+        """
+        counts = {}
+        for job in list(self.jobs):
+            counts[job.state] = counts.get(job.state, 0) + 1
+        return counts
+
+def main(argv=None):
+    # 命令行入口，无需图形界面即可批量下载
+    parser = argparse.ArgumentParser(description='批量下载B站视频并合并音视频')
+    parser.add_argument('bvids', nargs='*', help='要下载的BV号')
+    parser.add_argument('-i', '--input', action='append', default=[],
+                        help='BV号文件，可为BV号合并.csv或每行一个BV号的文本文件，可多次指定')
+    parser.add_argument('-o', '--output', default='.', help='保存目录')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='同时处理的任务数')
+    parser.add_argument('--network', type=int, default=3, help='同时下载的任务数')
+    parser.add_argument('--merge', type=int, default=1, help='同时运行的ffmpeg合并数')
+    parser.add_argument('--segments', type=int, default=4, help='每个文件分段并行下载的段数')
+    parser.add_argument('-q', '--quality', type=int, help='最高清晰度代号，如80为1080P、64为720P')
+    parser.add_argument('--min-quality', type=int, help='最低清晰度代号，与--smallest一起使用')
+    parser.add_argument('--codec', action='append', choices=sorted(CODEC_IDS),
+                        help='可接受的视频编码，按优先顺序可多次指定，默认avc、hevc、av1')
+    parser.add_argument('--smallest', action='store_true', help='选择满足清晰度要求的最小视频流')
+    parser.add_argument('--no-stream', action='store_true', help='先下载到文件再合并，不使用管道边下载边合并')
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='info',
+                        help='日志详细程度，warning时不输出每个文件的进度，只输出失败')
+    parser.add_argument('--metrics-file', help='定期把请求数、下载字节数与各阶段耗时写入该文件')
+    parser.add_argument('--metrics-format', choices=EXPORT_FORMATS, default='jsonl',
+                        help='指标文件的格式，jsonl每次追加一行，prometheus每次覆盖为文本格式')
+    parser.add_argument('--metrics-interval', type=float, default=10, help='写入指标文件的间隔(秒)')
+    parser.add_argument('--metrics-port', type=int, help='在本地该端口上提供/metrics供Prometheus抓取')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    bvids = list(args.bvids)
+    for path in args.input:
+        bvids.extend(load_bvids(path))
+    bvids = list(dict.fromkeys(bvids))
+    if not bvids:
+        parser.error('请提供BV号或BV号文件')
+    os.makedirs(args.output, exist_ok=True)
+
+    selector = StreamSelector(max_quality=args.quality, min_quality=args.min_quality,
+                              codecs=args.codec or ('avc', 'hevc', 'av1'),
+                              prefer='smallest' if args.smallest else 'best')
+    manager = DownloadManager(save_dir=args.output, workers=args.workers, network_limit=args.network,
+                              merge_limit=args.merge, segments=args.segments, stream_merge=not args.no_stream,
+                              selector=selector)
+    exporter = MetricsExporter(path=args.metrics_file, fmt=args.metrics_format, interval=args.metrics_interval,
+                               port=args.metrics_port).start()
+    if args.metrics_port is not None:
+        logger.info('指标地址：http://%s:%s/metrics', exporter.host, exporter.port)
+    manager.add_many(bvids)
+    logger.info('共%s个下载任务', len(bvids))
+    done = threading.Event()
+    waiter = threading.Thread(target=lambda: (manager.wait(), done.set()), daemon=True)
+    waiter.start()
+    # 定期输出总体进度
+    while not done.wait(5):
+        if not logger.isEnabledFor(logging.INFO):
+            continue
+        active = [job for job in manager.jobs if job.state == DOWNLOADING]
+        logger.info('进度：%s，%s', manager.summary(), '，'.join(
+            f'{job.bvid} {job.percent()}% {format_size(job.rate())}/s 剩余{format_eta(job.eta())}' for job in active))
+    manager.shutdown()
+    exporter.stop()
+    summary = manager.summary()
+    # 有失败的任务时以warning输出，--log-level warning时也能看到
+    logger.log(logging.WARNING if summary.get(FAILED) else logging.INFO, '全部任务结束：%s', summary)
+    for job in manager.jobs:
+        if job.state == FAILED:
+            logger.warning('%s：%s', job.bvid, job.error)
+    return 1 if summary.get(FAILED) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# 耗时直方图的分桶上界(秒)，覆盖从单次json解析到整个视频下载的范围
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# 命令行中可选的日志详细程度：debug输出每个请求，info输出每行/每个文件，warning只输出失败与限流
+LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+EXPORT_FORMATS = ('jsonl', 'prometheus')
+# Prometheus指标名的前缀
+METRIC_PREFIX = 'bilibili_'
+
+def configure_logging(level='info', stream=None):
+    """
+    设置各模块日志的详细程度，输出格式与原先的print相同，只有消息本身
+    :param level: LOG_LEVELS中的名称或logging的级别数值，生产环境中用'warning'关闭逐行输出
+    :param stream: 输出流，默认为标准输出
+    """
+    if isinstance(level, str):
+        level = LOG_LEVELS[level.lower()]
+    logging.basicConfig(level=level, format='%(message)s', stream=stream or sys.stdout, force=True)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+class SpanStats:
+    # 某一类耗时的次数、总和、最大值与直方图，由Metrics加锁后更新
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+class Metrics:
+    """
+    线程安全的计数器与耗时统计，按(名称, 标签)区分
+    记录一次只需要一次加锁，开销远小于print，可以放在每个请求、每个数据块的路径上
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.spans = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+
+    def incr(self, name, value=1, **labels):
+        """
+        计数器加value
+        :param name: 计数器名称，如'requests'、'bytes_downloaded'
+        :param labels: 附加的标签，如host='api.bilibili.com'
+        """
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        记录一次耗时
+        """
+        key = _key(name, labels)
+        with self.lock:
+            stats = self.spans.get(key)
+            if stats is None:
+                stats = self.spans[key] = SpanStats(self.buckets)
+            stats.observe(seconds)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        统计with块的耗时，块内抛出异常时同样记录，并额外计数name_errors
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.incr(f'{name}_errors', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.spans.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """
+        :return: 当前全部计数器与耗时统计的字典，可直接序列化为json
+        """
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            spans = [{'name': name, 'labels': dict(labels), 'count': stats.count, 'sum': round(stats.total, 6),
+                      'max': round(stats.max, 6), 'buckets': list(stats.counts)}
+                     for (name, labels), stats in sorted(self.spans.items())]
+        return {'time': datetime.now().isoformat(timespec='seconds'), 'uptime': round(time.time() - self.started_at, 3),
+                'counters': counters, 'spans': spans}
+
+    def to_prometheus(self, snapshot=None):
+        """
+        :return: Prometheus文本格式的指标，计数器加_total后缀，耗时为以秒为单位的直方图
+        """
+        snapshot = snapshot or self.snapshot()
+        lines = []
+        declared = set()
+
+        def declare(metric, kind):
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f'# TYPE {metric} {kind}')
+
+        for counter in snapshot['counters']:
+            metric = f"{METRIC_PREFIX}{counter['name']}_total"
+            declare(metric, 'counter')
+            lines.append(f"{metric}{_format_labels(counter['labels'])} {counter['value']}")
+        for span in snapshot['spans']:
+            metric = f"{METRIC_PREFIX}{span['name']}_seconds"
+            declare(metric, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), span['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{metric}_bucket{_format_labels(span['labels'], le=le)} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(span['labels'])} {span['sum']}")
+            lines.append(f"{metric}_count{_format_labels(span['labels'])} {span['count']}")
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+class MetricsExporter:
+    """
+    定期导出指标快照：追加JSON行或覆盖写入Prometheus文本文件，也可以在本地端口上提供/metrics供Prometheus抓取
+    可作为上下文管理器使用，退出时再导出一次最终的快照
+    """
+    def __init__(self, metrics=None, path=None, fmt='jsonl', interval=10.0, port=None, host='127.0.0.1'):
+        """
+        :param metrics: 要导出的Metrics，默认为default_metrics
+        :param path: 快照文件路径，为None时不写文件
+        :param fmt: 'jsonl'每次追加一行，'prometheus'每次原子地覆盖整个文件，可供node_exporter的textfile收集
+        :param interval: 写文件的间隔(秒)
+        :param port: 提供HTTP /metrics的端口，为None时不监听，为0时随机选择端口
+        :param host: 监听的地址
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'不支持的指标格式：{fmt}')
+        self.metrics = metrics or default_metrics
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self.port = port
+        self.host = host
+        self.server = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def write_snapshot(self):
+        # 把当前快照写入文件
+        if self.path is None:
+            return
+        snapshot = self.metrics.snapshot()
+        if self.fmt == 'jsonl':
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.metrics.to_prometheus(snapshot))
+        os.replace(temp_path, self.path)
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                logging.getLogger(__name__).warning('指标快照写入失败：%s', e)
+
+    def start(self):
+        if self.port is not None:
+            # 只有需要提供/metrics时才导入http.server
+            from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def log_message(self, *args):
+                    pass
+
+                def do_GET(self):
+                    if self.path.split('?')[0] == '/metrics.json':
+                        body, content_type = json.dumps(metrics.snapshot(), ensure_ascii=False), 'application/json'
+                    elif self.path.split('?')[0] == '/metrics':
+                        body, content_type = metrics.to_prometheus(), 'text/plain; version=0.0.4'
+                    else:
+                        self.send_error(404)
+                        return
+                    body = body.encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.server.daemon_threads = True
+            self.port = self.server.server_port
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if self.path is not None:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.write_snapshot()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+# 爬虫与下载器共享的默认指标
+default_metrics = Metrics()
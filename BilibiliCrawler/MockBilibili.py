@@ -0,0 +1,211 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# 每页搜索结果数与视频页面中除播放信息外的填充大小，接近真实页面
+SEARCH_PAGE_SIZE = 20
+PAGE_PADDING = 200 * 1024
+# 不注入错误的路径：搜索出错时爬虫会改用selenium，离线测试中无法运行
+NO_ERROR_PATHS = ('/x/web-interface/wbi/search/type', '/x/web-interface/nav', '/')
+
+def _number(text, modulo):
+    # 由字符串得到稳定的数字，同一个BV号每次返回相同的数据
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16) % modulo
+
+def make_bvid(keyword, page, i):
+    return 'BV1' + hashlib.md5(f'{keyword}-{page}-{i}'.encode('utf-8')).hexdigest()[:9]
+
+class MockBilibiliServer:
+    """
+    本地模拟的B站接口与视频CDN，用于离线测试爬虫与下载器的性能
+    提供view、stat、card、nav、搜索、playurl接口，含__playinfo__的视频页面，以及支持Range请求的音视频文件
+    可以设置每个请求的延迟、错误率与412限流的比例
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, media_size=16 * 1024 * 1024,
+                 num_pages=5, num_uploaders=50, seed=0):
+        """
+        :param latency: 每个请求的延迟(秒)
+        :param error_rate: 返回HTTP 500的比例
+        :param throttle_rate: 返回HTTP 412的比例
+        :param media_size: 视频文件的字节数，音频文件为其四分之一
+        :param num_pages: 每个关键词的搜索结果页数
+        :param num_uploaders: 不同UP主的数量，card接口的请求会有重复
+        :param seed: 错误注入所用的随机种子
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.num_pages = num_pages
+        self.num_uploaders = num_uploaders
+        self.random = random.Random(seed)
+        rng = random.Random(seed)
+        self.media = {'video': rng.randbytes(media_size), 'audio': rng.randbytes(media_size // 4)}
+        # 音视频文件的版本号，作为ETag的一部分，修改后可模拟CDN上的文件被替换
+        self.media_version = 0
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                mock.handle(self)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # 以下为各接口的响应内容
+    def view(self, bvid):
+        mid = _number(bvid, self.num_uploaders) + 1
+        n = _number(bvid, 10 ** 6)
+        return {'code': 0, 'message': '0', 'data': {
+            'bvid': bvid, 'aid': n + 10 ** 8, 'cid': n + 2 * 10 ** 8, 'title': f'测试视频{bvid}', 'tname': '单机游戏',
+            'pubdate': 1700000000 + n, 'desc': '离线测试用的视频简介' * 5, 'owner': {'mid': mid, 'name': f'UP主{mid}'},
+            'stat': {'view': n * 7, 'like': n, 'coin': n // 3, 'favorite': n // 2, 'share': n // 10,
+                     'reply': n // 20, 'danmaku': n // 5}}}
+
+    def card(self, mid):
+        n = _number(str(mid), 10 ** 6)
+        return {'code': 0, 'message': '0', 'data': {'card': {'mid': str(mid), 'fans': n * 3}, 'archive_count': n % 500}}
+
+    def nav(self):
+        return {'code': -101, 'message': '账号未登录', 'data': {'wbi_img': {
+            'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+            'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png'}}}
+
+    def search(self, keyword, page):
+        result = [{'type': 'video', 'bvid': make_bvid(keyword, page, i)} for i in range(SEARCH_PAGE_SIZE)]
+        return {'code': 0, 'message': '0', 'data': {'page': page, 'numPages': self.num_pages, 'result': result}}
+
+    def playinfo(self):
+        def stream(kind, stream_id, codecid, bandwidth):
+            url = f'{self.base_url}/media/{kind}.m4s?id={stream_id}&codec={codecid}'
+            return {'id': stream_id, 'codecid': codecid, 'bandwidth': bandwidth, 'codecs': kind,
+                    'baseUrl': url, 'backupUrl': [url + '&backup=1']}
+
+        return {'code': 0, 'data': {'dash': {
+            'video': [stream('video', 80, 7, 3000000), stream('video', 80, 12, 1500000), stream('video', 64, 7, 1200000)],
+            'audio': [stream('audio', 30280, 0, 192000), stream('audio', 30216, 0, 64000)]}}}
+
+    def video_page(self, bvid):
+        padding = '<div class="padding">' + 'x' * PAGE_PADDING + '</div>'
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{bvid}</title>'
+                f'<meta data-vue-meta="true" property="og:title" content="测试视频{bvid}_哔哩哔哩_bilibili">'
+                f'</head><body>{padding}<script>window.__playinfo__={json.dumps(self.playinfo())}</script>'
+                f'</body></html>')
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.count(url.path if not url.path.startswith('/video/') else '/video/')
+        if self.latency:
+            time.sleep(self.latency)
+        roll = self._roll()
+        if roll < self.throttle_rate:
+            self.count('throttled')
+            return self.send(request, 412, b'', 'text/plain')
+        if url.path not in NO_ERROR_PATHS and roll < self.throttle_rate + self.error_rate:
+            self.count('errors')
+            return self.send(request, 500, b'Internal Server Error', 'text/plain')
+
+        if url.path == '/x/web-interface/view':
+            return self.send_json(request, self.view(query.get('bvid', '')))
+        if url.path == '/x/web-interface/archive/stat':
+            view = self.view(query.get('bvid', ''))
+            return self.send_json(request, {'code': 0, 'message': '0', 'data': view['data']['stat']})
+        if url.path == '/x/web-interface/card':
+            return self.send_json(request, self.card(query.get('mid', '0')))
+        if url.path == '/x/web-interface/nav':
+            return self.send_json(request, self.nav())
+        if url.path == '/x/web-interface/wbi/search/type':
+            return self.send_json(request, self.search(query.get('keyword', ''), int(query.get('page', 1))))
+        if url.path == '/x/player/playurl':
+            return self.send_json(request, self.playinfo())
+        if url.path.startswith('/video/'):
+            page = self.video_page(url.path.split('/')[2]).encode('utf-8')
+            return self.send(request, 200, page, 'text/html; charset=utf-8')
+        if url.path.startswith('/media/'):
+            kind = url.path.split('/')[2].split('.')[0]
+            return self.send_media(request, self.media[kind], f'"{kind}-{self.media_version}"')
+        if url.path == '/':
+            return self.send(request, 200, b'<html></html>', 'text/html; charset=utf-8',
+                             {'Set-Cookie': 'buvid3=mock; Path=/'})
+        return self.send_json(request, {'code': -404, 'message': '啥都木有'}, 404)
+
+    def send_json(self, request, data, status=200):
+        self.send(request, status, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+    def send(self, request, status, body, content_type, headers=None):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def send_media(self, request, data, etag):
+        match = re.match(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+        # If-Range与当前的ETag不一致时忽略Range，返回整个文件
+        if_range = request.headers.get('If-Range')
+        if if_range is not None and if_range != etag:
+            match = None
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                return self.send(request, 416, b'', 'text/plain', {'Content-Range': f'bytes */{len(data)}'})
+            request.send_response(206)
+            request.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            start, end = 0, len(data) - 1
+            request.send_response(200)
+        request.send_header('Content-Type', 'video/mp4')
+        request.send_header('Accept-Ranges', 'bytes')
+        request.send_header('ETag', etag)
+        request.send_header('Content-Length', str(end - start + 1))
+        request.end_headers()
+        view = memoryview(data)[start:end + 1]
+        try:
+            for offset in range(0, len(view), 256 * 1024):
+                request.wfile.write(view[offset:offset + 256 * 1024])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
@@ -0,0 +1,245 @@
+import os
+import threading
+from datetime import datetime
+from CsvSink import BufferedCsvWriter
+from Instrumentation import default_metrics
+
+# 视频基本信息中各列的类型，用于列式存储
+INT_COLUMNS = ['AV号', 'CID', 'UP主ID', 'UP主粉丝数', '作品总数', '播放量', '点赞数', '投币数', '收藏数', '分享数',
+               '评论数', '弹幕数']
+FLOAT_COLUMNS = ['传播效果指数']
+# 列式存储额外增加的一列，由发布日期与发布时间合成
+TIMESTAMP_COLUMN = '发布时间戳'
+
+def _import_pyarrow():
+    # pyarrow只在使用列式存储时才需要
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('使用parquet/arrow输出需要安装pyarrow：pip install pyarrow')
+    return pyarrow
+
+def video_info_schema(fieldnames):
+    """
+    :param fieldnames: csv的表头，即WebCrawlerX.VIDEO_INFO_FIELDNAMES
+    :return: 带类型的pyarrow.Schema，整数统计列为int64，发布日期为date32，并追加发布时间戳列
+    """
+    pa = _import_pyarrow()
+    fields = []
+    for name in fieldnames:
+        if name in INT_COLUMNS:
+            fields.append(pa.field(name, pa.int64()))
+        elif name in FLOAT_COLUMNS:
+            fields.append(pa.field(name, pa.float64()))
+        elif name == '发布日期':
+            fields.append(pa.field(name, pa.date32()))
+        elif name == '视频分类标签':
+            # 分类标签重复度高，使用字典编码
+            fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    fields.append(pa.field(TIMESTAMP_COLUMN, pa.timestamp('s')))
+    return pa.schema(fields)
+
+class CsvBackend:
+    """
+    csv输出，即原有的视频基本信息.csv
+    """
+    def __init__(self, path, fieldnames, batch_size=200, flush_interval=5.0, on_flush=None):
+        self.path = path if path.endswith('.csv') else f'{path}.csv'
+        self.sink = BufferedCsvWriter(self.path, fieldnames, batch_size=batch_size, flush_interval=flush_interval,
+                                      on_flush=on_flush)
+
+    def open(self):
+        self.sink.open()
+        return self
+
+    def writerow(self, row):
+        self.sink.writerow(row)
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class ColumnarBackend:
+    """
+    列式输出的公共部分：path为一个目录，每次运行在其中写入一个新的分片文件，缓存的行数达到row_group_size时写入一个row group
+    读取时对整个目录使用pandas.read_parquet或pyarrow.dataset即可得到全部数据
+    """
+    suffix = ''
+
+    def __init__(self, path, fieldnames, row_group_size=5000, on_flush=None):
+        """
+        :param path: 输出目录
+        :param fieldnames: csv的表头
+        :param row_group_size: 每个row group(record batch)包含的行数
+        :param on_flush: 每个row group写入后调用的函数，参数为这批行的列表
+        """
+        self.pa = _import_pyarrow()
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.schema = video_info_schema(self.fieldnames)
+        self.row_group_size = row_group_size
+        self.on_flush = on_flush
+        self.pending_rows = []
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+        self.rows_written = 0
+        self.file_path = None
+        self.writer = None
+        # 与BufferedCsvWriter相同，缓存的列与待回调的行只在持有锁时修改，可以由多个线程写入
+        self.lock = threading.Lock()
+
+    def _new_writer(self, file_path):
+        raise NotImplementedError
+
+    def _write_table(self, table):
+        raise NotImplementedError
+
+    def open(self):
+        if self.writer is None:
+            os.makedirs(self.path, exist_ok=True)
+            name = f'part-{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}-{os.getpid()}{self.suffix}'
+            self.file_path = os.path.join(self.path, name)
+            self.writer = self._new_writer(self.file_path)
+        return self
+
+    def writerow(self, row):
+        """
+        :param row: 与csv相同的以表头为键的字典，值会按列的类型转换
+        """
+        pub_date = row.get('发布日期')
+        pub_time = row.get('发布时间')
+        values = []
+        for name in self.fieldnames:
+            value = row.get(name)
+            if value is not None and value != '':
+                if name in INT_COLUMNS:
+                    value = int(value)
+                elif name in FLOAT_COLUMNS:
+                    value = float(value)
+                elif name == '发布日期':
+                    value = datetime.strptime(str(value), '%Y-%m-%d').date()
+                else:
+                    value = str(value)
+            else:
+                value = None
+            values.append(value)
+        timestamp = None
+        if pub_date and pub_time:
+            timestamp = datetime.strptime(f'{pub_date} {pub_time}', '%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            for name, value in zip(self.fieldnames, values):
+                self.columns[name].append(value)
+            self.columns[TIMESTAMP_COLUMN].append(timestamp)
+            if self.on_flush is not None:
+                self.pending_rows.append(row)
+            self.buffered += 1
+            if self.buffered >= self.row_group_size:
+                self._flush()
+
+    def flush(self):
+        """
+        把缓存的行作为一个row group写入文件
+        """
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffered:
+            return
+        self.open()
+        fmt = self.suffix.lstrip('.')
+        with default_metrics.span('output_write', format=fmt):
+            table = self.pa.Table.from_pydict(self.columns, schema=self.schema)
+            self._write_table(table)
+        self.rows_written += self.buffered
+        default_metrics.incr('rows_written', self.buffered, format=fmt)
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+        if self.on_flush is not None:
+            rows, self.pending_rows = self.pending_rows, []
+            self.on_flush(rows)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class ParquetBackend(ColumnarBackend):
+    """
+    parquet输出，使用zstd压缩
+    """
+    suffix = '.parquet'
+
+    def __init__(self, path, fieldnames, row_group_size=5000, on_flush=None, compression='zstd'):
+        self.compression = compression
+        super().__init__(path, fieldnames, row_group_size, on_flush)
+
+    def _new_writer(self, file_path):
+        return self.pa.parquet.ParquetWriter(file_path, self.schema, compression=self.compression)
+
+    def _write_table(self, table):
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+
+class ArrowIpcBackend(ColumnarBackend):
+    """
+    Arrow IPC(feather v2)输出，读取时可直接内存映射
+    """
+    suffix = '.arrow'
+
+    def _new_writer(self, file_path):
+        return self.pa.ipc.new_file(file_path, self.schema)
+
+    def _write_table(self, table):
+        self.writer.write_table(table, max_chunksize=self.row_group_size)
+
+BACKENDS = {
+    'csv': CsvBackend,
+    'parquet': ParquetBackend,
+    'arrow': ArrowIpcBackend,
+}
+
+def open_video_output(path, fieldnames, fmt='csv', **kwargs):
+    """
+    创建视频基本信息的输出，返回的对象都支持writerow/flush/close，并可作为上下文管理器，可直接作为write_to_csv的sink
+    :param path: 输出路径，csv为文件名，parquet/arrow为目录名
+    :param fieldnames: 表头
+    :param fmt: 'csv'、'parquet'或'arrow'
+    :param kwargs: 传给对应输出类的其他参数
+    :return: 输出对象
+    """
+    if fmt not in BACKENDS:
+        raise ValueError(f'不支持的输出格式：{fmt}，可选{list(BACKENDS)}')
+    return BACKENDS[fmt](path, fieldnames, **kwargs)
+
+def read_video_dataset(path, columns=None):
+    """
+    读取parquet/arrow输出目录中的全部分片为pandas.DataFrame
+    :param path: 输出目录
+    :param columns: 只读取的列，为None时读取全部列
+    :return: pandas.DataFrame
+    """
+    _import_pyarrow()
+    import pyarrow.dataset as ds
+    files = sorted(os.listdir(path))
+    fmt = 'ipc' if files and all(name.endswith('.arrow') for name in files) else 'parquet'
+    return ds.dataset(path, format=fmt).to_table(columns=columns).to_pandas()
@@ -0,0 +1,188 @@
+import csv
+import logging
+import os
+import queue
+import threading
+from BvidDedup import SeenSet
+from Instrumentation import default_metrics
+from CsvSink import BufferedCsvWriter
+from SearchCollector import SearchCollector
+from WebCrawlerX import (VIEW_API_URL, CARD_API_URL, HEADERS, BVID_FIELDNAMES, fetch_api_json, parse_video_info,
+                         parse_user_info, build_video_row, spider_bvid_selenium)
+
+logger = logging.getLogger(__name__)
+
+# 各阶段之间传递的结束标记
+_STOP = object()
+
+class CrawlPipeline:
+    """
+    流式爬取流水线：搜索 -> 视频信息 -> UP主信息 -> 写入
+    各阶段之间用有界队列连接，下游处理不过来时上游阻塞等待，内存占用与关键词数量无关
+    """
+    def __init__(self, keywords, output, state=None, search_workers=2, detail_workers=8, user_workers=4,
+                 queue_size=200, page_concurrency=2, bvid_filename='BV号合并.csv', seen=None):
+        """
+        :param keywords: 搜索关键词列表
+        :param output: 已打开的输出对象(open_video_output的返回值)，只由写入线程使用
+        :param state: CrawlState，传入时跳过已完成的搜索页与BV号，并记录进度
+        :param search_workers: 同时搜索的关键词数
+        :param detail_workers: 获取视频信息的线程数
+        :param user_workers: 获取UP主信息的线程数
+        :param queue_size: 各阶段之间队列的容量
+        :param page_concurrency: 每个关键词同时请求的搜索页数
+        :param bvid_filename: 记录全部去重BV号的文件，为None时不记录
+        :param seen: 未传入state时用于去重的SeenSet，默认只在本次运行中去重；传入state时由state去重
+        """
+        self.keywords = list(keywords)
+        self.output = output
+        self.state = state
+        self.search_workers = search_workers
+        self.detail_workers = detail_workers
+        self.user_workers = user_workers
+        self.page_concurrency = page_concurrency
+        self.bvid_queue = queue.Queue(maxsize=queue_size)
+        self.detail_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.bvid_sink = BufferedCsvWriter(bvid_filename, BVID_FIELDNAMES) if bvid_filename else None
+        if state is None and seen is None:
+            seen = SeenSet(':memory:')
+        self.seen = seen
+        self.lock = threading.Lock()
+        self.counts = {'found': 0, 'written': 0, 'failed': 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+        default_metrics.incr('videos', status=key)
+
+    def _offer(self, bvid):
+        # 去重后把新的BV号送入下游，已完成或已入队的BV号直接跳过
+        with self.lock:
+            if self.state is not None:
+                is_new = self.state.add_videos([bvid]) > 0
+            else:
+                is_new = self.seen.add(bvid)
+            if not is_new:
+                return
+            self.counts['found'] += 1
+            default_metrics.incr('videos', status='found')
+            if self.bvid_sink is not None:
+                self.bvid_sink.writerow({'BV号': bvid})
+        self.bvid_queue.put(bvid)
+
+    def _search_keyword(self, keyword):
+        done_pages = self.state.done_pages(keyword) if self.state is not None else set()
+        try:
+            collector = SearchCollector(concurrency=self.page_concurrency, headers={'Cookie': HEADERS.get('Cookie')})
+            for i, bv_id_list in collector.iter_pages(keyword, skip_pages=done_pages):
+                for bvid in bv_id_list:
+                    self._offer(bvid)
+                if self.state is not None:
+                    self.state.mark_page_done(keyword, i)
+                logger.info('===========成功获取%s的第%s页搜索结果===========', keyword, i + 1)
+        except Exception as e:
+            # 搜索接口不可用时用selenium获取剩余页，再从其输出文件中读取BV号
+            logger.warning('%s的搜索接口获取失败：%s，改用selenium继续获取剩余页', keyword, e)
+            spider_bvid_selenium(keyword, state=self.state)
+            filename = f'{keyword}BV号.csv'
+            if os.path.isfile(filename):
+                with open(filename, encoding='utf-8', newline='') as csvfile:
+                    for row in csv.DictReader(csvfile):
+                        self._offer(row['BV号'])
+
+    def _search_worker(self, keyword_queue):
+        while True:
+            try:
+                keyword = keyword_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._search_keyword(keyword)
+
+    def _fail(self, bvid, error):
+        logger.warning('==========BV号：%s爬取失败：%s==========', bvid, error)
+        self._count('failed')
+        if self.state is not None:
+            self.state.mark_failed(bvid, error)
+
+    def _detail_worker(self):
+        while True:
+            bvid = self.bvid_queue.get()
+            if bvid is _STOP:
+                return
+            try:
+                video_info = parse_video_info(fetch_api_json(VIEW_API_URL.format(bvid=bvid)))
+            except Exception as e:
+                self._fail(bvid, e)
+                continue
+            self.detail_queue.put((bvid, video_info))
+
+    def _user_worker(self):
+        while True:
+            item = self.detail_queue.get()
+            if item is _STOP:
+                return
+            bvid, video_info = item
+            try:
+                user_info = parse_user_info(fetch_api_json(CARD_API_URL.format(mid=video_info['mid'])))
+                row = build_video_row(video_info, user_info)
+            except Exception as e:
+                self._fail(bvid, e)
+                continue
+            self.write_queue.put(row)
+
+    def _writer(self):
+        while True:
+            row = self.write_queue.get()
+            if row is _STOP:
+                return
+            try:
+                self.output.writerow(row)
+            except Exception as e:
+                self._fail(row['BV号'], e)
+                continue
+            self._count('written')
+            logger.info('==========第%s个BV号：%s的相关数据已写入==========', self.counts['written'], row['BV号'])
+
+    @staticmethod
+    def _start(target, count, *args):
+        threads = [threading.Thread(target=target, args=args, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self):
+        """
+        运行整条流水线，所有关键词处理完并写入后返回
+        :return: 各阶段的计数
+        """
+        if self.bvid_sink is not None:
+            self.bvid_sink.open()
+        writer = self._start(self._writer, 1)
+        user_threads = self._start(self._user_worker, self.user_workers)
+        detail_threads = self._start(self._detail_worker, self.detail_workers)
+
+        # 先处理上次运行中未完成的BV号
+        if self.state is not None:
+            for bvid in self.state.pending_videos():
+                self._count('found')
+                self.bvid_queue.put(bvid)
+
+        keyword_queue = queue.Queue()
+        for keyword in self.keywords:
+            keyword_queue.put(keyword)
+        search_threads = self._start(self._search_worker, min(self.search_workers, len(self.keywords)) or 1,
+                                     keyword_queue)
+
+        # 上游全部结束后，向下游每个线程发送结束标记
+        for stage_threads, next_queue, next_count in ((search_threads, self.bvid_queue, self.detail_workers),
+                                                      (detail_threads, self.detail_queue, self.user_workers),
+                                                      (user_threads, self.write_queue, 1)):
+            for thread in stage_threads:
+                thread.join()
+            for _ in range(next_count):
+                next_queue.put(_STOP)
+        writer[0].join()
+        if self.bvid_sink is not None:
+            self.bvid_sink.close()
+        return dict(self.counts)
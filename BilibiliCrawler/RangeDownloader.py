@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from RateLimiter import limited_get
+from Instrumentation import default_metrics
+
+logger = logging.getLogger(__name__)
+
+def stream_source(url):
+    """
+    :return: 标识同一路音视频流的地址路径，不含带签名的查询参数；备用地址与重新获取的地址路径相同，换了清晰度或编码时不同
+    """
+    return urlparse(url).path
+
+def response_validator(response):
+    """
+    :return: 可用于If-Range的校验值，优先使用强ETag，其次Last-Modified，都没有时返回None
+    """
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+class ResourceChanged(IOError):
+    # 续传时服务器上的文件已与之前下载的部分不同，需要从头下载
+    pass
+
+class RangeDownloader:
+    """
+    分段并行下载器：按Content-Length把文件分成若干段，每段用HTTP Range请求并行下载，写入预先分配好大小的文件
+    每段失败时单独重试，进度保存在同名的.dl.json文件中，中断后重新下载时从已完成的位置继续
+    """
+    def __init__(self, session, segments=4, min_segment_size=2 * 1024 * 1024, chunk_size=256 * 1024,
+                 max_retries=5, timeout=30):
+        """
+        :param session: 使用的requests.Session，应挂载连接数不少于segments的连接池
+        :param segments: 并行下载的段数
+        :param min_segment_size: 每段的最小字节数，小文件会分成更少的段
+        :param chunk_size: 每次读取写入的字节数
+        :param max_retries: 每段的最大重试次数
+        :param timeout: 单次请求的超时时间(秒)
+        """
+        self.session = session
+        self.segments = segments
+        self.min_segment_size = min_segment_size
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    @staticmethod
+    def state_path(file_path):
+        return f'{file_path}.dl.json'
+
+    def probe(self, url):
+        """
+        请求第一个字节，判断服务器是否支持Range请求
+        :return: (文件总字节数, 校验值)，不支持Range或无法得知大小时总字节数为None
+        """
+        with limited_get(url, session=self.session, headers={'Range': 'bytes=0-0'}, stream=True,
+                         timeout=self.timeout) as response:
+            # 地址过期等错误直接抛出，由调用方换用其他地址
+            response.raise_for_status()
+            if response.status_code != 206:
+                return None, None
+            match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+            return (int(match.group(1)) if match else None), response_validator(response)
+
+    def _plan(self, total):
+        count = max(1, min(self.segments, total // self.min_segment_size))
+        size = total // count
+        bounds = [i * size for i in range(count)] + [total]
+        return [[bounds[i], bounds[i + 1] - 1, 0] for i in range(count)]
+
+    def _load_state(self, file_path, total, source, validator):
+        # 读取上次中断时保存的进度，文件大小、流的地址路径或服务器的校验值不一致时视为无效
+        path = self.state_path(file_path)
+        if not os.path.isfile(path) or not os.path.isfile(file_path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('total') != total or os.path.getsize(file_path) != total:
+            return None
+        if state.get('source') != source or state.get('validator') != validator:
+            logger.info('%s对应的流已变化，从头下载', file_path)
+            return None
+        return state['segments']
+
+    def _save_state(self, file_path, total, segments, source, validator):
+        path = self.state_path(file_path)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'total': total, 'source': source, 'validator': validator, 'segments': segments}, f)
+        os.replace(tmp_path, path)
+
+    def download(self, url, file_path, progress_callback=None):
+        """
+        :param url: 下载地址
+        :param file_path: 保存路径
+        :param progress_callback: 进度回调函数，参数为(已下载的字节数, 总字节数)，会从多个下载线程中调用
+        :return: 文件总字节数，服务器不支持Range请求时返回None，由调用方改用单连接下载
+        """
+        try:
+            return self._download(url, file_path, progress_callback)
+        except ResourceChanged as e:
+            # 下载过程中文件被替换，已下载的部分作废，重新获取大小与校验值后从头下载一次
+            logger.warning('%s：%s，从头下载', file_path, e)
+            if os.path.isfile(self.state_path(file_path)):
+                os.remove(self.state_path(file_path))
+            return self._download(url, file_path, progress_callback)
+
+    def _download(self, url, file_path, progress_callback):
+        total, validator = self.probe(url)
+        if total is None:
+            return None
+        source = stream_source(url)
+
+        segments = self._load_state(file_path, total, source, validator)
+        if segments is None:
+            segments = self._plan(total)
+            # 预先分配文件大小，各段直接写入各自的偏移位置
+            with open(file_path, 'wb') as f:
+                f.truncate(total)
+        else:
+            logger.info('继续上次未完成的下载：%s', file_path)
+        self._save_state(file_path, total, segments, source, validator)
+
+        lock = threading.Lock()
+        progress = {'downloaded': sum(segment[2] for segment in segments), 'saved_at': time.monotonic()}
+
+        def on_chunk(segment, size):
+            default_metrics.incr('bytes_downloaded', size)
+            with lock:
+                segment[2] += size
+                progress['downloaded'] += size
+                downloaded = progress['downloaded']
+                # 每秒最多保存一次进度
+                if time.monotonic() - progress['saved_at'] >= 1.0:
+                    self._save_state(file_path, total, segments, source, validator)
+                    progress['saved_at'] = time.monotonic()
+                # 在锁内回调，各段上报的进度按递增的顺序到达
+                if progress_callback:
+                    progress_callback(downloaded, total)
+
+        todo = [segment for segment in segments if segment[0] + segment[2] <= segment[1]]
+        error = None
+        with ThreadPoolExecutor(max_workers=max(1, len(todo))) as executor:
+            futures = [executor.submit(self._download_segment, url, file_path, segment, on_chunk, validator)
+                       for segment in todo]
+            # 等待全部分段结束，某一段失败时其他段仍会把能下载的部分下载完
+            for future in futures:
+                try:
+                    future.result()
+                except ResourceChanged as e:
+                    error = e
+                except Exception as e:
+                    error = error or e
+        if isinstance(error, ResourceChanged):
+            raise error
+        if error is None and any(segment[0] + segment[2] <= segment[1] for segment in segments):
+            error = IOError(f'{file_path}下载不完整')
+        if error is not None:
+            self._save_state(file_path, total, segments, source, validator)
+            raise error
+        if os.path.getsize(file_path) != total:
+            raise IOError(f'{file_path}大小与Content-Length不一致')
+
+        os.remove(self.state_path(file_path))
+        return total
+
+    def _download_segment(self, url, file_path, segment, on_chunk, validator=None):
+        # 下载[start, end]中尚未完成的部分，出错时从已完成的位置重试
+        # 有校验值时带上If-Range，服务器上的文件已变化时返回整个文件(200)而不是这一段
+        start, end = segment[0], segment[1]
+        for attempt in range(self.max_retries + 1):
+            offset = start + segment[2]
+            if offset > end:
+                return
+            try:
+                headers = {'Range': f'bytes={offset}-{end}'}
+                if validator:
+                    headers['If-Range'] = validator
+                with limited_get(url, session=self.session, headers=headers, stream=True,
+                                 timeout=self.timeout) as response:
+                    if response.status_code != 206:
+                        response.raise_for_status()
+                        if validator:
+                            raise ResourceChanged(f'服务器上的文件已变化：HTTP {response.status_code}')
+                        raise IOError(f'服务器未按Range返回数据：HTTP {response.status_code}')
+                    with open(file_path, 'r+b') as f:
+                        f.seek(offset)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if not chunk:
+                                continue
+                            # 服务器多返回的数据不能覆盖下一段
+                            chunk = chunk[:end + 1 - (start + segment[2])]
+                            f.write(chunk)
+                            on_chunk(segment, len(chunk))
+                            if start + segment[2] > end:
+                                break
+                if start + segment[2] > end:
+                    return
+            except ResourceChanged:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning('分段%s-%s下载出错：%s，%ss后从第%s字节重试', start, end, e, 2 ** attempt,
+                               start + segment[2])
+                default_metrics.incr('segment_retries')
+                time.sleep(2 ** attempt)
+        raise IOError(f'分段{start}-{end}在重试{self.max_retries}次后仍未下载完成')
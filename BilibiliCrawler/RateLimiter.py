@@ -0,0 +1,230 @@
+import json
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+from Instrumentation import default_metrics
+
+logger = logging.getLogger(__name__)
+
+# 被限流时B站返回的HTTP状态码与json中的code
+THROTTLE_STATUS_CODES = (412, 429)
+THROTTLE_API_CODES = (-412, -509, -799)
+
+# 按域名后缀设置的初始速率(每秒请求数)与突发量，速率为0表示不限速
+# 视频/音频CDN不做限速，只对接口与网页做限速
+DEFAULT_HOST_RATES = {
+    'api.bilibili.com': (5.0, 5),
+    'search.bilibili.com': (1.0, 2),
+    'www.bilibili.com': (2.0, 3),
+    'bilivideo.com': (0, 0),
+    'bilivideo.cn': (0, 0),
+    'akamaized.net': (0, 0),
+}
+
+def _requests_get():
+    # 调用方通常传入自己的Session，只有未传入时才需要导入requests，导入本模块时不加载它
+    import requests
+    return requests.get
+
+class TokenBucket:
+    """
+    令牌桶，按rate的速度生成令牌，最多积累burst个令牌，线程安全
+    """
+    def __init__(self, rate, burst, min_rate, max_rate):
+        """
+        :param rate: 初始速率(每秒令牌数)，为0表示不限速
+        :param burst: 桶的容量，即允许的突发请求数
+        :param min_rate: 自适应降速的下限
+        :param max_rate: 自适应提速的上限
+        """
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        # 被限流后在该时间点之前不再发出请求
+        self.blocked_until = 0.0
+        # 连续被限流的次数，用于计算退避时间
+        self.strikes = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        取走一个令牌
+        :return: 需要等待的秒数，令牌不足时令牌数记为负数，由调用方等待至令牌补足
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def on_success(self, increase):
+        """
+        加性增：每成功一次，速率增加increase/rate，即持续成功时大约每秒增加increase
+        """
+        if self.rate <= 0:
+            return
+        with self.lock:
+            self.strikes = 0
+            self.rate = min(self.max_rate, self.rate + increase / self.rate)
+
+    def on_throttled(self, decrease, backoff):
+        """
+        乘性减：速率乘以decrease，清空令牌，并按连续被限流的次数指数退避
+        :return: 本次退避的秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * decrease)
+            self.tokens = min(self.tokens, 0.0)
+            self.strikes += 1
+            delay = backoff * (2 ** (self.strikes - 1))
+            self.blocked_until = max(self.blocked_until, now + delay)
+            return delay
+
+class AdaptiveRateLimiter:
+    """
+    按域名划分令牌桶的限速器，根据响应结果以AIMD的方式自适应调整速率
+    被412/429或json中code为-412等限流信号命中时降速，请求成功时逐步提速
+    """
+    def __init__(self, host_rates=None, default_rate=2.0, default_burst=2, min_rate=0.2, max_rate=20.0,
+                 increase=0.2, decrease=0.5, backoff=2.0):
+        """
+        :param host_rates: 域名后缀到(rate, burst)的映射，默认为DEFAULT_HOST_RATES
+        :param default_rate: 未配置的域名使用的初始速率
+        :param default_burst: 未配置的域名使用的突发量
+        :param min_rate: 降速的下限
+        :param max_rate: 提速的上限
+        :param increase: 加性增的幅度
+        :param decrease: 乘性减的系数
+        :param backoff: 首次被限流时的退避秒数，连续被限流时翻倍
+        """
+        self.host_rates = dict(DEFAULT_HOST_RATES if host_rates is None else host_rates)
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.backoff = backoff
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, url):
+        host = urlparse(url).hostname or ''
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                rate, burst = self.default_rate, self.default_burst
+                for suffix, config in self.host_rates.items():
+                    if host == suffix or host.endswith('.' + suffix):
+                        rate, burst = config
+                        break
+                bucket = TokenBucket(rate, burst, self.min_rate, self.max_rate)
+                self.buckets[host] = bucket
+            return bucket
+
+    def acquire(self, url):
+        """
+        在向url发出请求前调用，阻塞直到该域名有可用的令牌
+        """
+        wait = self._bucket(url).reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def feedback(self, url, status_code, api_code=None):
+        """
+        根据响应结果调整该域名的速率
+        :param url: 请求的url
+        :param status_code: HTTP状态码
+        :param api_code: json响应中的code，没有则为None
+        :return: 是否被限流
+        """
+        bucket = self._bucket(url)
+        if is_throttled(status_code, api_code):
+            delay = bucket.on_throttled(self.decrease, self.backoff)
+            default_metrics.incr('throttled', host=urlparse(url).hostname)
+            logger.warning('请求被限流(HTTP %s, code %s)，%s降速至%.2f次/秒，暂停%.1fs',
+                           status_code, api_code, urlparse(url).hostname, bucket.rate, delay)
+            return True
+        if status_code < 400:
+            bucket.on_success(self.increase)
+        return False
+
+    def rate_of(self, url):
+        """
+        :return: url所在域名当前的速率
+        """
+        return self._bucket(url).rate
+
+def is_throttled(status_code, api_code=None):
+    """
+    判断一次响应是否为限流信号
+    """
+    return status_code in THROTTLE_STATUS_CODES or api_code in THROTTLE_API_CODES
+
+# 所有爬虫请求共享的默认限速器
+default_limiter = AdaptiveRateLimiter()
+
+def _send(getter, url, attempt, **kwargs):
+    # 发出一次请求并记录耗时、请求数与重试次数，流式请求只计到收到响应头为止
+    host = urlparse(url).hostname
+    default_metrics.incr('requests', host=host)
+    if attempt:
+        default_metrics.incr('retries', host=host)
+    with default_metrics.span('http_fetch', host=host):
+        return getter(url, **kwargs)
+
+def limited_get(url, session=None, limiter=None, max_retries=3, **kwargs):
+    """
+    经过限速器发送GET请求，遇到HTTP层面的限流会降速并重试
+    :param url: 请求的url
+    :param session: 使用的requests.Session，为None时使用requests.get
+    :param limiter: 限速器，为None时使用default_limiter
+    :param max_retries: 被限流时的最大重试次数
+    :param kwargs: 传给requests的其他参数
+    :return: requests.Response
+    """
+    limiter = limiter or default_limiter
+    getter = session.get if session is not None else _requests_get()
+    for attempt in range(max_retries + 1):
+        limiter.acquire(url)
+        response = _send(getter, url, attempt, **kwargs)
+        if not limiter.feedback(url, response.status_code) or attempt == max_retries:
+            return response
+        response.close()
+
+def limited_get_json(url, session=None, limiter=None, max_retries=3, **kwargs):
+    """
+    经过限速器请求json接口，HTTP状态码或json中的code为限流信号时降速并重试
+    :return: 解析后的json字典
+    """
+    limiter = limiter or default_limiter
+    getter = session.get if session is not None else _requests_get()
+    for attempt in range(max_retries + 1):
+        limiter.acquire(url)
+        response = _send(getter, url, attempt, **kwargs)
+        try:
+            with default_metrics.span('json_parse'):
+                data = json.loads(response.text)
+        except ValueError:
+            data = None
+        api_code = data.get('code') if isinstance(data, dict) else None
+        if not limiter.feedback(url, response.status_code, api_code) or attempt == max_retries:
+            if data is None:
+                response.raise_for_status()
+                raise ValueError(f'接口返回的内容不是json：{url}')
+            return data
@@ -0,0 +1,210 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qsl, urlencode
+from Instrumentation import default_metrics
+
+# 各接口的缓存有效期(秒)，视频统计数据变化较快，UP主信息变化较慢
+DEFAULT_TTLS = {
+    '/x/web-interface/view': 6 * 3600,
+    '/x/web-interface/card': 24 * 3600,
+}
+
+class ResponseCache:
+    """
+    接口响应缓存：进程内的LRU字典在前，SQLite持久化缓存在后
+    按接口路径与排序后的参数生成缓存键，支持按接口设置有效期，磁盘缓存超过容量上限时按最近访问时间淘汰
+    """
+    def __init__(self, path='api_cache.sqlite', ttls=None, default_ttl=3600, max_bytes=256 * 1024 * 1024,
+                 memo_size=10000):
+        """
+        :param path: SQLite文件路径，为None时只使用进程内缓存
+        :param ttls: 接口路径到有效期(秒)的映射，默认为DEFAULT_TTLS
+        :param default_ttl: 未配置的接口使用的有效期
+        :param max_bytes: 磁盘缓存的容量上限(字节)
+        :param memo_size: 进程内缓存的最大条目数
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # 正在请求中的缓存键，避免多个线程同时请求同一个url
+        self.inflight = {}
+        self._conn = None
+        self._total_bytes = None
+
+    @staticmethod
+    def make_key(url):
+        """
+        :param url: 请求的url
+        :return: (接口路径, 缓存键)，缓存键为接口路径加上按名称排序后的参数
+        """
+        parsed = urlparse(url)
+        params = urlencode(sorted(parse_qsl(parsed.query)))
+        return parsed.path, f'{parsed.path}?{params}'
+
+    def ttl_for(self, endpoint):
+        return self.ttls.get(endpoint, self.default_ttl)
+
+    def _db(self):
+        # 首次使用时才打开数据库，导入模块时不创建文件
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, '
+                               'body TEXT, size INTEGER, expires_at REAL, accessed_at REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)')
+            self._conn.commit()
+            self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        return self._conn
+
+    def _memo_put(self, key, expires_at, data):
+        self.memo[key] = (expires_at, data)
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def _lookup(self, key, now):
+        # 调用方需持有self.lock，返回(数据, 是否来自磁盘)，未命中返回(None, False)
+        entry = self.memo.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.memo.move_to_end(key)
+                return entry[1], False
+            del self.memo[key]
+        if self.path is not None:
+            db = self._db()
+            row = db.execute('SELECT body, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] > now:
+                db.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+                db.commit()
+                data = json.loads(row[0])
+                self._memo_put(key, row[1], data)
+                return data, True
+        return None, False
+
+    def _count(self, data, from_disk):
+        if data is None:
+            self.misses += 1
+            default_metrics.incr('cache_misses')
+        else:
+            self.hits += 1
+            if from_disk:
+                self.disk_hits += 1
+            default_metrics.incr('cache_hits', tier='disk' if from_disk else 'memo')
+
+    def get(self, url):
+        """
+        :param url: 请求的url
+        :return: 缓存中未过期的json字典，没有则返回None
+        """
+        _, key = self.make_key(url)
+        with self.lock:
+            data, from_disk = self._lookup(key, time.time())
+            self._count(data, from_disk)
+            return data
+
+    def put(self, url, data):
+        """
+        写入缓存，磁盘缓存超过容量上限时淘汰最久未访问的条目
+        :param url: 请求的url
+        :param data: 接口返回的json字典
+        """
+        endpoint, key = self.make_key(url)
+        now = time.time()
+        expires_at = now + self.ttl_for(endpoint)
+        with self.lock:
+            self._memo_put(key, expires_at, data)
+            if self.path is None:
+                return
+            db = self._db()
+            body = json.dumps(data, ensure_ascii=False)
+            size = len(body.encode('utf-8'))
+            old = db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                       (key, endpoint, body, size, expires_at, now))
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict(db)
+            db.commit()
+
+    def _evict(self, db):
+        # 先删除已过期的条目，仍超出上限时按最近访问时间从旧到新删除
+        db.execute('DELETE FROM responses WHERE expires_at <= ?', (time.time(),))
+        self._total_bytes = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        target = self.max_bytes * 0.9
+        for key, size in db.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall():
+            if self._total_bytes <= target:
+                break
+            db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._total_bytes -= size
+
+    def get_or_fetch(self, url, fetch):
+        """
+        优先从缓存读取，未命中时调用fetch请求网络，并发请求同一个url时只有一个线程真正发出请求
+        只缓存code为0的成功响应
+        :param url: 请求的url
+        :param fetch: 无参函数，返回接口的json字典
+        :return: json字典
+        """
+        _, key = self.make_key(url)
+        with self.lock:
+            data, from_disk = self._lookup(key, time.time())
+            if data is None:
+                event = self.inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self.inflight[key] = threading.Event()
+                    self._count(None, False)
+            else:
+                self._count(data, from_disk)
+                return data
+        if not owner:
+            # 等待正在请求同一个url的线程，之后直接读取它写入的缓存
+            event.wait()
+            with self.lock:
+                data, _ = self._lookup(key, time.time())
+                self._count(data, False)
+            return data if data is not None else fetch()
+        try:
+            data = fetch()
+            if isinstance(data, dict) and data.get('code') == 0:
+                self.put(url, data)
+            return data
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            event.set()
+
+    def stats(self):
+        """
+        :return: 命中与未命中次数的统计
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memo_hits': self.hits - self.disk_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'memo_entries': len(self.memo),
+                'disk_bytes': self._total_bytes or 0,
+            }
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# 爬虫共享的默认缓存
+default_cache = ResponseCache()
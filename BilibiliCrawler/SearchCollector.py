@@ -0,0 +1,138 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from RateLimiter import default_limiter, limited_get, limited_get_json
+
+# 搜索接口与获取WBI签名密钥的接口
+SEARCH_API_URL = 'https://api.bilibili.com/x/web-interface/wbi/search/type'
+NAV_API_URL = 'https://api.bilibili.com/x/web-interface/nav'
+HOME_URL = 'https://www.bilibili.com'
+# B站搜索结果最多显示42页
+MAX_PAGES = 42
+
+# WBI签名中打乱img_key+sub_key所用的下标表
+MIXIN_KEY_ENC_TAB = [
+    46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
+    33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40,
+    61, 26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11,
+    36, 20, 34, 44, 52
+]
+
+def get_mixin_key(img_key, sub_key):
+    """
+    :return: 由img_key与sub_key按下标表重排后取前32位得到的签名密钥
+    """
+    orig = img_key + sub_key
+    return ''.join(orig[i] for i in MIXIN_KEY_ENC_TAB)[:32]
+
+def sign_params(params, mixin_key, wts=None):
+    """
+    为请求参数加上WBI签名
+    :param params: 请求参数字典
+    :param mixin_key: get_mixin_key得到的签名密钥
+    :param wts: 时间戳，默认为当前时间
+    :return: 加上wts与w_rid的新参数字典
+    """
+    params = dict(params)
+    params['wts'] = int(time.time()) if wts is None else wts
+    params = {key: ''.join(ch for ch in str(value) if ch not in "!'()*") for key, value in sorted(params.items())}
+    query = urlencode(params)
+    params['w_rid'] = hashlib.md5((query + mixin_key).encode('utf-8')).hexdigest()
+    return params
+
+class SearchCollector:
+    """
+    不启动浏览器，直接请求搜索接口获取关键词的BV号，多页并发请求
+    """
+    def __init__(self, concurrency=4, limiter=None, headers=None, timeout=10):
+        """
+        :param concurrency: 同时请求的页数
+        :param limiter: 限速器，默认使用RateLimiter.default_limiter
+        :param headers: 额外的请求头，如Cookie
+        :param timeout: 单次请求的超时时间(秒)
+        """
+        self.concurrency = concurrency
+        self.limiter = limiter or default_limiter
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'referer': 'https://search.bilibili.com',
+            'origin': 'https://search.bilibili.com',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        })
+        if headers:
+            self.session.headers.update({key: value for key, value in headers.items() if value})
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.mixin_key = None
+
+    def _prepare(self):
+        # 访问一次首页获取buvid3等cookie，并从nav接口取得WBI签名密钥
+        if self.mixin_key is not None:
+            return
+        if 'buvid3' not in self.session.cookies:
+            limited_get(HOME_URL, session=self.session, limiter=self.limiter, timeout=self.timeout).close()
+        nav = limited_get_json(NAV_API_URL, session=self.session, limiter=self.limiter, timeout=self.timeout)
+        wbi_img = nav['data']['wbi_img']
+        img_key = wbi_img['img_url'].rsplit('/', 1)[-1].split('.')[0]
+        sub_key = wbi_img['sub_url'].rsplit('/', 1)[-1].split('.')[0]
+        self.mixin_key = get_mixin_key(img_key, sub_key)
+
+    def fetch_page(self, keyword, page):
+        """
+        :param keyword: 搜索关键词
+        :param page: 页码，从1开始
+        :return: (该页去重后的BV号列表, 总页数)
+        """
+        self._prepare()
+        params = sign_params({'search_type': 'video', 'keyword': keyword, 'page': page}, self.mixin_key)
+        url = f'{SEARCH_API_URL}?{urlencode(params)}'
+        data = limited_get_json(url, session=self.session, limiter=self.limiter, timeout=self.timeout)
+        if data.get('code') != 0:
+            raise RuntimeError(f"搜索接口返回错误：code {data.get('code')}，{data.get('message')}")
+        bv_id_list = []
+        for item in data['data'].get('result') or []:
+            bvid = item.get('bvid')
+            if bvid and bvid not in bv_id_list:
+                bv_id_list.append(bvid)
+        return bv_id_list, data['data'].get('numPages', 1)
+
+    def iter_pages(self, keyword, skip_pages=(), max_pages=MAX_PAGES):
+        """
+        并发获取关键词的各页搜索结果，按页码顺序产出
+        先请求第1页得到总页数，其余页并发请求
+        :param keyword: 搜索关键词
+        :param skip_pages: 已完成、无需产出的页下标集合(从0开始，与spider_bvid中的页下标一致)
+        :param max_pages: 最多获取的页数
+        :return: 生成器，产出(页下标, 该页的BV号列表)
+        """
+        first_page, num_pages = self.fetch_page(keyword, 1)
+        if 0 not in skip_pages:
+            yield 0, first_page
+        todo = [i for i in range(1, min(num_pages, max_pages)) if i not in skip_pages]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [(i, executor.submit(self.fetch_page, keyword, i + 1)) for i in todo]
+            try:
+                for i, future in futures:
+                    yield i, future.result()[0]
+            finally:
+                for _, future in futures:
+                    future.cancel()
+
+    def collect(self, keyword, max_pages=MAX_PAGES):
+        """
+        :return: 关键词全部搜索结果去重后的BV号列表，保持搜索结果中的顺序
+        """
+        seen = set()
+        bv_id_list = []
+        for _, page in self.iter_pages(keyword, max_pages=max_pages):
+            for bvid in page:
+                if bvid not in seen:
+                    seen.add(bvid)
+                    bv_id_list.append(bvid)
+        return bv_id_list
@@ -1,20 +1,45 @@
 # 导入所需的库
 import json
-import re
-from bs4 import BeautifulSoup
+import logging
+import os
 import subprocess
-import requests
-import tkinter as tk
-from tkinter import ttk  # 导入ttk模块，用于更现代化的组件外观
-from tkinter import messagebox, filedialog
-from threading import Thread
+import time
+from threading import Thread, Lock
+from RateLimiter import limited_get, limited_get_json
+from RangeDownloader import RangeDownloader, stream_source, response_validator
+from StreamSelector import StreamSelector, extract_title, extract_playinfo
+from Instrumentation import default_metrics
+
+logger = logging.getLogger(__name__)
+
+# 视频页面，以及页面中没有播放信息时改用的接口，fnval=4048请求全部dash格式
+VIDEO_PAGE_URL = 'https://www.bilibili.com/video/{bvid}'
+VIEW_API_URL = 'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
+PLAYURL_API_URL = 'https://api.bilibili.com/x/player/playurl?bvid={bvid}&cid={cid}&fnval=4048&fourk=1'
+# 重新获取播放地址的最短间隔(秒)，视频和音频同时过期时只获取一次
+REFRESH_INTERVAL = 60
 
 # 定义Bilibili视频下载与合并音视频的类
 class BilibiliVideoAudio:
-    def __init__(self, bvid):
+    def __init__(self, bvid, segments=4, selector=None):
         # 初始化时保存BV号，并创建一个用于发送网络请求的Session
         self.bvid = bvid
+        # 分段并行下载的段数，为1时使用单连接下载
+        self.segments = segments
+        # 按清晰度、编码与码率选择视频流和音频流，默认选择清晰度最高的AVC编码
+        self.selector = selector or StreamSelector()
+        # 播放地址带有签名，过期后重新获取
+        self.refresh_lock = Lock()
+        self.refreshed_streams = None
+        self.refreshed_at = 0
+        # requests在创建下载对象时才导入，只导入本模块的常量与函数时不加载它
+        import requests
+        from requests.adapters import HTTPAdapter
         self.session = requests.Session()
+        # 连接池大小需要容纳视频和音频的全部分段同时下载
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, segments * 2))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         # 设置请求头部信息，模拟浏览器访问，防止被网站屏蔽
         self.session.headers.update({
             "referer": "https://www.bilibili.com",
@@ -24,47 +49,142 @@ class BilibiliVideoAudio:
         })
 
     def get_play_info(self):
+        # 返回标题与选中的视频、音频的主地址
+        title, video_urls, audio_urls = self.get_play_streams()
+        return title, video_urls[0], audio_urls[0]
+
+    def get_play_streams(self):
+        """
+        :return: (标题, 视频地址列表, 音频地址列表)，地址列表中主地址在前、备用地址在后
+        """
         # 根据传入的BV号拼接出视频页面的URL并获取页面HTML内容
-        url = f'https://www.bilibili.com/video/{self.bvid}'
-        response = self.session.get(url)
+        url = VIDEO_PAGE_URL.format(bvid=self.bvid)
+        # 经过共享的限速器发送请求，被限流时自动降速重试
+        response = limited_get(url, session=self.session)
         response.raise_for_status()  # 如果响应状态码不是200，则抛出异常
-        html = response.text
-
-        # 使用BeautifulSoup解析HTML，提取视频的标题
-        soup = BeautifulSoup(html, 'html.parser')
-        meta_tag = soup.find('meta', {'property': 'og:title'})
-        title = meta_tag['content'] if meta_tag else self.bvid  # 如果没有提取到标题就使用BV号代替
-
-        # 使用正则表达式提取视频和音频的URL信息
-        pattern = r'window\.__playinfo__=(\{.*?\})</script>'
-        match = re.search(pattern, html)
-        if not match:
+        page = response.text
+
+        # 只扫描标题所在的meta标签与__playinfo__所在的位置，不解析整个页面
+        with default_metrics.span('html_parse', page='video'):
+            title = extract_title(page) or self.bvid  # 如果没有提取到标题就使用BV号代替
+            play_info = extract_playinfo(page)
+        if not play_info or 'dash' not in (play_info.get('data') or {}):
+            # 页面中没有播放信息时改用playurl接口
+            api_title, play_info = self.fetch_playurl()
+            title = title if title != self.bvid else api_title
+
+        video_urls, audio_urls = self.selector.select(play_info['data']['dash'])
+        return title, video_urls, audio_urls
+
+    def fetch_playurl(self):
+        """
+        通过视频信息接口取得cid，再请求playurl接口
+        :return: (标题, 与__playinfo__格式相同的播放信息)
+        """
+        view = limited_get_json(VIEW_API_URL.format(bvid=self.bvid), session=self.session)
+        if view.get('code') != 0:
+            raise Exception(f"获取视频信息失败：code {view.get('code')}，{view.get('message')}")
+        play_info = limited_get_json(PLAYURL_API_URL.format(bvid=self.bvid, cid=view['data']['cid']),
+                                     session=self.session)
+        if play_info.get('code') != 0 or 'dash' not in (play_info.get('data') or {}):
             raise Exception('未能找到播放信息')
-        play_info_json = match.group(1)
-        play_info = json.loads(play_info_json)  # 将JSON格式的字符串解析为Python字典对象
-
-        # 从解析出的信息中提取视频和音频的URL
-        video_url = play_info['data']['dash']['video'][0]['baseUrl']
-        audio_url = play_info['data']['dash']['audio'][0]['baseUrl']
-
-        return title, video_url, audio_url
-
-    def download_file(self, url, file_path, progress_callback):
+        return view['data'].get('title') or self.bvid, play_info
+
+    def refresh_urls(self, kind):
+        """
+        重新获取播放地址，用于签名过期后继续下载
+        :param kind: 'video'或'audio'
+        :return: 新的地址列表
+        """
+        with self.refresh_lock:
+            if self.refreshed_streams is None or time.monotonic() - self.refreshed_at > REFRESH_INTERVAL:
+                logger.warning('%s的下载地址可能已过期，重新获取播放地址', self.bvid)
+                default_metrics.incr('url_refreshes')
+                _, video_urls, audio_urls = self.get_play_streams()
+                self.refreshed_streams = {'video': video_urls, 'audio': audio_urls}
+                self.refreshed_at = time.monotonic()
+            return self.refreshed_streams[kind]
+
+    def download_file(self, url, file_path, progress_callback, refresh=None):
+        # url可以是一个地址，也可以是主地址在前、备用地址在后的地址列表，一个地址失败时换下一个
+        # 全部地址都失败且传入了refresh时，调用refresh获取新地址后从已下载的位置继续
+        urls = as_url_list(url)
+        with default_metrics.span('download'):
+            while True:
+                error = None
+                for i, mirror in enumerate(urls):
+                    try:
+                        self._download_from(mirror, file_path, progress_callback)
+                        return
+                    except Exception as e:
+                        error = e
+                        if i < len(urls) - 1:
+                            logger.warning('%s下载失败：%s，改用备用地址', file_path, e)
+                            default_metrics.incr('mirror_failovers')
+                if error is None:
+                    error = ValueError(f'{file_path}没有可用的下载地址')
+                if refresh is None:
+                    raise error
+                logger.warning('%s下载失败：%s，重新获取下载地址后继续', file_path, error)
+                urls, refresh = as_url_list(refresh()), None
+
+    def _download_from(self, url, file_path, progress_callback):
+        # 服务器支持Range请求时分段并行下载，否则使用单连接流式下载
+        if self.segments > 1:
+            downloader = RangeDownloader(self.session, segments=self.segments)
+            if downloader.download(url, file_path, progress_callback) is not None:
+                logger.info('下载完成：%s', file_path)
+                return
+        # 单连接下载时先写入.part文件，中断后再次下载时用Range请求从已有的大小继续
+        # .part.json记录.part属于哪一路流及服务器的校验值，换了流或文件已变化时不能接在已有部分后面
+        part_path = f'{file_path}.part'
+        meta_path = f'{part_path}.json'
+        source = stream_source(url)
+        meta = read_part_meta(meta_path)
+        offset = 0
+        if os.path.isfile(part_path) and meta is not None and meta.get('source') == source:
+            offset = os.path.getsize(part_path)
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if meta.get('validator'):
+                headers['If-Range'] = meta['validator']
         # 通过流式请求下载大文件，如视频或音频
-        with self.session.get(url, stream=True) as response:
+        with limited_get(url, session=self.session, stream=True, headers=headers) as response:
+            if response.status_code == 416 or (offset and response.status_code == 206 and
+                                               response_validator(response) != meta.get('validator')):
+                # 已有部分与服务器上的文件不一致，从头下载
+                logger.info('%s对应的文件已变化，从头下载', file_path)
+                for path in (part_path, meta_path):
+                    if os.path.isfile(path):
+                        os.remove(path)
+                return self._download_from(url, file_path, progress_callback)
             response.raise_for_status()  # 确保请求成功
+            if response.status_code != 206:
+                # 服务器不支持Range请求，或If-Range不匹配时返回了整个文件，从头下载
+                offset = 0
+                write_part_meta(meta_path, {'source': source, 'validator': response_validator(response)})
             total_length = int(response.headers.get('content-length', 0))  # 获取内容的总长度
+            if total_length:
+                total_length += offset
 
             # 打开文件进行写入
-            with open(file_path, 'wb') as file:
-                downloaded = 0
-                for chunk in response.iter_content(chunk_size=8192):
+            with open(part_path, 'ab' if offset else 'wb') as file:
+                downloaded = offset
+                for chunk in response.iter_content(chunk_size=256 * 1024):
                     if chunk:  # 过滤掉keep-alive的新chunk
                         file.write(chunk)
                         downloaded += len(chunk)
+                        default_metrics.incr('bytes_downloaded', len(chunk))
                         if progress_callback:  # 如果有进度回调函数，则调用它更新进度
                             progress_callback(downloaded, total_length)
-        print(f'下载完成：{file_path}')
+        # 大小与Content-Length一致才算下载完成，否则保留.part文件供下次继续
+        if total_length and os.path.getsize(part_path) != total_length:
+            raise IOError(f'{file_path}下载不完整：{os.path.getsize(part_path)}/{total_length}字节')
+        os.replace(part_path, file_path)
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+        logger.info('下载完成：%s', file_path)
 
     def merge_video_audio(self, video_path, audio_path, output_path):
         # 使用环境变量中的ffmpeg进行调用，这样不需要指定具体路径
@@ -74,134 +194,163 @@ class BilibiliVideoAudio:
         cmd = [FFMPEG_CMD, '-y', '-i', video_path, '-i', audio_path, '-c', 'copy', output_path]
 
         # 执行命令并等待完成
-        subprocess.run(cmd, check=True)
-        print(f'合并文件完成：{output_path}')
-
-class BilibiliApp(tk.Tk):
-    def __init__(self):
-        # 初始化父类构造器
-        super().__init__()
-        # 加载图标文件
-        self.iconbitmap('../ico/Bilibili.ico')
-        # 设置窗口标题和大小
-        self.title('Bilibili视频下载器')
-        self.geometry('500x300')
-        # 创建窗口组件
-        self.create_widgets()
-
-
-    def update_progress(self, downloaded, total_length):
-        # 根据下载的字节数和总字节数更新进度条的值
-        progress = int((downloaded / total_length) * 100)
-        # 设置进度条的新值，以更新显示
-        self.progress['value'] = progress
-        # 更新界面，以反映进度条的变化
-        self.update_idletasks()
-
-    def create_widgets(self):
-        # 配置应用界面的样式和布局
-        self.style = ttk.Style(self)
-        # 使用clam风格，你可以试验其他风格如'alt', 'default', 'classic'等
-        self.style.theme_use('clam')
-
-        # 创建界面元素并放置它们
-        # 设定一些样式
-        self.style.configure('TLabel', font=('Arial', 11), padding=5)
-        self.style.configure('TButton', font=('Arial', 11), padding=5)
-        self.style.configure('TEntry', font=('Arial', 11), padding=5)
-
-        # 输入框标签
-        label = ttk.Label(self, text='请输入Bilibili视频BV号:', style='TLabel')
-        label.grid(column=0, row=0, padx=10, pady=10, sticky='w')
-
-        # 输入框
-        self.bv_input = ttk.Entry(self, width=50, style='TEntry')
-        self.bv_input.grid(column=1, row=0, padx=10, pady=10, sticky='ew')
-
-        # 下载按钮
-        download_button = ttk.Button(self, text='下载', command=self.start_download_thread, style='TButton')
-        download_button.grid(column=2, row=0, padx=10, pady=10, sticky='ew')
-
-        # 保存位置按钮
-        save_button = ttk.Button(self, text='选择保存位置', command=self.choose_directory, style='TButton')
-        save_button.grid(column=0, row=1, padx=10, pady=10, sticky='ew')
-
-        # 保存路径标签
-        self.save_path_label = ttk.Label(self, text='未选择保存位置', style='TLabel')
-        self.save_path_label.grid(column=1, row=1, padx=10, pady=10, columnspan=2, sticky='w')
-
-        # 下载进度条
-        self.progress = ttk.Progressbar(self, orient='horizontal', length=300, mode='determinate')
-        self.progress.grid(column=0, row=2, columnspan=3, padx=10, pady=10, sticky='ew')
-
-        # 下载状态标签
-        self.status_label = ttk.Label(self, text='准备下载...', style='TLabel')
-        self.status_label.grid(column=0, row=3, columnspan=3, padx=10, pady=10, sticky='w')
-
-        # 使用grid布局管理器来放置组件
-        # 列和行的权重设定确保组件间隔均匀，并且随窗口大小调整而调整
-
-    def update_status(self, status):
-        # 在GUI中安全地更新状态标签的文本
-        # 使用after方法避免线程直接更新GUI，这可能会导致线程问题
-        self.status_label.config(text=status)
-
-    def choose_directory(self):
-        # 使用文件对话框选择保存下载文件的目录
-        self.save_directory = filedialog.askdirectory()
-        # 更新标签以显示选择的目录。如果未选择，则显示未选择保存位置
-        self.save_path_label.config(text=f'保存位置：{self.save_directory}' if self.save_directory else '未选择保存位置')
-
-    def start_download_thread(self):
-        # 启动一个新线程进行下载，避免在下载过程中阻塞GUI
-        bv_number = self.bv_input.get()
-        if bv_number:
-            # 输入框有内容，即BV号不为空，开始下载
-            thread = Thread(target=self.download_video, args=(bv_number,))
-            thread.start()
-        else:
-            # BV号为空，显示错误信息
-            messagebox.showerror('错误', 'BV号不能为空！')
-
-    def download_video(self, bvid):
-        # 实际执行下载工作的函数
+        with default_metrics.span('ffmpeg_merge', mode='file'):
+            subprocess.run(cmd, check=True)
+        logger.info('合并文件完成：%s', output_path)
+
+    @staticmethod
+    def can_stream_merge():
+        # 通过管道把数据直接交给ffmpeg需要pass_fds，仅在POSIX系统上可用
+        return os.name == 'posix'
+
+    def open_stream(self, url):
+        # 依次尝试主地址与备用地址，返回第一个请求成功的流式响应
+        urls = as_url_list(url)
+        for i, mirror in enumerate(urls):
+            try:
+                response = limited_get(mirror, session=self.session, stream=True)
+                response.raise_for_status()
+                return response
+            except Exception as e:
+                if i == len(urls) - 1:
+                    raise
+                logger.warning('请求失败：%s，改用备用地址', e)
+                default_metrics.incr('mirror_failovers')
+
+    def stream_merge(self, video_url, audio_url, output_path, progress_callback=None):
+        # 同时下载视频流和音频流，通过两个管道直接交给ffmpeg合并，不产生中间文件
+        FFMPEG_CMD = 'ffmpeg'
+        video_read, video_write = os.pipe()
+        audio_read, audio_write = os.pipe()
+        cmd = [FFMPEG_CMD, '-y', '-loglevel', 'error', '-i', f'pipe:{video_read}', '-i', f'pipe:{audio_read}',
+               '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', output_path]
+        started = time.perf_counter()
         try:
-            # 创建下载器实例
-            bili = BilibiliVideoAudio(bvid)
-            # 获取视频信息
-            title, video_url, audio_url = bili.get_play_info()
-            # 标题中不合法的字符替换掉，避免创建文件时出错
-            sanitized_title = re.sub(r'[\\/*?:"<>|]', '', title)
-
-            # 检查是否已经选择了保存目录
-            if hasattr(self, 'save_directory') and self.save_directory:
-                save_path = self.save_directory
-            else:
-                save_path = '.'
-
-            # 拼接出完整的文件保存路径
-            video_path = f'{save_path}/{sanitized_title}.mp4'
-            audio_path = f'{save_path}/{sanitized_title}.mp3'
-            output_path = f'{save_path}/{sanitized_title}_合并.mp4'
-
-            # 依次下载视频和音频，并更新GUI状态
-            self.update_status('正在下载视频...')
-            bili.download_file(video_url, video_path, self.update_progress)
-            self.update_status('正在下载音频...')
-            bili.download_file(audio_url, audio_path, self.update_progress)
-
-            # 合并视频和音频文件，并更新状态
-            self.update_status('正在合并视频和音频...')
-            bili.merge_video_audio(video_path, audio_path, output_path)
-            self.update_status('下载和合并完成！')
-
-            # 一切完成，弹出提示窗口告知用户
-            messagebox.showinfo('完成', f'视频已下载并合并完成：{output_path}')
-        except Exception as e:
-            # 发生错误时弹出错误提示
-            messagebox.showerror('错误', str(e))
-
-# 主程序入口
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, pass_fds=(video_read, audio_read))
+        except Exception:
+            for fd in (video_write, audio_write):
+                os.close(fd)
+            raise
+        finally:
+            # 读端已交给ffmpeg，本进程只保留写端
+            os.close(video_read)
+            os.close(audio_read)
+
+        report = combine_progress(progress_callback)
+        errors = []
+
+        def pump(url, fd, key):
+            try:
+                with os.fdopen(fd, 'wb') as pipe, self.open_stream(url) as response:
+                    total_length = int(response.headers.get('content-length', 0))
+                    downloaded = 0
+                    for chunk in response.iter_content(chunk_size=256 * 1024):
+                        if chunk:
+                            pipe.write(chunk)
+                            downloaded += len(chunk)
+                            default_metrics.incr('bytes_downloaded', len(chunk))
+                            report(key, downloaded, total_length)
+                    # 与下载到文件时相同，大小与Content-Length一致才算完整，否则不能把合并结果当作完成
+                    if total_length and downloaded != total_length:
+                        raise IOError(f'{url}下载不完整：{downloaded}/{total_length}字节')
+            except BrokenPipeError:
+                # ffmpeg提前退出，错误由其返回码反映
+                pass
+            except Exception as e:
+                errors.append(e)
+                process.kill()
+
+        threads = [Thread(target=pump, args=(video_url, video_write, 'video'), daemon=True),
+                   Thread(target=pump, args=(audio_url, audio_write, 'audio'), daemon=True)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        returncode = process.wait()
+        # 边下载边合并时下载与合并无法分开计时，整个过程记为一次stream模式的合并
+        default_metrics.observe('ffmpeg_merge', time.perf_counter() - started, mode='stream')
+        if errors or returncode != 0:
+            default_metrics.incr('ffmpeg_merge_errors', mode='stream')
+        if errors:
+            raise errors[0]
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        logger.info('合并文件完成：%s', output_path)
+
+    def download_and_merge(self, video_url, audio_url, output_path, progress_callback=None,
+                           video_path=None, audio_path=None):
+        # 同时下载视频和音频并合并，支持时边下载边合并，否则同时下载到video_path/audio_path后再合并
+        if self.can_stream_merge():
+            self.stream_merge(video_url, audio_url, output_path, progress_callback)
+            return
+        self.download_both(video_url, audio_url, video_path, audio_path, progress_callback)
+        self.merge_video_audio(video_path, audio_path, output_path)
+
+    def download_both(self, video_url, audio_url, video_path, audio_path, progress_callback=None):
+        # 同时下载视频和音频到文件，进度按两者之和计算
+        report = combine_progress(progress_callback)
+        errors = []
+
+        def fetch(url, file_path, key):
+            try:
+                self.download_file(url, file_path, lambda downloaded, total: report(key, downloaded, total),
+                                   refresh=lambda: self.refresh_urls(key))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=fetch, args=(video_url, video_path, 'video')),
+                   Thread(target=fetch, args=(audio_url, audio_path, 'audio'))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+def read_part_meta(path):
+    # 读取.part文件对应的流与校验值，不存在或已损坏时返回None
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_part_meta(path, meta):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+
+def as_url_list(url):
+    # 把单个地址或地址列表统一为列表
+    return [url] if isinstance(url, str) else list(url)
+
+def combine_progress(progress_callback):
+    # 把视频和音频各自的进度合并为一个总进度，返回的函数参数为(流的名称, 已下载字节数, 总字节数)
+    lock = Lock()
+    downloaded = {}
+    totals = {}
+
+    def report(key, done, total):
+        with lock:
+            downloaded[key] = done
+            totals[key] = total
+            all_done = sum(downloaded.values())
+            all_total = sum(totals.values())
+            # 在锁内回调，视频与音频两个线程上报的总进度不会乱序
+            if progress_callback and all_total:
+                progress_callback(all_done, all_total)
+
+    return report
+
+def __getattr__(name):
+    # 图形界面已移到SpiderNetGui，作为库使用时不导入tkinter，仍可通过SpiderNet.BilibiliApp访问
+    if name in ('BilibiliApp', 'PROGRESS_INTERVAL'):
+        import SpiderNetGui
+        return getattr(SpiderNetGui, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+# 主程序入口，启动图形界面
 if __name__ == '__main__':
-    app = BilibiliApp()
-    app.mainloop()  # 开始应用的主事件循环
+    from SpiderNetGui import main
+    main()
@@ -0,0 +1,161 @@
+# 导入所需的库
+import argparse
+import tkinter as tk
+from tkinter import ttk  # 导入ttk模块，用于更现代化的组件外观
+from tkinter import messagebox, filedialog
+from DownloadManager import DownloadManager, load_bvids, parse_bvids
+from TransferMeter import format_size, format_eta
+from Instrumentation import configure_logging, LOG_LEVELS
+
+# 界面刷新下载进度的间隔(毫秒)，与下载速度无关
+PROGRESS_INTERVAL = 250
+
+class BilibiliApp(tk.Tk):
+    def __init__(self):
+        # 初始化父类构造器
+        super().__init__()
+        # 加载图标文件
+        self.iconbitmap('../ico/Bilibili.ico')
+        # 设置窗口标题和大小
+        self.title('Bilibili视频下载器')
+        self.geometry('800x480')
+        # 下载队列，所有任务在有限的工作线程中执行
+        self.manager = DownloadManager()
+        # 创建窗口组件
+        self.create_widgets()
+        # 下载线程只记录字节数，由主线程按固定频率读取并刷新界面
+        self.after(PROGRESS_INTERVAL, self.refresh_jobs)
+
+    def refresh_jobs(self):
+        # 根据各任务的状态刷新任务列表，进度条显示全部未结束任务的总进度
+        downloaded = total = 0
+        rate = 0.0
+        for job in list(self.manager.jobs):
+            values = (job.bvid, job.title, job.state, f'{job.percent()}%',
+                      f'{format_size(job.downloaded)}/{format_size(job.total)}',
+                      f'{format_size(job.rate())}/s' if job.rate() else '', format_eta(job.eta()))
+            if not self.job_list.exists(job.bvid):
+                self.job_list.insert('', 'end', iid=job.bvid, values=values)
+            elif tuple(self.job_list.item(job.bvid, 'values')) != values:
+                # 内容不变时不更新，避免多余的重绘
+                self.job_list.item(job.bvid, values=values)
+            if job.finished_at is None:
+                downloaded += job.downloaded
+                total += job.total
+                rate += job.rate()
+        self.progress['value'] = int(downloaded * 100 / total) if total else 0
+        if self.manager.jobs:
+            eta = (total - downloaded) / rate if rate and total else None
+            self.update_status(f'任务状态：{self.manager.summary()}  {format_size(downloaded)}/{format_size(total)}  '
+                               f'{format_size(rate)}/s  剩余{format_eta(eta)}')
+        else:
+            self.update_status('准备下载...')
+        self.after(PROGRESS_INTERVAL, self.refresh_jobs)
+
+    def create_widgets(self):
+        # 配置应用界面的样式和布局
+        self.style = ttk.Style(self)
+        # 使用clam风格，你可以试验其他风格如'alt', 'default', 'classic'等
+        self.style.theme_use('clam')
+
+        # 创建界面元素并放置它们
+        # 设定一些样式
+        self.style.configure('TLabel', font=('Arial', 11), padding=5)
+        self.style.configure('TButton', font=('Arial', 11), padding=5)
+        self.style.configure('TEntry', font=('Arial', 11), padding=5)
+
+        # 输入框标签
+        label = ttk.Label(self, text='请输入Bilibili视频BV号(多个用空格分隔):', style='TLabel')
+        label.grid(column=0, row=0, padx=10, pady=10, sticky='w')
+
+        # 输入框
+        self.bv_input = ttk.Entry(self, width=40, style='TEntry')
+        self.bv_input.grid(column=1, row=0, padx=10, pady=10, sticky='ew')
+
+        # 下载按钮
+        download_button = ttk.Button(self, text='下载', command=self.start_download_thread, style='TButton')
+        download_button.grid(column=2, row=0, padx=10, pady=10, sticky='ew')
+
+        # 保存位置按钮
+        save_button = ttk.Button(self, text='选择保存位置', command=self.choose_directory, style='TButton')
+        save_button.grid(column=0, row=1, padx=10, pady=10, sticky='ew')
+
+        # 保存路径标签
+        self.save_path_label = ttk.Label(self, text='未选择保存位置', style='TLabel')
+        self.save_path_label.grid(column=1, row=1, padx=10, pady=10, sticky='w')
+
+        # 从文件导入按钮，支持WebCrawlerX输出的BV号合并.csv
+        import_button = ttk.Button(self, text='从文件导入', command=self.import_bvids, style='TButton')
+        import_button.grid(column=2, row=1, padx=10, pady=10, sticky='ew')
+
+        # 下载进度条
+        self.progress = ttk.Progressbar(self, orient='horizontal', length=300, mode='determinate')
+        self.progress.grid(column=0, row=2, columnspan=3, padx=10, pady=10, sticky='ew')
+
+        # 下载状态标签
+        self.status_label = ttk.Label(self, text='准备下载...', style='TLabel')
+        self.status_label.grid(column=0, row=3, columnspan=3, padx=10, pady=10, sticky='w')
+
+        # 任务列表，显示每个任务的状态与进度
+        self.job_list = ttk.Treeview(self, columns=('bvid', 'title', 'state', 'percent', 'size', 'speed', 'eta'),
+                                     show='headings', height=8)
+        for column, text, width in (('bvid', 'BV号', 110), ('title', '标题', 200), ('state', '状态', 60),
+                                    ('percent', '进度', 50), ('size', '大小', 130), ('speed', '速度', 80),
+                                    ('eta', '剩余时间', 70)):
+            self.job_list.heading(column, text=text)
+            self.job_list.column(column, width=width, anchor='w')
+        self.job_list.grid(column=0, row=4, columnspan=3, padx=10, pady=10, sticky='nsew')
+
+        # 使用grid布局管理器来放置组件
+        # 列和行的权重设定确保组件间隔均匀，并且随窗口大小调整而调整
+        self.columnconfigure(1, weight=1)
+        self.rowconfigure(4, weight=1)
+
+    def update_status(self, status):
+        # 在GUI中安全地更新状态标签的文本
+        # 使用after方法避免线程直接更新GUI，这可能会导致线程问题
+        self.status_label.config(text=status)
+
+    def choose_directory(self):
+        # 使用文件对话框选择保存下载文件的目录
+        self.save_directory = filedialog.askdirectory()
+        # 更新标签以显示选择的目录。如果未选择，则显示未选择保存位置
+        self.save_path_label.config(text=f'保存位置：{self.save_directory}' if self.save_directory else '未选择保存位置')
+        self.manager.save_dir = self.save_directory or '.'
+
+    def import_bvids(self):
+        # 从文件中读取BV号并加入下载队列
+        path = filedialog.askopenfilename(filetypes=[('BV号文件', '*.csv *.txt'), ('所有文件', '*.*')])
+        if not path:
+            return
+        try:
+            bvids = load_bvids(path)
+        except Exception as e:
+            messagebox.showerror('错误', f'读取文件失败：{e}')
+            return
+        self.manager.add_many(bvids)
+        messagebox.showinfo('导入完成', f'已加入{len(bvids)}个下载任务')
+
+    def start_download_thread(self):
+        # 把输入的BV号加入下载队列，由下载管理器的工作线程执行，避免在下载过程中阻塞GUI
+        bvids = parse_bvids(self.bv_input.get())
+        if bvids:
+            # 输入框中有BV号，加入下载队列
+            self.manager.add_many(bvids)
+            self.bv_input.delete(0, tk.END)
+        else:
+            # BV号为空，显示错误信息
+            messagebox.showerror('错误', 'BV号不能为空！')
+
+def main(argv=None):
+    # 图形界面入口
+    parser = argparse.ArgumentParser(description='B站视频下载器的图形界面')
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='info', help='日志详细程度')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    app = BilibiliApp()
+    app.mainloop()  # 开始应用的主事件循环
+
+# 主程序入口
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+import argparse
+import csv
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from RateLimiter import limited_get_json
+from BvidDedup import iter_bvids
+from Instrumentation import default_metrics, configure_logging, MetricsExporter, LOG_LEVELS
+from WebCrawlerX import VIEW_API_URL, CARD_API_URL, HEADERS, fetch_api_json, parse_user_info
+
+logger = logging.getLogger(__name__)
+
+# 只返回统计数据的接口，响应比view接口小得多，不可用时改用view接口
+STAT_API_URL = 'https://api.bilibili.com/x/web-interface/archive/stat?bvid={bvid}'
+# 统计数据的字段，与view接口stat中的名称相同
+STAT_FIELDS = ('view', 'like', 'coin', 'favorite', 'share', 'reply', 'danmaku')
+# 导出历史时的表头，与VIDEO_INFO_FIELDNAMES中的名称一致
+HISTORY_FIELDNAMES = ['BV号', '采集时间', '播放量', '点赞数', '投币数', '收藏数', '分享数', '评论数', '弹幕数']
+# 视频已删除或不可见时接口返回的code，之后不再采集
+GONE_API_CODES = (-404, 62002, 62004, 62012)
+
+HOUR = 3600
+DAY = 24 * HOUR
+# 按视频发布时长确定的最长采集间隔：(发布时长上限, 采集间隔)，新视频变化快，采集得更频繁
+AGE_INTERVALS = ((DAY, HOUR), (7 * DAY, 6 * HOUR), (30 * DAY, DAY), (365 * DAY, 7 * DAY))
+OLD_VIDEO_INTERVAL = 30 * DAY
+# 采集间隔的下限
+MIN_INTERVAL = 15 * 60
+
+ACTIVE = 'active'
+GONE = 'gone'
+
+def age_interval(age):
+    """
+    :param age: 视频发布至今的秒数
+    :return: 该发布时长对应的最长采集间隔
+    """
+    for max_age, interval in AGE_INTERVALS:
+        if age < max_age:
+            return interval
+    return OLD_VIDEO_INTERVAL
+
+def next_interval(age, view, last_view, elapsed, target_change=0.02):
+    """
+    根据发布时长与最近的增长速度计算下次采集的间隔
+    增长越快间隔越短，使相邻两次采集之间的播放量大约变化target_change，但不超过发布时长对应的间隔
+    :param age: 视频发布至今的秒数
+    :param view: 本次的播放量
+    :param last_view: 上次的播放量，首次采集时为None
+    :param elapsed: 距上次采集的秒数
+    :param target_change: 相邻两次采集之间期望的播放量相对变化
+    :return: 秒数
+    """
+    upper = age_interval(age)
+    if last_view is None or elapsed <= 0 or view <= last_view:
+        return upper
+    growth = (view - last_view) / elapsed / max(view, 1)
+    return max(MIN_INTERVAL, min(upper, target_change / growth))
+
+def parse_stat(data):
+    # view接口的data['stat']与archive/stat接口的data中字段相同
+    return tuple(int(data.get(field) or 0) for field in STAT_FIELDS)
+
+class StatsTracker:
+    """
+    视频统计数据的增量采集：视频的静态信息与UP主信息只获取并保存一次，
+    之后只采集播放量等统计数据，带时间戳追加到紧凑的时间序列表中
+    每个视频的下次采集时间按发布时长与最近的增长速度自适应调整，热门新视频采集频繁，旧视频很少采集
+    """
+    def __init__(self, path='video_stats.sqlite', concurrency=8, batch_size=500, target_change=0.02, timeout=10):
+        """
+        :param path: SQLite文件路径
+        :param concurrency: 同时请求的视频数
+        :param batch_size: 每批采集的视频数，每批的结果在一个事务中写入
+        :param target_change: 相邻两次采集之间期望的播放量相对变化，见next_interval
+        :param timeout: 单次请求的超时时间(秒)
+        """
+        self.path = path
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.target_change = target_change
+        self.timeout = timeout
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS videos (id INTEGER PRIMARY KEY, bvid TEXT UNIQUE NOT NULL, '
+                          'aid INTEGER, cid INTEGER, mid INTEGER, title TEXT, tname TEXT, pubdate INTEGER, '
+                          'description TEXT, added_at REAL, status TEXT NOT NULL DEFAULT \'active\', '
+                          'last_polled REAL, last_view INTEGER, next_poll REAL, errors INTEGER NOT NULL DEFAULT 0)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_next_poll ON videos(next_poll)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS uploaders (mid INTEGER PRIMARY KEY, name TEXT, '
+                          'follower INTEGER, archive INTEGER, updated_at REAL)')
+        # 时间序列表按(视频, 时间)聚簇存储，只有整数列，每条记录只有几十字节
+        # 时间精确到秒，同一秒内的多次采集只保留最后一次，与videos中的last_view一致
+        self.conn.execute('CREATE TABLE IF NOT EXISTS stats (video_id INTEGER NOT NULL, ts INTEGER NOT NULL, '
+                          'view INTEGER, likes INTEGER, coin INTEGER, favorite INTEGER, share INTEGER, '
+                          'reply INTEGER, danmaku INTEGER, PRIMARY KEY (video_id, ts)) WITHOUT ROWID')
+        self.conn.commit()
+
+    # 网络请求，在线程池中执行，不访问数据库
+    def _get_json(self, url):
+        return limited_get_json(url, session=self.session, timeout=self.timeout)
+
+    def _fetch_static(self, bvid, known_mids):
+        # 静态信息与首次的统计数据来自同一次view请求，不经过缓存，保证统计数据是最新的
+        view = self._get_json(VIEW_API_URL.format(bvid=bvid))
+        if view.get('code') != 0:
+            raise RuntimeError(f"view接口返回错误：code {view.get('code')}，{view.get('message')}")
+        data = view['data']
+        mid = data['owner']['mid']
+        uploader = None
+        if mid not in known_mids:
+            # UP主信息变化慢，经过缓存请求，同一UP主的多个视频只请求一次
+            uploader = parse_user_info(fetch_api_json(CARD_API_URL.format(mid=mid)))
+        return data, uploader, time.time()
+
+    def _fetch_stat(self, bvid):
+        """
+        :return: (code, 统计数据元组或None, 采集时间)
+        """
+        data = self._get_json(STAT_API_URL.format(bvid=bvid))
+        if data.get('code') not in (0,) + GONE_API_CODES:
+            data = self._get_json(VIEW_API_URL.format(bvid=bvid))
+            if data.get('code') == 0:
+                data = {'code': 0, 'data': data['data']['stat']}
+        code = data.get('code')
+        return code, parse_stat(data['data']) if code == 0 else None, time.time()
+
+    def _map(self, fn, items):
+        # 并发执行fn，出错的项返回异常对象，按输入顺序返回
+        def call(item):
+            try:
+                return fn(item)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(call, items))
+
+    def track(self, bvids):
+        """
+        登记要跟踪的视频，获取并保存新视频的静态信息、UP主信息与第一次统计数据，已登记的视频直接跳过
+        :param bvids: BV号的可迭代对象
+        :return: (新登记的数量, 失败的数量)
+        """
+        added = failed = 0
+        with self.lock:
+            known_mids = {row[0] for row in self.conn.execute('SELECT mid FROM uploaders')}
+        for chunk in _chunks(bvids, self.batch_size):
+            with self.lock:
+                known = {row[0] for row in self.conn.execute(
+                    f'SELECT bvid FROM videos WHERE bvid IN ({",".join("?" * len(chunk))})', chunk)}
+            todo = list(dict.fromkeys(bvid for bvid in chunk if bvid not in known))
+            results = self._map(lambda bvid: self._fetch_static(bvid, known_mids), todo)
+            with self.lock, default_metrics.span('stats_write'), self.conn:
+                for bvid, result in zip(todo, results):
+                    if isinstance(result, Exception):
+                        logger.warning('%s的视频信息获取失败：%s', bvid, result)
+                        failed += 1
+                        continue
+                    self._insert_video(result[0], result[1], result[2])
+                    known_mids.add(result[0]['owner']['mid'])
+                    added += 1
+            logger.info('已登记%s个视频，失败%s个', added, failed)
+        default_metrics.incr('stats_tracked', added)
+        return added, failed
+
+    def _insert_video(self, data, uploader, polled_at):
+        # 调用方需持有self.lock并处于事务中
+        owner = data['owner']
+        if uploader is not None:
+            self.conn.execute('INSERT OR REPLACE INTO uploaders VALUES (?, ?, ?, ?, ?)',
+                              (owner['mid'], owner['name'], uploader['follower'], uploader['archive'], polled_at))
+        stat = parse_stat(data['stat'])
+        age = polled_at - data['pubdate']
+        next_poll = polled_at + next_interval(age, stat[0], None, 0, self.target_change)
+        cursor = self.conn.execute(
+            'INSERT INTO videos (bvid, aid, cid, mid, title, tname, pubdate, description, added_at, last_polled, '
+            'last_view, next_poll) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (data['bvid'], data['aid'], data['cid'], owner['mid'], data['title'], data['tname'], data['pubdate'],
+             data['desc'], polled_at, polled_at, stat[0], next_poll))
+        self.conn.execute('INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (cursor.lastrowid, int(polled_at)) + stat)
+
+    def due(self, limit=None, now=None, polled_before=None, exclude=()):
+        """
+        :param limit: 最多返回的数量
+        :param now: 截止时间，默认为当前时间，为float('inf')时返回全部仍在跟踪的视频
+        :param polled_before: 只返回上次采集早于该时间的视频
+        :param exclude: 不返回的视频id集合，如本轮已经失败过的视频
+        :return: 已到采集时间的(id, BV号, 发布时间, 上次播放量, 上次采集时间)列表，最早到期的在前
+        """
+        now = time.time() if now is None else now
+        sql = 'SELECT id, bvid, pubdate, last_view, last_polled FROM videos WHERE next_poll <= ?'
+        params = [now]
+        if polled_before is not None:
+            sql += ' AND last_polled < ?'
+            params.append(polled_before)
+        # 多取len(exclude)行，过滤掉排除的视频后仍有limit个
+        with self.lock:
+            rows = self.conn.execute(sql + ' ORDER BY next_poll LIMIT ?',
+                                     params + [-1 if limit is None else limit + len(exclude)]).fetchall()
+        rows = [row for row in rows if row[0] not in exclude]
+        return rows if limit is None else rows[:limit]
+
+    def refresh(self, limit=None, force=False):
+        """
+        采集全部已到采集时间的视频的统计数据，按批并发请求，每批在一个事务中写入
+        :param limit: 本次最多采集的视频数
+        :param force: 为True时忽略采集时间，采集全部仍在跟踪的视频
+        :return: {'polled': 成功数, 'failed': 失败数, 'gone': 已删除的视频数}
+        """
+        counts = {'polled': 0, 'failed': 0, 'gone': 0}
+        # 采集过程中写入的下次采集时间都晚于开始时间，按开始时间取到期视频，不会重复采集同一个视频
+        started = time.time()
+        # 失败的视频不更新上次采集时间，force时需要单独记录，本轮不再重试
+        failed_ids = set()
+        while limit is None or sum(counts.values()) < limit:
+            size = self.batch_size if limit is None else min(self.batch_size, limit - sum(counts.values()))
+            if force:
+                batch = self.due(size, float('inf'), polled_before=started, exclude=failed_ids)
+            else:
+                batch = self.due(size, started)
+            if not batch:
+                break
+            results = self._map(lambda row: self._fetch_stat(row[1]), batch)
+            with self.lock, default_metrics.span('stats_write'), self.conn:
+                for row, result in zip(batch, results):
+                    category = self._store_result(row, result)
+                    counts[category] += 1
+                    if category == 'failed':
+                        failed_ids.add(row[0])
+            default_metrics.incr('stats_polled', len(batch))
+            logger.info('已采集%s个视频的统计数据，失败%s个，已删除%s个', counts['polled'], counts['failed'],
+                        counts['gone'])
+        return counts
+
+    def _store_result(self, row, result):
+        # 调用方需持有self.lock并处于事务中，返回计入的类别
+        video_id, bvid, pubdate, last_view, last_polled = row
+        if isinstance(result, Exception) or result[0] not in (0,) + GONE_API_CODES:
+            # 请求失败时按连续失败的次数退避，不超过正常的采集间隔
+            error = result if isinstance(result, Exception) else f'code {result[0]}'
+            logger.warning('%s的统计数据获取失败：%s', bvid, error)
+            self.conn.execute('UPDATE videos SET errors = errors + 1, next_poll = ? + MIN(? * (1 << MIN(errors, 6)), '
+                              '?) WHERE id = ?', (time.time(), MIN_INTERVAL, OLD_VIDEO_INTERVAL, video_id))
+            return 'failed'
+        code, stat, polled_at = result
+        if code != 0:
+            self.conn.execute('UPDATE videos SET status = ?, next_poll = NULL WHERE id = ?', (GONE, video_id))
+            return 'gone'
+        self.conn.execute('INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (video_id, int(polled_at)) + stat)
+        elapsed = polled_at - last_polled if last_polled else 0
+        interval = next_interval(polled_at - (pubdate or 0), stat[0], last_view, elapsed, self.target_change)
+        self.conn.execute('UPDATE videos SET last_polled = ?, last_view = ?, next_poll = ?, errors = 0 WHERE id = ?',
+                          (polled_at, stat[0], polled_at + interval, video_id))
+        return 'polled'
+
+    def run_forever(self, max_sleep=300):
+        """
+        持续运行：采集到期的视频，之后等待到下一个视频到期，适合作为常驻进程每天跟踪大量视频
+        :param max_sleep: 每次等待的最长秒数，期间新登记的视频最迟在这个时间后开始采集
+        """
+        while True:
+            self.refresh()
+            with self.lock:
+                next_poll = self.conn.execute('SELECT MIN(next_poll) FROM videos').fetchone()[0]
+            wait = max_sleep if next_poll is None else min(max_sleep, max(0.0, next_poll - time.time()))
+            logger.debug('等待%.0fs后继续采集', wait)
+            time.sleep(wait)
+
+    def history(self, bvid):
+        """
+        :return: 该视频的(采集时间, 播放量, 点赞数, 投币数, 收藏数, 分享数, 评论数, 弹幕数)列表，按时间排序
+        """
+        with self.lock:
+            return self.conn.execute('SELECT ts, view, likes, coin, favorite, share, reply, danmaku FROM stats '
+                                     'WHERE video_id = (SELECT id FROM videos WHERE bvid = ?) ORDER BY ts',
+                                     (bvid,)).fetchall()
+
+    def export_history(self, filename, since=None):
+        """
+        把时间序列流式导出为csv，每次采集一行
+        :param filename: 输出的csv文件
+        :param since: 只导出该时间戳之后的采集
+        :return: 导出的行数
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                'SELECT v.bvid, s.ts, s.view, s.likes, s.coin, s.favorite, s.share, s.reply, s.danmaku '
+                'FROM stats s JOIN videos v ON v.id = s.video_id WHERE s.ts >= ? ORDER BY s.video_id, s.ts',
+                (since or 0,))
+            written = 0
+            with open(filename, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(HISTORY_FIELDNAMES)
+                while True:
+                    rows = cursor.fetchmany(10000)
+                    if not rows:
+                        break
+                    writer.writerows((bvid, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))) + tuple(stat)
+                                     for bvid, ts, *stat in rows)
+                    written += len(rows)
+        return written
+
+    def summary(self):
+        """
+        :return: 跟踪中与已删除的视频数、采集记录数、已到期待采集的视频数
+        """
+        with self.lock:
+            counts = dict(self.conn.execute('SELECT status, COUNT(*) FROM videos GROUP BY status').fetchall())
+            counts['snapshots'] = self.conn.execute('SELECT COUNT(*) FROM stats').fetchone()[0]
+            counts['due'] = self.conn.execute('SELECT COUNT(*) FROM videos WHERE next_poll <= ?',
+                                              (time.time(),)).fetchone()[0]
+        return counts
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        self.session.close()
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def main(argv=None):
+    # 命令行入口：登记视频、采集到期的统计数据、导出时间序列
+    parser = argparse.ArgumentParser(description='增量跟踪B站视频的播放量、点赞数等统计数据')
+    parser.add_argument('--db', default='video_stats.sqlite', help='保存静态信息与时间序列的SQLite文件')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='同时请求的视频数')
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='info', help='日志详细程度')
+    parser.add_argument('--metrics-file', help='定期把请求数与耗时写入该文件')
+    commands = parser.add_subparsers(dest='command', required=True)
+    track = commands.add_parser('track', help='登记要跟踪的视频，只在首次获取静态信息与UP主信息')
+    track.add_argument('bvids', nargs='*', help='BV号')
+    track.add_argument('-i', '--input', action='append', default=[],
+                       help='第一列为BV号的csv文件，如BV号合并.csv或视频基本信息.csv，可多次指定')
+    refresh = commands.add_parser('refresh', help='采集已到采集时间的视频的统计数据')
+    refresh.add_argument('-n', '--limit', type=int, help='本次最多采集的视频数')
+    refresh.add_argument('--all', action='store_true', help='忽略采集时间，采集全部仍在跟踪的视频')
+    refresh.add_argument('--forever', action='store_true', help='常驻运行，持续采集到期的视频')
+    export = commands.add_parser('export', help='把时间序列导出为csv')
+    export.add_argument('-o', '--output', default='视频统计历史.csv', help='输出的csv文件')
+    export.add_argument('--days', type=float, help='只导出最近若干天的采集')
+    commands.add_parser('summary', help='显示跟踪的视频数与采集记录数')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    tracker = StatsTracker(args.db, concurrency=args.concurrency)
+    exporter = MetricsExporter(path=args.metrics_file).start()
+    try:
+        if args.command == 'track':
+            def bvids():
+                yield from args.bvids
+                for path in args.input:
+                    for chunk in iter_bvids(path):
+                        yield from chunk
+
+            added, failed = tracker.track(bvids())
+            print(f'新登记{added}个视频，失败{failed}个')
+        elif args.command == 'refresh':
+            if args.forever:
+                tracker.run_forever()
+            else:
+                counts = tracker.refresh(limit=args.limit, force=args.all)
+                print(f"采集{counts['polled']}个，失败{counts['failed']}个，已删除{counts['gone']}个")
+        elif args.command == 'export':
+            since = time.time() - args.days * DAY if args.days else None
+            print(f'导出{tracker.export_history(args.output, since)}条记录到{args.output}')
+        print(f'跟踪状态：{tracker.summary()}')
+    finally:
+        exporter.stop()
+        tracker.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import html
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 视频清晰度代号，数值越大清晰度越高
+QUALITY_NAMES = {
+    127: '8K', 126: '杜比视界', 125: 'HDR', 120: '4K', 116: '1080P60', 112: '1080P+', 80: '1080P',
+    74: '720P60', 64: '720P', 32: '480P', 16: '360P', 6: '240P'
+}
+# 视频编码代号
+CODEC_IDS = {'avc': 7, 'hevc': 12, 'av1': 13}
+
+_PLAYINFO_MARKER = 'window.__playinfo__='
+_OG_TITLE_PATTERN = re.compile(r'<meta[^>]*?property="og:title"[^>]*?content="([^"]*)"'
+                               r'|<meta[^>]*?content="([^"]*)"[^>]*?property="og:title"')
+_decoder = json.JSONDecoder()
+
+def extract_title(page):
+    """
+    只扫描og:title所在的meta标签，不解析整个页面
+    :param page: 视频页面的HTML
+    :return: 视频标题，找不到时返回None
+    """
+    match = _OG_TITLE_PATTERN.search(page)
+    if not match:
+        return None
+    return html.unescape(match.group(1) if match.group(1) is not None else match.group(2))
+
+def extract_playinfo(page):
+    """
+    定位window.__playinfo__后直接从该位置解码一个JSON对象，不需要正则匹配整段脚本
+    :param page: 视频页面的HTML
+    :return: 播放信息字典，找不到时返回None
+    """
+    start = page.find(_PLAYINFO_MARKER)
+    if start < 0:
+        return None
+    play_info, _ = _decoder.raw_decode(page, start + len(_PLAYINFO_MARKER))
+    return play_info
+
+def stream_urls(stream):
+    """
+    :param stream: dash中的一路视频或音频
+    :return: 主地址在前、备用地址在后的地址列表
+    """
+    urls = [stream.get('baseUrl') or stream.get('base_url')]
+    urls.extend(stream.get('backupUrl') or stream.get('backup_url') or [])
+    return [url for url in dict.fromkeys(urls) if url]
+
+def describe(stream):
+    # 用于日志输出的简短描述
+    if 'codecid' in stream:
+        quality = QUALITY_NAMES.get(stream.get('id'), stream.get('id'))
+        return f"{quality} {stream.get('codecs', '')} {stream.get('bandwidth', 0) // 1000}kbps"
+    return f"{stream.get('codecs', '')} {stream.get('bandwidth', 0) // 1000}kbps".strip()
+
+class StreamSelector:
+    """
+    按清晰度、编码与码率从dash的多路视频、音频中选择要下载的一路
+    """
+    def __init__(self, max_quality=None, min_quality=None, codecs=('avc', 'hevc', 'av1'), prefer='best'):
+        """
+        :param max_quality: 最高清晰度代号，如80表示不超过1080P，为None时不限
+        :param min_quality: 最低清晰度代号，达不到时仍选择可用的最高清晰度
+        :param codecs: 可接受的编码，按优先顺序排列，可选'avc'、'hevc'、'av1'
+        :param prefer: 'best'选择清晰度最高、码率最高的一路；'smallest'选择满足清晰度要求且码率最低的一路
+        """
+        if prefer not in ('best', 'smallest'):
+            raise ValueError(f'不支持的选择方式：{prefer}')
+        unknown = [codec for codec in codecs if codec not in CODEC_IDS]
+        if unknown:
+            raise ValueError(f'不支持的编码：{unknown}')
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+        self.codec_rank = {CODEC_IDS[codec]: i for i, codec in enumerate(codecs)}
+        self.prefer = prefer
+
+    def select_video(self, videos):
+        """
+        :param videos: dash['video']列表
+        :return: 选中的一路视频
+        """
+        if not videos:
+            raise ValueError('没有可用的视频流')
+        candidates = [video for video in videos if video.get('codecid') in self.codec_rank] or list(videos)
+        if self.max_quality is not None:
+            candidates = ([video for video in candidates if video.get('id', 0) <= self.max_quality]
+                          or [min(candidates, key=lambda video: video.get('id', 0))])
+        if self.min_quality is not None:
+            qualified = [video for video in candidates if video.get('id', 0) >= self.min_quality]
+            if qualified:
+                candidates = qualified
+            else:
+                top = max(video.get('id', 0) for video in candidates)
+                candidates = [video for video in candidates if video.get('id', 0) == top]
+
+        def rank(video):
+            return self.codec_rank.get(video.get('codecid'), len(self.codec_rank))
+
+        if self.prefer == 'smallest':
+            return min(candidates, key=lambda video: (video.get('bandwidth', 0), rank(video)))
+        return min(candidates, key=lambda video: (-video.get('id', 0), rank(video), -video.get('bandwidth', 0)))
+
+    def select_audio(self, audios):
+        """
+        :param audios: dash['audio']列表
+        :return: 选中的一路音频
+        """
+        if not audios:
+            raise ValueError('没有可用的音频流')
+        if self.prefer == 'smallest':
+            return min(audios, key=lambda audio: audio.get('bandwidth', 0))
+        return max(audios, key=lambda audio: audio.get('bandwidth', 0))
+
+    def select(self, dash):
+        """
+        :param dash: 播放信息中的dash字典
+        :return: (视频地址列表, 音频地址列表)，每个列表主地址在前、备用地址在后
+        """
+        video = self.select_video(dash.get('video') or [])
+        audio = self.select_audio(dash.get('audio') or [])
+        logger.info('选择视频流：%s，音频流：%s', describe(video), describe(audio))
+        return stream_urls(video), stream_urls(audio)
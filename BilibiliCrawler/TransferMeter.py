@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import deque
+
+class TransferMeter:
+    """
+    记录下载进度并计算最近一段时间内的平均速度与剩余时间
+    update可以在下载线程中频繁调用，只做简单的赋值与定期采样；界面在主线程中按固定频率读取
+    """
+    def __init__(self, window=5.0, sample_interval=0.25):
+        """
+        :param window: 计算速度所用的时间窗口(秒)
+        :param sample_interval: 两次采样之间的最短间隔(秒)
+        """
+        self.window = window
+        self.sample_interval = sample_interval
+        self.downloaded = 0
+        self.total = 0
+        self.samples = deque()
+        self.lock = threading.Lock()
+
+    def update(self, downloaded, total):
+        now = time.monotonic()
+        with self.lock:
+            # 多个线程上报的进度可能乱序到达，比已记录的小的值是过时的，直接丢弃，不影响速度窗口
+            if downloaded < self.downloaded:
+                return
+            self.downloaded = downloaded
+            self.total = total
+            if self.samples and now - self.samples[-1][0] < self.sample_interval:
+                return
+            self.samples.append((now, downloaded))
+            while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+
+    def reset(self):
+        # 重新开始计量，下次update的进度作为起点，断点续传时已下载的字节数不计入速度
+        with self.lock:
+            self.samples.clear()
+            self.downloaded = 0
+
+    def rate(self):
+        """
+        :return: 最近window秒内的平均速度(字节/秒)，长时间没有进度时逐渐降为0
+        """
+        with self.lock:
+            if not self.samples:
+                return 0.0
+            start_time, start_bytes = self.samples[0]
+            downloaded = self.downloaded
+        elapsed = time.monotonic() - start_time
+        if elapsed <= 0:
+            return 0.0
+        return max(0.0, (downloaded - start_bytes) / elapsed)
+
+    def eta(self):
+        """
+        :return: 预计剩余秒数，速度为0或总大小未知时返回None
+        """
+        rate = self.rate()
+        if not rate or not self.total:
+            return None
+        return max(0.0, (self.total - self.downloaded) / rate)
+
+def format_size(size):
+    # 把字节数格式化为便于阅读的字符串
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+def format_eta(seconds):
+    # 把剩余秒数格式化为时:分:秒，未知时返回--:--
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes:02d}:{seconds:02d}'
@@ -1,85 +1,153 @@
 import os
 import csv
+import logging
 import re
-import time
-import json
 import math
-import requests
-import numpy as np
-import pandas as pd
 from datetime import datetime
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
+from RateLimiter import default_limiter, limited_get_json
+from ResponseCache import default_cache
+from CsvSink import BufferedCsvWriter
+from OutputBackend import open_video_output
+from CrawlState import CrawlState
+from BvidDedup import SeenSet, iter_bvids
+from Instrumentation import default_metrics, configure_logging, MetricsExporter
 
-def merge_csv(input_filename, output_filename):
+logger = logging.getLogger(__name__)
+
+# B站视频信息与UP主信息接口
+VIEW_API_URL = 'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
+CARD_API_URL = 'https://api.bilibili.com/x/web-interface/card?mid={mid}'
+# 设置用户代理 User_Agent及Cookies
+HEADERS = {
+    'User-Agent': "",
+    'Cookie': ""}
+# 输出文件的表头
+BVID_FIELDNAMES = ['BV号']
+VIDEO_INFO_FIELDNAMES = ['BV号', 'AV号', 'CID', 'UP主ID', 'UP主名称', 'UP主粉丝数', '作品总数', '视频标题',
+                         '视频分类标签', '发布日期', '发布时间', '视频简介', '播放量', '点赞数', '投币数', '收藏数',
+                         '分享数', '评论数', '弹幕数', '传播效果指数']
+# 传播效果指数 = ln(0.5×播放量 + 0.3×(点赞数+投币数+收藏数) + 0.2×(评论数+弹幕数))，Analytics中的批量计算使用同一组权重
+COMMUNICATION_INDEX_WEIGHTS = {'播放量': 0.5, '点赞数': 0.3, '投币数': 0.3, '收藏数': 0.3, '评论数': 0.2, '弹幕数': 0.2}
+
+def merge_csv(input_filename, output_filename, seen=None):
     """
-    读取csv文件内容，并写入新的文件
+    流式读取BV号csv文件，只把此前未出现过的BV号写入新的文件，内存占用与文件大小无关
     :param input_filename: 传入的文件名称
     :param output_filename: 写入的新文件的名称
-    :return: 向新文件中写入input_filename中的内容
+    :param seen: 用于去重的SeenSet，多个文件、多次运行之间共享；为None时使用默认的seen_bvid.sqlite
+    :return: 写入的新BV号数量
     """
-    # 读取文件
-    csv_data_read = pd.read_csv(input_filename)
-    # 获取文件总行数
-    number_of_row = len(csv_data_read)
-    # 循环该csv文件中的所有行，并写入信息
-    with open(output_filename, mode='a', encoding='utf-8', newline='')  as csvfile:
-        fieldnames = ['BV号']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-        if csvfile.tell() == 0:
-            writer.writeheader()
-
-        for i in range(number_of_row):
-            row_content = csv_data_read.iloc[i, 0]
-            writer.writerow({'BV号': row_content})
+    own_seen = seen is None
+    if own_seen:
+        seen = SeenSet()
+    written = 0
+    with BufferedCsvWriter(output_filename, BVID_FIELDNAMES, batch_size=1000) as sink:
+        for chunk in iter_bvids(input_filename):
+            # 先把新的BV号写入文件再记入去重集合，中途中断时未写入的BV号下次仍会被合并
+            new = seen.new_bvids(chunk)
+            for bvid in new:
+                sink.writerow({'BV号': bvid})
+            sink.flush()
+            seen.add_many(new)
+            written += len(new)
+    if own_seen:
+        seen.close()
 
     # 打印进度
-    print(f'成功向{output_filename}中写入了{input_filename}的全部信息')
+    logger.info('成功向%s中写入了%s中的%s个新BV号', output_filename, input_filename, written)
+    return written
+
+def merge_bvid_files(input_filenames, output_filename, seen_path='seen_bvid.sqlite'):
+    """
+    把多个关键词的BV号文件合并为一个去重的文件
+    :param input_filenames: 传入的文件名称列表
+    :param output_filename: 写入的新文件的名称
+    :param seen_path: 去重集合的SQLite文件，保留在磁盘上，下次运行时已合并过的BV号不会再次写入
+    :return: 写入的新BV号总数
+    """
+    seen = SeenSet(seen_path)
+    try:
+        return sum(merge_csv(filename, output_filename, seen=seen) for filename in input_filenames)
+    finally:
+        seen.close()
 
-def write_to_csv_bvid(input_filename, bvid):
+def write_to_csv_bvid(input_filename, bvid, sink=None):
     """
     写入新的csv文件，若没有则创建，须根据不同程序进行修改
     :param input_filename: 写入的文件名称
     :param bvid: BV号
+    :param sink: 已打开的BufferedCsvWriter，传入时只缓存这一行，由sink批量写入
     :return: 生成写入的input_filename文件
     """
-    # 判断路径是否存在
-    file_exists = os.path.isfile(input_filename)
-    # 设置最大尝试次数
-    max_retries = 50
-    retries = 0
-
-    while retries < max_retries:
-        try:
-            with open(input_filename, mode='a', encoding='utf-8', newline='')  as csvfile:
-                fieldnames = ['BV号']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                if not file_exists:
-                    writer.writeheader()
-
-                writer.writerow({'BV号': bvid})
-            break  # 如果成功写入，跳出循环
-        except PermissionError as e:
-            retries += 1
-            print(f"将爬取到的数据写入csv时，遇到权限错误Permission denied，文件可能被占用或无写入权限: {e}")
-            print(f"等待3s后重试，将会重试50次... (尝试 {retries}/{max_retries})")
-            time.sleep(3)  # 等待3秒后重试
-    else:
-        print("将爬取到的数据写入csv时遇到权限错误，且已达到最大重试次数50次，退出程序")
-
-def spider_bvid(keyword):
+    if sink is not None:
+        sink.writerow({'BV号': bvid})
+        return
+    with BufferedCsvWriter(input_filename, BVID_FIELDNAMES, batch_size=1) as sink:
+        sink.writerow({'BV号': bvid})
+
+def spider_bvid(keyword, state=None, concurrency=4):
+    """
+    直接请求搜索接口获取搜索结果的bvid，供给后续程序使用，接口不可用时改用selenium
+    :param keyword: 搜索关键词
+    :param state: CrawlState，传入时跳过已完成的搜索页，中断后可从未完成的页继续
+    :param concurrency: 同时请求的页数
+    :return: 生成去重的output_filename = f'{keyword}BV号.csv'
+    """
+    # 保存的文件名
+    input_filename = f'{keyword}BV号.csv'
+    done_pages = state.done_pages(keyword) if state is not None else set()
+    # 续爬时读取已写入的BV号，保证整个关键词的结果不重复
+    seen = set()
+    if os.path.isfile(input_filename):
+        with open(input_filename, encoding='utf-8', newline='') as csvfile:
+            seen.update(row['BV号'] for row in csv.DictReader(csvfile))
+
+    try:
+        from SearchCollector import SearchCollector
+        collector = SearchCollector(concurrency=concurrency, headers={'Cookie': HEADERS.get('Cookie')})
+        with BufferedCsvWriter(input_filename, BVID_FIELDNAMES, batch_size=100) as sink:
+            for i, bv_id_list in collector.iter_pages(keyword, skip_pages=done_pages):
+                for bvid in bv_id_list:
+                    if bvid not in seen:
+                        seen.add(bvid)
+                        write_to_csv_bvid(input_filename, bvid, sink=sink)
+                # 本页的BV号写入文件后再记录进度
+                sink.flush()
+                if state is not None:
+                    state.mark_page_done(keyword, i)
+                logger.info('===========成功获取%s的第%s页搜索结果===========', keyword, i + 1)
+    except Exception as e:
+        logger.warning('搜索接口获取失败：%s，改用selenium继续获取剩余页', e)
+        spider_bvid_selenium(keyword, state=state)
+        return
+    logger.info('==========%s的搜索结果获取完成==========', keyword)
+
+def spider_bvid_selenium(keyword, state=None):
     """
-    利用selenium获取搜索结果的bvid，供给后续程序使用
+    利用selenium获取搜索结果的bvid，作为搜索接口不可用时的备用方案
     :param keyword: 搜索关键词
+    :param state: CrawlState，传入时跳过已完成的搜索页，中断后可从未完成的页继续
     :return: 生成去重的output_filename = f'{keyword}BV号.csv'
     """
     # 保存的文件名
     input_filename = f'{keyword}BV号.csv'
 
+    # B站最多显示42页
+    total_page = 42
+    done_pages = state.done_pages(keyword) if state is not None else set()
+    if len(done_pages) >= total_page:
+        logger.info('==========%s的%s页搜索结果均已获取，跳过==========', keyword, total_page)
+        return
+
+    # selenium与bs4只在搜索接口不可用时才需要，延迟到这里导入，导入本模块的命令行与其他模块不必加载它们
+    from bs4 import BeautifulSoup
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+
     # 启动爬虫
     options = Options()
     options.add_argument('--headless')
@@ -89,58 +157,69 @@ def spider_bvid(keyword):
     browser.get('https://bilibili.com')
     # 刷新一下，防止搜索button被登录弹框遮住
     browser.refresh()
-    print("============成功进入B站首页！！！===========")
+    logger.info('============成功进入B站首页！！！===========')
 
     # 输入关键词并点击搜索
     input = browser.find_element(By.CLASS_NAME, 'nav-search-input')
     button = browser.find_element(By.CLASS_NAME, 'nav-search-btn')
     input.send_keys(keyword)
     button.click()
-    print(f'==========成功搜索{keyword}相关内容==========')
+    logger.info('==========成功搜索%s相关内容==========', keyword)
 
     # 设置窗口
     all_h = browser.window_handles
     browser.switch_to.window(all_h[1])
 
-    # B站最多显示42页
-    total_page = 42
-
-    for i in range(total_page):
-        url = f"https://search.bilibili.com/all?keyword={keyword}&from_source=webtop_search&spm_id_from=333.1007&search_source=5&page={i}"
-        print(f"===========正在尝试获取第{i + 1}页网页内容===========")
-        print(f"===========本次的url为：{url}===========")
-        browser.get(url)
-        print('正在等待页面加载...')
-        time.sleep(3)
+    # 整个搜索过程只打开一次文件，每页的结果批量写入
+    with BufferedCsvWriter(input_filename, BVID_FIELDNAMES, batch_size=100) as sink:
+        for i in range(total_page):
+            if i in done_pages:
+                continue
+            url = f"https://search.bilibili.com/all?keyword={keyword}&from_source=webtop_search&spm_id_from=333.1007&search_source=5&page={i}"
+            logger.debug('===========正在尝试获取第%s页网页内容===========', i + 1)
+            logger.debug('===========本次的url为：%s===========', url)
+            default_limiter.acquire(url)
+            browser.get(url)
+            logger.debug('正在等待页面加载...')
+            # 等待视频卡片出现而不是固定等待3s，超时说明页面为空或被限流
+            try:
+                WebDriverWait(browser, 10).until(EC.presence_of_element_located((By.CLASS_NAME, 'bili-video-card')))
+                default_limiter.feedback(url, 200)
+            except TimeoutException:
+                default_limiter.feedback(url, 412)
 
-        # 直接分析网页
-        html = browser.page_source
-        soup = BeautifulSoup(html, 'lxml')
-        infos = soup.find_all(class_='bili-video-card')
-        bv_id_list = []
+            # 直接分析网页
+            html = browser.page_source
+            bv_id_list = []
+            with default_metrics.span('html_parse', page='search'):
+                soup = BeautifulSoup(html, 'lxml')
+                infos = soup.find_all(class_='bili-video-card')
 
-        for info in infos:
-            href = info.find('a').get('href')
-            split_url_data = href.split('/')
-            split_url_data = [element for element in split_url_data if element != '']
-            bvid = split_url_data[2]
+                for info in infos:
+                    href = info.find('a').get('href')
+                    split_url_data = href.split('/')
+                    split_url_data = [element for element in split_url_data if element != '']
+                    bvid = split_url_data[2]
 
-            if bvid not in bv_id_list:
-                bv_id_list.append(bvid)
+                    if bvid not in bv_id_list:
+                        bv_id_list.append(bvid)
 
-        for bvid_index in range(len(bv_id_list)):
-            write_to_csv_bvid(input_filename, bv_id_list[bvid_index])
+            for bvid_index in range(len(bv_id_list)):
+                write_to_csv_bvid(input_filename, bv_id_list[bvid_index], sink=sink)
+            # 本页的BV号写入文件后再记录进度
+            sink.flush()
+            if state is not None:
+                state.mark_page_done(keyword, i)
 
-        print('写入文件成功')
-        print("===========成功获取第" + str(i + 1) + "次===========")
-        time.sleep(1)
+            logger.debug('写入文件成功')
+            logger.info('===========成功获取第%s次===========', i + 1)
 
     # 退出爬虫
     browser.quit()
-    print(f'==========爬取完成。退出爬虫==========')
+    logger.info('==========爬取完成。退出爬虫==========')
 
 def write_to_csv(filename, bvid, aid, cid, mid, name, follower, archive, title, tname, pub_date, pub_time, desc,
-                 view, like, coin, favorite, share, reply, danmaku, communication_index):
+                 view, like, coin, favorite, share, reply, danmaku, communication_index, sink=None):
     """
     向csv文件中写入B站视频相关的基本信息，若未找到文件，则新建文件
     :param filename: 写入数据的文件名
@@ -164,40 +243,76 @@ def write_to_csv(filename, bvid, aid, cid, mid, name, follower, archive, title,
     :param reply: 评论数
     :param danmaku: 弹幕数
     :param communication_index: 传播效果公式的值
+    :param sink: 已打开的BufferedCsvWriter，传入时只缓存这一行，由sink批量写入
     :return:
     """
-    file_exists = os.path.isfile(filename)
-    max_retries = 50
-    retries = 0
-
-    while retries < max_retries:
-        try:
-            with open(filename, mode='a', encoding='utf-8', newline='') as csvfile:
-                fieldnames = ['BV号', 'AV号', 'CID', 'UP主ID', 'UP主名称', 'UP主粉丝数', '作品总数', '视频标题',
-                              '视频分类标签',
-                              '发布日期', '发布时间', '视频简介', '播放量', '点赞数', '投币数', '收藏数', '分享数',
-                              '评论数',
-                              '弹幕数', '传播效果指数']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                if not file_exists:
-                    writer.writeheader()
-
-                writer.writerow({
-                    'BV号': bvid, 'AV号': aid, 'CID': cid, 'UP主ID': mid, 'UP主名称': name, 'UP主粉丝数': follower,
-                    '作品总数': archive, '视频标题': title, '视频分类标签': tname, '发布日期': pub_date,
-                    '发布时间': pub_time,
-                    '视频简介': desc, '播放量': view, '点赞数': like, '投币数': coin, '收藏数': favorite,
-                    '分享数': share,
-                    '评论数': reply, '弹幕数': danmaku, '传播效果指数': communication_index
-                })
-            break  # 如果成功写入，跳出循环
-        except PermissionError as e:
-            retries += 1
-            print(f"将爬取到的数据写入csv时，遇到权限错误Permission denied，文件可能被占用或无写入权限: {e}")
-            print(f"等待3s后重试，将会重试50次... (尝试 {retries}/{max_retries})")
-    else:
-        print("将爬取到的数据写入csv时遇到权限错误，且已达到最大重试次数50次，退出程序")
+    row = {
+        'BV号': bvid, 'AV号': aid, 'CID': cid, 'UP主ID': mid, 'UP主名称': name, 'UP主粉丝数': follower,
+        '作品总数': archive, '视频标题': title, '视频分类标签': tname, '发布日期': pub_date, '发布时间': pub_time,
+        '视频简介': desc, '播放量': view, '点赞数': like, '投币数': coin, '收藏数': favorite, '分享数': share,
+        '评论数': reply, '弹幕数': danmaku, '传播效果指数': communication_index
+    }
+    if sink is not None:
+        sink.writerow(row)
+        return
+    with BufferedCsvWriter(filename, VIDEO_INFO_FIELDNAMES, batch_size=1) as sink:
+        sink.writerow(row)
+
+def compute_communication_index(row):
+    """
+    计算一行数据的传播效果指数，加权和为0(没有任何播放与互动)时记为0，不会因对0取对数而出错
+    :param row: 以VIDEO_INFO_FIELDNAMES为键的字典
+    :return: float
+    """
+    total = sum(weight * int(row[name]) for name, weight in COMMUNICATION_INDEX_WEIGHTS.items())
+    return math.log(total) if total > 0 else 0.0
+
+def build_video_row(video_info, user_info):
+    """
+    由get_video_info与get_user_info的结果生成一行视频基本信息，并计算传播效果指数
+    :param video_info: info_dict
+    :param user_info: user_info_dict
+    :return: 以VIDEO_INFO_FIELDNAMES为键的字典
+    """
+    view = video_info['view']
+    like = video_info['like']
+    coin = video_info['coin']
+    favorite = video_info['favorite']
+    reply = video_info['reply']
+    danmaku = video_info['danmaku']
+    row = {
+        'BV号': video_info['bvid'], 'AV号': video_info['aid'], 'CID': video_info['cid'],
+        'UP主ID': video_info['mid'], 'UP主名称': video_info['name'], 'UP主粉丝数': user_info['follower'],
+        '作品总数': user_info['archive'], '视频标题': video_info['title'], '视频分类标签': video_info['tname'],
+        '发布日期': video_info['pub_date'], '发布时间': video_info['pub_time'], '视频简介': video_info['desc'],
+        '播放量': view, '点赞数': like, '投币数': coin, '收藏数': favorite, '分享数': video_info['share'],
+        '评论数': reply, '弹幕数': danmaku, '传播效果指数': None
+    }
+    row['传播效果指数'] = compute_communication_index(row)
+    return row
+
+def fetch_api_json(api_url, cache=None, **kwargs):
+    """
+    请求view/card等json接口，优先读取缓存，未命中时经过限速器请求网络
+    :param api_url: 接口url
+    :param cache: 响应缓存，为None时使用ResponseCache.default_cache
+    :param kwargs: 传给limited_get_json的其他参数，如session、limiter、timeout
+    :return: 接口返回的json字典
+    """
+    cache = cache or default_cache
+    kwargs.setdefault('headers', HEADERS)
+    return cache.get_or_fetch(api_url, lambda: limited_get_json(api_url, **kwargs))
+
+def parse_user_info(up_info_json):
+    """
+    从card接口返回的json中解析UP主的粉丝总数和作品总数
+    :param up_info_json: card接口返回的json字典
+    :return: user_info_dict
+    """
+    user_info_dict = {}
+    user_info_dict['follower'] = up_info_json['data']['card']['fans']
+    user_info_dict['archive'] = up_info_json['data']['archive_count']
+    return user_info_dict
 
 def get_user_info(uid):
     """
@@ -205,122 +320,86 @@ def get_user_info(uid):
     :param uid: mid
     :return:user_info_dict
     """
-    # 定义空字典用于存放数据
-    user_info_dict = {}
-    # 设置用户代理 User_Agent及Cookies
-    headers = {
-        'User-Agent': "",
-        'Cookie': ""}
-    api_url = f'https://api.bilibili.com/x/web-interface/card?mid={uid}'
-    print(f"正在进行爬取uid为：{uid}的UP主的粉丝数量与作品总数")
-    print(f"==========本次获取数据的up主的uid为：{uid}==========")
-    print(f"url为{api_url}")
-    up_info = requests.get(url=api_url, headers=headers)
-    up_info_json = json.loads(up_info.text)
-    fans_number = up_info_json['data']['card']['fans']
-    user_info_dict['follower'] = fans_number
-    archive_count = up_info_json['data']['archive_count']
-    user_info_dict['archive'] = archive_count
-    print(f'=========={bv_id} 的作者基本信息已成功获取==========\n')
-    time.sleep(1.5)
+    api_url = CARD_API_URL.format(mid=uid)
+    logger.debug('正在进行爬取uid为：%s的UP主的粉丝数量与作品总数', uid)
+    logger.debug('==========本次获取数据的up主的uid为：%s==========', uid)
+    logger.debug('url为%s', api_url)
+    # 同一个UP主在本次运行中只请求一次，请求频率由共享的限速器控制
+    up_info_json = fetch_api_json(api_url)
+    user_info_dict = parse_user_info(up_info_json)
+    logger.info('==========%s 的作者基本信息已成功获取==========\n', uid)
     return user_info_dict
 
-def get_video_info(bv_id):
-    headers = {
-        'User-Agent': "",
-        'Cookie': ""}
-    api_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bv_id}'
-    print(f"正在进行爬取uid为：{bv_id}的UP主的粉丝数量与作品总数")
-    print(f"==========本次获取数据的视频BV号为：{bv_id}==========")
-    print(f"url为：{api_url}")
-    video_info = requests.get(url=api_url, headers=headers)
-    video_info_json = json.loads(video_info.text)
+def parse_video_info(video_info_json):
+    """
+    从view接口返回的json中解析视频的基本信息
+    :param video_info_json: view接口返回的json字典
+    :return: info_dict
+    """
+    data = video_info_json['data']
     info_dict = {}
     # 信息解读
-    bvid = video_info_json['data']['bvid']
-    info_dict['bvid'] = bvid
-    aid = video_info_json['data']['aid']
-    info_dict['aid'] = aid
-    cid = video_info_json['data']['cid']
-    info_dict['cid'] = cid
-    mid = video_info_json['data']['owner']['mid']
-    info_dict['mid'] = mid
-    name = video_info_json['data']['owner']['name']
-    info_dict['name'] = name
-    title = video_info_json['data']['title']
-    info_dict['title'] = title
-    tname = video_info_json['data']['tname']
-    info_dict['tname'] = tname
-    pubdate = video_info_json['data']['pubdate']
-    pub_datatime = datetime.fromtimestamp(pubdate)
+    info_dict['bvid'] = data['bvid']
+    info_dict['aid'] = data['aid']
+    info_dict['cid'] = data['cid']
+    info_dict['mid'] = data['owner']['mid']
+    info_dict['name'] = data['owner']['name']
+    info_dict['title'] = data['title']
+    info_dict['tname'] = data['tname']
+    pub_datatime = datetime.fromtimestamp(data['pubdate'])
     pub_datatime_strf = pub_datatime.strftime('%Y-%m-%d %H:%M:%S')
     date = re.search(r"(\d{4}-\d{1,2}-\d{1,2})", pub_datatime_strf)
     info_dict['pub_date'] = date.group()
     pub_time = re.search(r"(\d{1,2}:\d{1,2}:\d{1,2})", pub_datatime_strf)
     info_dict['pub_time'] = pub_time.group()
-    desc = video_info_json['data']['desc']
-    info_dict['desc'] = desc
-    view = video_info_json['data']['stat']['view']
-    info_dict['view'] = view
-    like = video_info_json['data']['stat']['like']
-    info_dict['like'] = like
-    coin = video_info_json['data']['stat']['coin']
-    info_dict['coin'] = coin
-    favorite = video_info_json['data']['stat']['favorite']
-    info_dict['favorite'] = favorite
-    share = video_info_json['data']['stat']['share']
-    info_dict['share'] = share
-    repiy = video_info_json['data']['stat']['reply']
-    info_dict['reply'] = repiy
-    danmaku = video_info_json['data']['stat']['danmaku']
-    info_dict['danmaku'] = danmaku
-    print(f'=========={bv_id} 的视频基本信息已成功获取==========')
-    print('正在等待，以防访问过于频繁\n')
-    time.sleep(1.5)
+    info_dict['desc'] = data['desc']
+    stat = data['stat']
+    info_dict['view'] = stat['view']
+    info_dict['like'] = stat['like']
+    info_dict['coin'] = stat['coin']
+    info_dict['favorite'] = stat['favorite']
+    info_dict['share'] = stat['share']
+    info_dict['reply'] = stat['reply']
+    info_dict['danmaku'] = stat['danmaku']
+    return info_dict
+
+def get_video_info(bv_id):
+    """
+    通过BV号获取视频的基本信息
+    :param bv_id: BV号
+    :return: info_dict
+    """
+    api_url = VIEW_API_URL.format(bvid=bv_id)
+    logger.debug('正在进行爬取BV号为：%s的视频基本信息', bv_id)
+    logger.debug('==========本次获取数据的视频BV号为：%s==========', bv_id)
+    logger.debug('url为：%s', api_url)
+    # 优先读取缓存，请求频率由共享的限速器控制
+    video_info_json = fetch_api_json(api_url)
+    info_dict = parse_video_info(video_info_json)
+    logger.info('==========%s 的视频基本信息已成功获取==========\n', bv_id)
     return info_dict
 
 if __name__ == '__main__':
     keywords = ["暗区突围"]
-    for keyword in keywords:
-        spider_bvid(keyword)
-    for keyword in keywords:
-        csv_to_merge = f'{keyword}BV号.csv'
-        merge_csv(input_filename=csv_to_merge, output_filename='BV号合并.csv')
-
-    filename = 'BV号合并.csv'
-    open_csv = pd.read_csv(filename)
-    open_csv.drop_duplicates(subset='BV号')
-    bv_id_list = np.array(open_csv['BV号'])
-
-    for i in range(len(bv_id_list)):
-        bv_id = bv_id_list[i]
-        print(f'正在进行第{i + 1}次爬取\n')
-        video_info = get_video_info(bv_id)
-        bvid = video_info['bvid']
-        aid = video_info['aid']
-        cid = video_info['cid']
-        mid = video_info['mid']
-        name = video_info['name']
-        title = video_info['title']
-        tname = video_info['tname']
-        pub_date = video_info['pub_date']
-        pub_time = video_info['pub_time']
-        desc = video_info['desc']
-        view = video_info['view']
-        like = video_info['like']
-        coin = video_info['coin']
-        favorite = video_info['favorite']
-        share = video_info['share']
-        reply = video_info['reply']
-        danmaku = video_info['danmaku']
-
-        Communication_Index = math.log(0.5 * int(view) + 0.3 * (int(like) + int(coin) + int(favorite)) + 0.2 * (int(reply) + int(danmaku)))
-        user_info = get_user_info(uid=mid)
-        follower = user_info['follower']
-        archive = user_info['archive']
-        write_to_csv(filename='视频基本信息.csv', bvid=bvid, aid=aid, cid=cid, mid=mid, name=name, follower=follower,
-                     archive=archive, title=title, tname=tname, pub_date=pub_date, pub_time=pub_time, desc=desc,
-                     view=view, like=like, coin=coin, favorite=favorite, share=share, reply=reply, danmaku=danmaku,
-                     communication_index=Communication_Index)
-        print(f'==========第{i + 1}个BV号：{bv_id}的相关数据已写入csv文件中==========')
-        print('==================================================\n')
+    # 日志详细程度：'debug'输出每个请求，'info'输出每行的进度，'warning'只输出失败与限流
+    configure_logging('info')
+    # 记录爬取进度，中断后重新运行只处理未完成的搜索页与BV号
+    state = CrawlState('crawl_state.sqlite')
+
+    from Pipeline import CrawlPipeline
+
+    # 输出格式可选'csv'、'parquet'或'arrow'，列式格式输出到名为视频基本信息的目录
+    output_format = 'csv'
+    # 每10秒把请求数、缓存命中与各阶段耗时追加到crawl_metrics.jsonl，
+    # 也可改用fmt='prometheus'写文本文件，或传入port在本地提供/metrics
+    exporter = MetricsExporter(path='crawl_metrics.jsonl', fmt='jsonl', interval=10)
+    # 整个爬取过程只打开一次输出，按批写入，每批写入文件后才把其中的BV号标记为已完成
+    with exporter, open_video_output('视频基本信息', VIDEO_INFO_FIELDNAMES, fmt=output_format,
+                                     on_flush=lambda rows: state.mark_done([row['BV号'] for row in rows])) as sink:
+        # 搜索、视频信息、UP主信息、写入四个阶段同时进行，请求频率由共享的限速器自适应控制
+        pipeline = CrawlPipeline(keywords, sink, state=state, search_workers=2, detail_workers=8, user_workers=4)
+        counts = pipeline.run()
+    print(f'共发现{counts["found"]}个待爬取的BV号，写入{counts["written"]}个，失败{counts["failed"]}个')
+    print(f'接口缓存统计：{default_cache.stats()}')
+    print(f'爬取进度：{state.summary()}')
+    state.close()